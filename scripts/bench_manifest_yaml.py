@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of manifest YAML parsing and emission, pure Python vs libyaml.
+
+Run it from a mirror directory against the checked out winget-pkgs
+manifests (or any directory of winget manifests):
+
+    python scripts/bench_manifest_yaml.py mirror/manifests --limit=5000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_manifest import load_manifest, dump_manifest  # noqa: E402
+
+def collect(manifests_dir, limit):
+    samples = []
+    for root, _, files in os.walk(manifests_dir):
+        for name in sorted(files):
+            if name.endswith('.yaml'):
+                samples.append((Path(root) / name).read_bytes())
+                if len(samples) >= limit:
+                    return samples
+    return samples
+
+def timed(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifests_dir', nargs='?', default='mirror/manifests')
+    parser.add_argument('--limit', type=int, default=2000, help='number of manifest files to sample')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the best is reported')
+    args = parser.parse_args()
+
+    samples = collect(args.manifests_dir, args.limit)
+    if not samples:
+        print(f"No .yaml files found under {args.manifests_dir}")
+        return 1
+    total_mb = sum(len(s) for s in samples) / 2**20
+    print(f"{len(samples)} manifests, {total_mb:.1f} MB")
+
+    if not hasattr(yaml, 'CSafeLoader'):
+        print("PyYAML was built without libyaml; only the pure-Python implementation is available")
+
+    cases = [('pure Python', yaml.SafeLoader, yaml.SafeDumper)]
+    if hasattr(yaml, 'CSafeLoader'):
+        cases.append(('libyaml', yaml.CSafeLoader, yaml.CSafeDumper))
+
+    documents = [load_manifest(s) for s in samples]
+    baseline = None
+    for label, loader, dumper in cases:
+        load_s = timed(lambda s: load_manifest(s, loader=loader), samples, args.repeat)
+        dump_s = timed(lambda d: dump_manifest(d, dumper=dumper), documents, args.repeat)
+        speedup = '' if baseline is None else f"  ({baseline / (load_s + dump_s):.1f}x faster load+dump)"
+        print(
+            f"{label:>12}: load {len(samples) / load_s:8.0f} files/s, "
+            f"dump {len(samples) / dump_s:8.0f} files/s{speedup}"
+        )
+        if baseline is None:
+            baseline = load_s + dump_s
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
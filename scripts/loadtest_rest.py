@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Load test of the winget REST source served by 'invoke serve'.
+
+Simulates many winget clients on keep-alive connections, mixing
+/information, /manifestSearch and /packageManifests requests; half of the
+manifest requests revalidate with If-None-Match like a client cache would:
+
+    python scripts/loadtest_rest.py http://localhost:8080/api --clients=64 --duration=30
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Client:
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.base_path = parts.path.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, self.base_path + path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+        return response.status, response.getheader('ETag'), data
+
+def package_ids(url, timeout):
+    """Return every package identifier the server knows, via an empty search."""
+    status, _, data = Client(url, timeout).request('POST', '/manifestSearch', {})
+    if status != 200:
+        return []
+    return [result['PackageIdentifier'] for result in json.loads(data)['Data']]
+
+def run_client(url, timeout, ids, deadline, results, lock):
+    client = Client(url, timeout)
+    etags = {}
+    latencies, errors, not_modified = [], 0, 0
+    while time.monotonic() < deadline:
+        roll = random.random()
+        package_id = random.choice(ids)
+        if roll < 0.1:
+            args = ('GET', '/information')
+        elif roll < 0.6:
+            keyword = package_id.split('.', 1)[-1][:random.randint(3, 8)]
+            args = ('POST', '/manifestSearch', {'Query': {'KeyWord': keyword, 'MatchType': 'Substring'}})
+        else:
+            headers = {}
+            if package_id in etags and random.random() < 0.5:
+                headers['If-None-Match'] = etags[package_id]
+            args = ('GET', '/packageManifests/' + quote(package_id), None, headers)
+
+        start = time.perf_counter()
+        try:
+            status, etag, _ = client.request(*args)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status == 304:
+            not_modified += 1
+        elif status >= 400:
+            errors += 1
+        elif etag and args[1].startswith('/packageManifests/'):
+            etags[package_id] = etag
+
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+        results['not_modified'] += not_modified
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', nargs='?', default='http://localhost:8080/api')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent keep-alive connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--timeout', type=float, default=10, help='per-request timeout in seconds')
+    args = parser.parse_args()
+
+    try:
+        ids = package_ids(args.url, args.timeout)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Cannot reach {args.url}: {e}")
+        return 1
+    if not ids:
+        print(f"No packages served at {args.url}")
+        return 1
+    print(f"{len(ids)} packages, {args.clients} clients, {args.duration:.0f}s")
+
+    results = {'latencies': [], 'errors': 0, 'not_modified': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=run_client, args=(args.url, args.timeout, ids, deadline, results, lock))
+        for _ in range(args.clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(results['latencies'])
+    print(f"{len(latencies)} requests, {len(latencies) / elapsed:.0f} req/s, "
+          f"{results['errors']} errors, {results['not_modified']} not modified")
+    print(f"latency p50 {percentile(latencies, 0.50) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    return 1 if results['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,9 +7,12 @@ from invoke import task
 # Add current directory to path for imports
 sys.path.insert(0, os.path.join(os.getcwd(), '..'))
 
+from pathlib import Path
+
 from winget_mirror_core import (
-    parse_version_safe, WingetMirrorManager
+    version_sort_key, WingetMirrorManager, PATCH_STATE_FILE
 )
+from winget_mirror_publish import list_generations, current_generation
 
 # Check Python version
 if sys.version_info < (3, 11):
@@ -33,7 +36,7 @@ def init(c, path):
     WingetMirrorManager.initialize(path)
 
 @task
-def sync(c, publisher, version=None):
+def sync(c, publisher, version=None, jobs=1, backend=None):
     """Download the latest version of packages matching the publisher/package filter from the already synced repository.
 
     Downloads the latest version of packages matching the publisher/package filter.
@@ -42,9 +45,13 @@ def sync(c, publisher, version=None):
 
     Args:
         publisher: Publisher filter, optionally with package filter and --version
+        jobs: Number of packages to download concurrently (default 1)
+        backend: 'threads' or 'async' (needs aiohttp); defaults to download.backend in config.json
 
     Example:
         invoke sync Microsoft
+        invoke sync Microsoft --jobs=16
+        invoke sync Microsoft --jobs=200 --backend=async
         invoke sync Splunk/ACS
         invoke sync Spotify/Spotify --version 1.2.3
     """
@@ -52,8 +59,9 @@ def sync(c, publisher, version=None):
     if manager.repo is None:
         print("Repository not found. Run 'invoke sync-repo' first.")
         return
-
-    processed_packages = set()
+    backend = manager.download_backend(backend)
+    if backend is None:
+        return
 
     # Parse publisher/package filter
     if "/" in publisher:
@@ -64,47 +72,57 @@ def sync(c, publisher, version=None):
 
     publishers = manager.get_matching_publishers(pub_filter)
 
-    manifests_dir = manager.mirror_dir / 'manifests'
-
+    targets = []
     for pub in publishers:
-        first_letter = pub[0].lower()
-        publisher_path = manifests_dir / first_letter / pub
-        for package_path in publisher_path.iterdir():
-            if not package_path.is_dir():
-                continue
-
-            # Filter by package name if specified
-            if pkg_filter and not package_path.name.lower().startswith(pkg_filter.lower()):
-                continue
+        # Filter by package name if specified
+        for package in manager.get_packages(pub, pkg_filter or ''):
+            targets.append((f'{pub}.{package}', version))   # pass version down
 
-            package_id = f'{pub}.{package_path.name}'
-            pkg = manager.get_package(package_id)
-            if pkg.download(version=version):   # pass version down
-                processed_packages.add(package_id)
+    processed_packages = manager.download_packages(targets, jobs=int(jobs), backend=backend)
 
     # Update state
     manager.state['last_sync'] = datetime.datetime.now().isoformat()
-    manager.save_state()
+    manager.save_state(package_ids={package_id for package_id, _ in targets})
 
     if publisher:
         print(f"Downloaded {len(processed_packages)} packages matching '{publisher}'")
 
 @task
-def refresh_synced(c):
+def refresh_synced(c, jobs=1, backend=None):
     """Refresh all synced packages to their latest versions.
 
     Checks each package in state.json for newer versions in the repository
     and downloads/updates them if available. Leaves pinned versions untouched.
     The repository must be synced first.
+
+    Only packages whose manifests changed since the previous refresh (and
+    packages that failed to update last time) are checked.
+
+    Args:
+        jobs: Number of packages to download concurrently (default 1)
+        backend: 'threads' or 'async' (needs aiohttp); defaults to download.backend in config.json
     """
     manager = WingetMirrorManager()
     if manager.repo is None:
         print("Repository not found. Run 'invoke sync-repo' first.")
         return
+    backend = manager.download_backend(backend)
+    if backend is None:
+        return
 
-    updated_packages = set()
+    targets = []
+    head = manager.repo.head.commit.hexsha
+    pending = set(manager.state.get('refresh_pending', []))
+    changes = manager.changed_versions(manager.state.get('last_refresh_rev'))
+    changed_packages = None
+    if changes is not None:
+        changed_packages = {package_id for package_id, _ in changes} | pending
+        print(f"{len(changes)} manifest version(s) changed since the last refresh")
 
     for package_id, package_info in manager.state.get('downloads', {}).items():
+        if changed_packages is not None and package_id not in changed_packages:
+            continue
+
         versions = package_info.get("versions", {})
         if not versions:
             continue
@@ -117,21 +135,24 @@ def refresh_synced(c):
             print(f"{package_id} has only pinned versions, skipping refresh")
             continue
 
-        current_version = max(non_pinned_versions, key=parse_version_safe)
+        current_version = max(non_pinned_versions, key=version_sort_key)
 
         pkg = manager.get_package(package_id)
         latest_version = pkg.get_latest_version()
 
-        if latest_version and parse_version_safe(latest_version) > parse_version_safe(current_version):
+        if latest_version and version_sort_key(latest_version) > version_sort_key(current_version):
             print(f"Updating {package_id} from {current_version} to {latest_version}")
-            if pkg.download(version=latest_version):
-                updated_packages.add(package_id)
+            targets.append((package_id, latest_version))
         else:
             print(f"{package_id} is up to date")
 
+    updated_packages = manager.download_packages(targets, jobs=int(jobs), backend=backend)
+
     # Update state
+    manager.state['last_refresh_rev'] = head
+    manager.state['refresh_pending'] = sorted({package_id for package_id, _ in targets} - updated_packages)
     manager.state['last_sync'] = datetime.datetime.now().isoformat()
-    manager.save_state()
+    manager.save_state(package_ids={package_id for package_id, _ in targets})
 
     print(f"Refreshed {len(updated_packages)} packages")
 
@@ -152,18 +173,26 @@ def sync_repo(c):
     manager.sync_repo()
 
 @task
-def validate_hash(c, output=None):
+def validate_hash(c, output=None, jobs=1, full=False, sample=None):
     """Validate SHA256 hashes of all downloaded files against stored checksums.
 
     Checks that all expected files exist and their hashes match the recorded values.
+    Files whose size, mtime and inode are unchanged since they last matched
+    are not re-hashed unless --full is given or they are picked by --sample.
     Exits with error code 1 if any validation fails.
 
     Args:
         output: Optional output format. Use 'json' for JSON output, otherwise human-readable text.
+        jobs: Number of files hashed in parallel (default 1)
+        full: Re-hash every file, ignoring the verification cache
+        sample: Percentage of unchanged files to re-hash anyway (e.g. '5%')
 
     Examples:
         invoke validate-hash
         invoke validate-hash --output=json
+        invoke validate-hash --jobs=8
+        invoke validate-hash --full
+        invoke validate-hash --sample=5%
     """
     manager = WingetMirrorManager()
 
@@ -174,17 +203,18 @@ def validate_hash(c, output=None):
             print("No downloaded packages found in state.json")
         return
 
-    results = {
-        "all_valid": True,
-        "packages": {}
-    }
+    sample_fraction = 0.0
+    if sample:
+        try:
+            sample_fraction = float(str(sample).rstrip('%')) / 100
+        except ValueError:
+            print(f"Error: Invalid --sample value '{sample}', expected a percentage like 5%")
+            sys.exit(1)
+        if not 0 <= sample_fraction <= 1:
+            print(f"Error: --sample must be between 0% and 100%, got '{sample}'")
+            sys.exit(1)
 
-    for package_id in manager.state['downloads']:
-        pkg = manager.get_package(package_id)
-        pkg_results = pkg.validate_hashes()
-        results["packages"][package_id] = pkg_results
-        if not pkg_results["valid"]:
-            results["all_valid"] = False
+    results = manager.validate_hashes(jobs=int(jobs), full=full, sample=sample_fraction)
 
     if output == 'json':
         print(json.dumps(results, indent=4))
@@ -204,9 +234,13 @@ def validate_hash(c, output=None):
 
                 for filename, file_data in vdata["files"].items():
                     status = file_data["status"]
+                    if file_data.get("cached"):
+                        status += " (unchanged since last validation)"
                     print(f"Validating {package_id}/{version}/{filename}: {status}")
                     print(f"  Tracked hash: {file_data['expected']}")
                     print(f"  Computed hash: {file_data['computed']}")
+                    if file_data.get("error"):
+                        print(f"  Error: {file_data['error']}")
 
                 for missing in vdata["missing_files"]:
                     print(f"Error: Expected file missing for {package_id} {version}: {missing}")
@@ -271,21 +305,23 @@ def purge_package(c, target, version=None):
         return
 
     purged_count = 0
-    for package_id in matching_packages:
-        pkg = manager.get_package(package_id)
-        if not pkg:
-            print(f"Warning: package object not found for {package_id}")
-            continue
+    with manager.batch_state():
+        for package_id in matching_packages:
+            pkg = manager.get_package(package_id)
+            if not pkg:
+                print(f"Warning: package object not found for {package_id}")
+                continue
 
-        # If a specific version was requested, purge only that version
-        if version:
-            if pkg.purge(version=version):
-                purged_count += 1
-        else:
-            # Purge all versions for this package
-            if pkg.purge():
-                # pkg.purge() should return True if it removed at least one version
-                purged_count += 1
+            # If a specific version was requested, purge only that version
+            if version:
+                if pkg.purge(version=version):
+                    purged_count += 1
+            else:
+                # Purge all versions for this package
+                if pkg.purge():
+                    # pkg.purge() should return True if it removed at least one version
+                    purged_count += 1
+    manager.collect_garbage()
 
     print(f"Successfully purged {purged_count} version(s)")
 
@@ -321,19 +357,35 @@ def purge_all_packages(c):
 
     # Purge all
     purged_count = 0
-    for package_id in package_ids:
-        pkg = manager.get_package(package_id)
-        if pkg.purge():
-            purged_count += 1
+    with manager.batch_state():
+        for package_id in package_ids:
+            pkg = manager.get_package(package_id)
+            if pkg.purge():
+                purged_count += 1
+    manager.collect_garbage()
 
     print(f"Successfully purged {purged_count} package(s)")
 
 @task
-def search(c, target):
-    """Search for packages matching publisher or publisher/package.
+def search(c, target, output=None, limit=50):
+    """Search for packages by identifier, name, moniker, tag or description.
+
+    Matches are found across all publishers through the manifest index and
+    ranked: whole-word matches first, then prefixes, substrings and, when
+    nothing else matches, similar spellings. 'Publisher/Package' looks up
+    that exact package instead. Each match is listed with its download
+    status and versions.
+
+    Args:
+        target: Search terms, or publisher/package for an exact lookup
+        output: Optional output format. Use 'json' for JSON output, otherwise a table.
+        limit: Maximum number of packages to list (default 50)
 
-    Lists all packages from the repository matching the filter,
-    along with their download status and versions.
+    Examples:
+        invoke search firefox
+        invoke search "text editor"
+        invoke search Mozilla/Firefox
+        invoke search powertoys --output=json
     """
     manager = WingetMirrorManager()
     if not manager.mirror_dir.exists():
@@ -341,79 +393,82 @@ def search(c, target):
         return
 
     downloads = manager.state.get("downloads", {})
-    manifests_dir = manager.mirror_dir / "manifests"
 
-    # Parse target
     if "/" in target:
         publisher, package = target.split("/", 1)
-        publishers = [publisher]
-        package_filter = package
+        matches = [
+            (manager.index and manager.index.package_metadata(f"{publisher}.{name}"))
+            or {"package_id": f"{publisher}.{name}"}
+            for name in manager.get_packages(publisher, package)
+            if name.lower() == package.lower()
+        ]
     else:
-        publishers = manager.get_matching_publishers(target)
-        package_filter = None
+        matches = manager.search_packages(target, limit=int(limit))
+        if matches is None:
+            print("Manifest index not found or out of date; matching publisher names only. "
+                  "Run 'invoke sync-repo' to rebuild it.", file=sys.stderr)
+            matches = [
+                {"package_id": f"{pub}.{package}"}
+                for pub in manager.get_matching_publishers(target)
+                for package in manager.get_packages(pub)
+            ]
+
+    # Collect download status of each match
+    for match in matches:
+        pub, pkg = match["package_id"].split(".", 1)
+        match["downloads"] = []
+        for v, vdata in downloads.get(match["package_id"], {}).get("versions", {}).items():
+            download_dir = manager.downloads_dir / pub / pkg / v
+            downloaded = download_dir.exists() and any(download_dir.iterdir())
+            match["downloads"].append({
+                "version": v,
+                "status": "Downloaded" if downloaded else "Recorded",
+                "pinned": bool(vdata.get("pinned")),
+                "timestamp": vdata.get("timestamp"),
+            })
 
-    found_packages = []
-    for pub in publishers:
-        first_letter = pub[0].lower()
-        publisher_path = manifests_dir / first_letter / pub
-        if not publisher_path.exists():
-            continue
-        for package_path in publisher_path.iterdir():
-            if not package_path.is_dir():
-                continue
-            if package_filter and package_path.name.lower() != package_filter.lower():
-                continue
-            package_id = f"{pub}.{package_path.name}"
-            found_packages.append(package_id)
+    if output == 'json':
+        print(json.dumps(matches, indent=4))
+        return
 
-    if not found_packages:
+    if not matches:
         print(f"No packages found matching '{target}'")
         return
 
-    # Collect package data
     package_data = []
-    max_pkg_len = len("Package")
-    max_status_len = len("Status")
-
-    for package_id in sorted(found_packages):
-        pub, pkg = package_id.split(".", 1)
-        package_info = downloads.get(package_id, {})
-        versions = package_info.get("versions", {})
-
-        if not versions:
-            package_data.append((package_id, "Not downloaded", "-", "-"))
+    for match in matches:
+        name = match.get("name") or "-"
+        if not match["downloads"]:
+            package_data.append((match["package_id"], name, "Not downloaded", match.get("version") or "-", "-"))
             continue
 
-        for v, vdata in versions.items():
-            pinned = " (pinned)" if vdata.get("pinned") else ""
-            ts = vdata.get("timestamp", "-")
+        for entry in match["downloads"]:
+            pinned = " (pinned)" if entry["pinned"] else ""
+            ts = entry["timestamp"] or "-"
             try:
                 dt = datetime.datetime.fromisoformat(ts)
                 ts = dt.strftime("%Y-%m-%d %H:%M")
             except Exception:
                 pass
+            package_data.append((match["package_id"], name, entry["status"] + pinned, entry["version"], ts))
 
-            download_dir = manager.downloads_dir / pub / pkg / v
-            if download_dir.exists() and any(download_dir.iterdir()):
-                status = "Downloaded"
-            else:
-                status = "Recorded"
-
-            package_data.append((package_id, status + pinned, v, ts))
-            max_pkg_len = max(max_pkg_len, len(package_id))
-            max_status_len = max(max_status_len, len(status + pinned))
+    max_pkg_len = max(len("Package"), *(len(row[0]) for row in package_data))
+    max_name_len = min(40, max(len("Name"), *(len(row[1]) for row in package_data)))
+    max_status_len = max(len("Status"), *(len(row[2]) for row in package_data))
 
     # Print table
-    print(f"Found {len(found_packages)} package(s) matching '{target}':")
-    header = f"{'Package':<{max_pkg_len}}  {'Status':<{max_status_len}}  {'Version':<10}  {'Timestamp':<17}"
+    print(f"Found {len(matches)} package(s) matching '{target}':")
+    header = (f"{'Package':<{max_pkg_len}}  {'Name':<{max_name_len}}  {'Status':<{max_status_len}}  "
+              f"{'Version':<10}  {'Timestamp':<17}")
     print(header)
     print("-" * len(header))
 
-    for pkg_id, status, ver, ts in package_data:
-        print(f"{pkg_id:<{max_pkg_len}}  {status:<{max_status_len}}  {ver:<10}  {ts:<17}")
+    for pkg_id, name, status, ver, ts in package_data:
+        print(f"{pkg_id:<{max_pkg_len}}  {name[:max_name_len]:<{max_name_len}}  {status:<{max_status_len}}  "
+              f"{ver:<10}  {ts:<17}")
 
 @task
-def patch_repo(c, server_url=None, patch_dir=None):
+def patch_repo(c, server_url=None, patch_dir=None, jobs=1):
     """Create patched manifests with corrected InstallerURL paths for downloaded packages.
 
     Copies manifest files for all downloaded packages to the output directory,
@@ -425,9 +480,11 @@ def patch_repo(c, server_url=None, patch_dir=None):
     Args:
         server_url: Base server URL where downloads will be served (e.g., 'https://mirror.example.com')
         patch_dir: Directory to output the patched manifests
+        jobs: Number of worker processes patching versions in parallel (default 1)
 
     Example:
         invoke patch-repo --server-url="https://mirror.example.com" --patch-dir="./patched-manifests"
+        invoke patch-repo --jobs=8
     """
     # # Validate server URL
     # if not server_url.startswith(('http://', 'https://')):
@@ -450,9 +507,105 @@ def patch_repo(c, server_url=None, patch_dir=None):
         print("No downloaded packages found in state.json. Run 'invoke sync' first.")
         return
 
-    manager.patch_repo(server_url=server_url, patch_dir=patch_dir)
+    manager.patch_repo(server_url=server_url, patch_dir=patch_dir, jobs=int(jobs))
     print(f"Patched manifests created")
 
+@task
+def rollback_patch(c, generation=None, list_only=False):
+    """Publish an earlier generation of the patched manifests.
+
+    patch-repo writes every run to a new generation and keeps the last
+    patch_generations of them (config.json). Rolling back switches patch_dir
+    to another generation atomically; the next patch-repo run starts from
+    the generation that is published.
+
+    Args:
+        generation: Generation to publish (default: the one before the published generation)
+        list_only: Only list the generations
+
+    Example:
+        invoke rollback-patch
+        invoke rollback-patch --list-only
+        invoke rollback-patch --generation=20251109-153000
+    """
+    manager = WingetMirrorManager()
+    if list_only:
+        patch_dir = manager.config.get("patch_dir")
+        current = current_generation(patch_dir)
+        for name in list_generations(patch_dir):
+            print(f"{'*' if name == current else ' '} {name}")
+        return
+    if manager.rollback_patches(generation) is None:
+        sys.exit(1)
+
+@task
+def build_source(c, patch_dir=None, source_dir=None):
+    """Build a winget pre-indexed source (source.msix) from the patched manifests.
+
+    Merges the patched manifests of every version into the single-file form
+    winget reads from pre-indexed sources, indexes them in a winget
+    index.db and packages it as source.msix. Only versions re-patched since
+    the last build are processed. Run 'invoke patch-repo' first.
+
+    Args:
+        patch_dir: Directory holding the patched manifests (default: patch_dir in config.json)
+        source_dir: Output directory to serve as the source (default: source_dir in config.json)
+
+    Example:
+        invoke build-source
+        invoke build-source --patch-dir=./patched-manifests --source-dir=./source
+    """
+    manager = WingetMirrorManager()
+    if manager.build_source(patch_dir=patch_dir, source_dir=source_dir) is None:
+        sys.exit(1)
+
+@task
+def serve(c, host=None, port=None, patch_dir=None, verbose=False):
+    """Serve the patched manifests as a winget REST source.
+
+    Implements the /information, /manifestSearch and /packageManifests
+    endpoints of the winget REST source API from an in-memory catalog of
+    pre-serialized JSON responses. The catalog reloads itself whenever
+    'invoke patch-repo' changes the patched manifests; only changed
+    packages are re-read. Settings come from the 'rest' section of
+    config.json.
+
+    Args:
+        host: Address to listen on (default: rest.host in config.json)
+        port: Port to listen on (default: rest.port in config.json)
+        patch_dir: Directory holding the patched manifests (default: patch_dir in config.json)
+        verbose: Log every request
+
+    Example:
+        invoke serve
+        invoke serve --port=8443 --verbose
+        winget source add -n mirror -t "Microsoft.Rest" -a https://mirror.example.com/api
+    """
+    from winget_mirror_rest import serve as serve_rest
+
+    manager = WingetMirrorManager()
+    rest_cfg = {**manager.DEFAULT_CONFIG["rest"], **manager.config.get("rest", {})}
+    patch_dir = patch_dir or manager.config.get("patch_dir")
+    if not patch_dir:
+        print("Error: patch_dir must be set in config or passed explicitly")
+        sys.exit(1)
+    patch_dir = Path(patch_dir)
+    if not (patch_dir / PATCH_STATE_FILE).exists():
+        print(f"No patched manifests found in {patch_dir}. Run 'invoke patch-repo' first.")
+        sys.exit(1)
+
+    serve_rest(
+        patch_dir,
+        host=host or rest_cfg["host"],
+        port=int(port or rest_cfg["port"]),
+        base_path=rest_cfg["base_path"],
+        source_identifier=rest_cfg["source_identifier"],
+        reload_interval=float(rest_cfg["reload_interval"]),
+        certfile=rest_cfg["certfile"],
+        keyfile=rest_cfg["keyfile"],
+        verbose=verbose,
+    )
+
 @task
 def cleanup(c, dry_run=False):
     """Cleanup old unpinned versions based on config.json thresholds."""
@@ -464,39 +617,41 @@ def cleanup(c, dry_run=False):
     now = datetime.datetime.now()
     cleaned_count = 0
 
-    for package_id, package_info in list(manager.state.get("downloads", {}).items()):
-        versions = package_info.get("versions", {})
-        if not versions:
-            continue
+    with manager.batch_state():
+        for package_id, package_info in list(manager.state.get("downloads", {}).items()):
+            versions = package_info.get("versions", {})
+            if not versions:
+                continue
 
-        unpinned = [(v, vdata) for v, vdata in versions.items() if not vdata.get("pinned")]
-        if not unpinned:
-            continue
+            unpinned = [(v, vdata) for v, vdata in versions.items() if not vdata.get("pinned")]
+            if not unpinned:
+                continue
 
-        # Sort by timestamp
-        unpinned.sort(key=lambda item: parse_version_safe(item[0]))
+            # Sort oldest version first
+            unpinned.sort(key=lambda item: version_sort_key(item[0]))
 
-        # Apply thresholds
-        to_delete = []
-        if len(unpinned) > max_versions:
-            to_delete.extend(unpinned[:-max_versions])
+            # Apply thresholds
+            to_delete = []
+            if len(unpinned) > max_versions:
+                to_delete.extend(unpinned[:-max_versions])
 
-        for v, vdata in unpinned:
-            ts = datetime.datetime.fromisoformat(vdata.get("timestamp"))
-            age_months = (now.year - ts.year) * 12 + (now.month - ts.month)
-            if age_months > max_age_months and (v, vdata) not in to_delete:
-                to_delete.append((v, vdata))
+            for v, vdata in unpinned:
+                ts = datetime.datetime.fromisoformat(vdata.get("timestamp"))
+                age_months = (now.year - ts.year) * 12 + (now.month - ts.month)
+                if age_months > max_age_months and (v, vdata) not in to_delete:
+                    to_delete.append((v, vdata))
 
-        # Delete selected versions
-        pkg = manager.get_package(package_id)
-        for v, _ in to_delete:
-            if dry_run:
-                print(f"[DRY RUN] Would clean {package_id} {v}")
-            else:
-                if pkg.purge(version=v):
-                    cleaned_count += 1
+            # Delete selected versions
+            pkg = manager.get_package(package_id)
+            for v, _ in to_delete:
+                if dry_run:
+                    print(f"[DRY RUN] Would clean {package_id} {v}")
+                else:
+                    if pkg.purge(version=v):
+                        cleaned_count += 1
 
     if not dry_run:
+        manager.collect_garbage()
         print(f"Cleanup removed {cleaned_count} version(s)")
     else:
         print("Dry run complete — no changes made.")
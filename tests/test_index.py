@@ -0,0 +1,107 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_core import version_sort_key  # noqa: E402
+from winget_mirror_index import ManifestIndex  # noqa: E402
+from winget_mirror_tree import WorkingTree  # noqa: E402
+
+def write_package(manifests_dir, package_id, version, name, tags=(), description='', sha256='ab' * 32):
+    pub, pkg = package_id.split('.', 1)
+    version_dir = manifests_dir / pub[0].lower() / pub / pkg / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    (version_dir / f'{package_id}.yaml').write_text(
+        f'PackageIdentifier: {package_id}\n'
+        f'PackageVersion: "{version}"\n'
+        'DefaultLocale: en-US\n'
+        'ManifestType: version\n'
+        'ManifestVersion: 1.6.0\n'
+    )
+    tag_lines = ''.join(f'- {tag}\n' for tag in tags)
+    (version_dir / f'{package_id}.locale.en-US.yaml').write_text(
+        f'PackageIdentifier: {package_id}\n'
+        f'PackageVersion: "{version}"\n'
+        'PackageLocale: en-US\n'
+        f'Publisher: {pub}\n'
+        f'PackageName: {name}\n'
+        f'ShortDescription: {description or name}\n'
+        + (f'Tags:\n{tag_lines}' if tags else '')
+        + 'ManifestType: defaultLocale\n'
+        'ManifestVersion: 1.6.0\n'
+    )
+    (version_dir / f'{package_id}.installer.yaml').write_text(
+        f'PackageIdentifier: {package_id}\n'
+        f'PackageVersion: "{version}"\n'
+        'Installers:\n'
+        '- Architecture: x64\n'
+        f'  InstallerUrl: https://example.com/{pkg}-{version}.exe\n'
+        f'  InstallerSha256: {sha256.upper()}\n'
+        'ManifestType: installer\n'
+        'ManifestVersion: 1.6.0\n'
+    )
+
+@pytest.fixture
+def manifests_dir(tmp_path):
+    manifests_dir = tmp_path / 'manifests'
+    write_package(manifests_dir, 'Mozilla.Firefox', '121.0.1', 'Mozilla Firefox', tags=['browser'])
+    write_package(manifests_dir, 'Mozilla.Firefox', '99.0', 'Mozilla Firefox', tags=['browser'])
+    write_package(manifests_dir, 'Mozilla.Thunderbird', '115.0', 'Thunderbird', tags=['email'])
+    write_package(manifests_dir, 'Example.Tool', '1.10', 'Example Tool', description='Browser extension helper')
+    write_package(manifests_dir, 'Example.Tool', '1.9', 'Example Tool', description='Browser extension helper')
+    return manifests_dir
+
+def build_index(tmp_path, manifests_dir):
+    return ManifestIndex.build(tmp_path / 'index.db', WorkingTree(manifests_dir), 'rev1', version_sort_key, 'test')
+
+def test_build_indexes_versions_and_installers(tmp_path, manifests_dir):
+    index = build_index(tmp_path, manifests_dir)
+    try:
+        assert (index.git_rev, index.version_scheme) == ('rev1', 'test')
+        assert index.publishers('moz') == ['Mozilla']
+        assert index.packages('Mozilla', 'th') == ['Thunderbird']
+        assert index.versions('Mozilla.Firefox') == ['99.0', '121.0.1']
+        assert index.latest_version('Example.Tool') == '1.10'
+        assert index.manifest_paths('Example.Tool', '1.10') == [
+            'manifests/e/Example/Tool/1.10/Example.Tool.installer.yaml',
+            'manifests/e/Example/Tool/1.10/Example.Tool.locale.en-US.yaml',
+            'manifests/e/Example/Tool/1.10/Example.Tool.yaml',
+        ]
+        assert index.installers('Mozilla.Firefox', '99.0') == [{
+            'Architecture': 'x64', 'InstallerUrl': 'https://example.com/Firefox-99.0.exe', 'InstallerSha256': 'ab' * 32,
+        }]
+        assert index.package_metadata('Mozilla.Thunderbird')['tags'] == ['email']
+    finally:
+        index.close()
+
+def test_search_ranks_and_falls_back_to_fuzzy(tmp_path, manifests_dir):
+    index = build_index(tmp_path, manifests_dir)
+    try:
+        results = index.search('browser')
+        # An exact tag ranks above a word in the description
+        assert [r['package_id'] for r in results] == ['Mozilla.Firefox', 'Example.Tool']
+        assert results[0]['version'] == '121.0.1'
+        assert [r['package_id'] for r in index.search('mozilla thunder')] == ['Mozilla.Thunderbird']
+
+        fuzzy = index.search('thunderbrd')
+        assert [r['package_id'] for r in fuzzy] == ['Mozilla.Thunderbird']
+        assert fuzzy[0]['match'] == 'fuzzy'
+        assert index.search('   ') == []
+    finally:
+        index.close()
+
+def test_update_reindexes_changed_packages(tmp_path, manifests_dir):
+    index = build_index(tmp_path, manifests_dir)
+    try:
+        write_package(manifests_dir, 'Mozilla.Firefox', '122.0', 'Mozilla Firefox', tags=['browser'])
+        shutil.rmtree(manifests_dir / 'm' / 'Mozilla' / 'Thunderbird')
+        index.update(WorkingTree(manifests_dir), [('Mozilla', 'Firefox'), ('Mozilla', 'Thunderbird')], 'rev2')
+
+        assert index.git_rev == 'rev2'
+        assert index.latest_version('Mozilla.Firefox') == '122.0'
+        assert index.versions('Mozilla.Thunderbird') == []
+        assert index.search('thunderbird') == []
+    finally:
+        index.close()
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_manifest import load_manifest, rewrite_installer_urls  # noqa: E402
+
+MIRROR = 'https://mirror.example.com/downloads/app.exe'
+
+def installer_manifest(url_line):
+    return (
+        'PackageIdentifier: Example.App\n'
+        'PackageVersion: 1.0.0\n'
+        'Installers:\n'
+        '- Architecture: x64\n'
+        f'  {url_line}\n'
+        '  InstallerSha256: 0000000000000000000000000000000000000000000000000000000000000000\n'
+        'ManifestType: installer\n'
+        'ManifestVersion: 1.6.0\n'
+    ).encode('utf-8')
+
+@pytest.mark.parametrize('url_line', [
+    'InstallerUrl: https://example.com/app.exe',
+    'InstallerUrl: "https://example.com/app.exe"',
+    "InstallerUrl: 'https://example.com/app.exe'",
+    'InstallerUrl: https://example.com/app.exe   # comment',
+])
+def test_rewrites_plain_and_quoted_scalars(url_line):
+    result = rewrite_installer_urls(installer_manifest(url_line), lambda url: MIRROR)
+    assert result is not None
+    data, replaced = result
+    assert replaced == [('https://example.com/app.exe', MIRROR)]
+    assert load_manifest(data)['Installers'][0]['InstallerUrl'] == MIRROR
+
+@pytest.mark.parametrize('url_line', [
+    'InstallerUrl: &url https://example.com/app.exe',
+    'InstallerUrl: *url',
+    'InstallerUrl: !!str https://example.com/app.exe',
+    'InstallerUrl: %value',
+    'InstallerUrl: @value',
+    'InstallerUrl: `value',
+    'InstallerUrl: {url: https://example.com/app.exe}',
+    'InstallerUrl: [https://example.com/app.exe]',
+    'InstallerUrl: |',
+    'InstallerUrl: >',
+])
+def test_leaves_yaml_indicators_to_round_trip(url_line):
+    assert rewrite_installer_urls(installer_manifest(url_line), lambda url: MIRROR) is None
+
+def test_other_manifest_types_unchanged():
+    data = b'PackageIdentifier: Example.App\nManifestType: version\n'
+    assert rewrite_installer_urls(data, lambda url: MIRROR) == (data, [])
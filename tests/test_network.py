@@ -0,0 +1,86 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_network import DownloadScheduler, TokenBucket, resume_validator  # noqa: E402
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, burst=10)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.consume(10)
+    # The first 10 tokens are the burst, the other 50 take 0.5s at 100/s
+    assert time.monotonic() - started >= 0.45
+
+def test_token_bucket_lets_large_amounts_through_once_full():
+    bucket = TokenBucket(rate=1000, burst=10)
+    started = time.monotonic()
+    bucket.consume(500)
+    assert time.monotonic() - started < 0.1
+
+def test_unlimited_bucket_never_blocks():
+    bucket = TokenBucket(rate=None)
+    bucket.consume(10 ** 12)
+    asyncio.run(bucket.consume_async(10 ** 12))
+
+def test_resume_validator_skips_weak_etags():
+    assert resume_validator({'ETag': '"abc"', 'Last-Modified': 'x'}) == '"abc"'
+    assert resume_validator({'ETag': 'W/"abc"', 'Last-Modified': 'x'}) == 'x'
+    assert resume_validator({}) is None
+
+def test_from_config_caps_concurrency_at_pool_size(capsys):
+    scheduler = DownloadScheduler.from_config({
+        'http': {'max_connections_per_host': 2},
+        'network': {
+            'per_host': {'max_concurrency': 8},
+            'hosts': {'example.com': {'max_concurrency': None}, 'slow.example.org': {'max_bandwidth_mbps': 1}},
+        },
+    })
+    assert scheduler.per_host['max_concurrency'] == 2
+    assert scheduler.hosts['example.com']['max_concurrency'] == 2
+    assert 'max_concurrency' not in scheduler.hosts['slow.example.org']
+    assert 'exceeds http.max_connections_per_host' in capsys.readouterr().out
+
+def test_host_overrides_apply_to_subdomains():
+    scheduler = DownloadScheduler(per_host={'max_concurrency': 4}, hosts={'Example.com': {'max_concurrency': 1}})
+    assert scheduler._settings_for('dl.example.com')['max_concurrency'] == 1
+    assert scheduler._settings_for('example.org')['max_concurrency'] == 4
+
+def test_slot_limits_concurrent_transfers_per_host():
+    scheduler = DownloadScheduler(per_host={'max_concurrency': 2})
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def transfer():
+        with scheduler.slot('https://example.com/app.exe'):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=transfer) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+
+def test_async_slot_works_across_event_loops():
+    scheduler = DownloadScheduler(per_host={'max_concurrency': 1})
+
+    async def transfer():
+        async with scheduler.async_slot('https://example.com/app.exe') as throttle:
+            await throttle.charge_async(1)
+
+    async def transfers():
+        await asyncio.gather(transfer(), transfer())
+
+    # e.g. the HEAD probe and the downloads, each with their own loop
+    asyncio.run(transfers())
+    asyncio.run(transfers())
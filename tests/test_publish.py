@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_core import WingetMirrorManager  # noqa: E402
+from winget_mirror_publish import (  # noqa: E402
+    current_generation, generations_dir, list_generations, new_generation, prune_generations, publish,
+    staged_generation,
+)
+from winget_mirror_tree import WorkingTree  # noqa: E402
+
+SERVER_URL = 'https://mirror.example.com'
+
+def installer_manifest(url):
+    return (
+        'PackageIdentifier: Example.App\n'
+        'PackageVersion: 1.0.0\n'
+        'Installers:\n'
+        '- Architecture: x64\n'
+        f'  InstallerUrl: {url}\n'
+        '  InstallerSha256: 0000000000000000000000000000000000000000000000000000000000000000\n'
+        'ManifestType: installer\n'
+        'ManifestVersion: 1.6.0\n'
+    )
+
+@pytest.fixture
+def published(tmp_path):
+    """A published generation holding a single file."""
+    path = tmp_path / 'patched'
+    generation = new_generation(path)
+    (generation / 'a.txt').write_text('one')
+    publish(path, generation.name)
+    return path
+
+def test_new_generation_moves_plain_directory_into_generations(tmp_path):
+    path = tmp_path / 'patched'
+    path.mkdir()
+    (path / 'a.txt').write_text('one')
+
+    generation = new_generation(path)
+    assert path.is_symlink()
+    assert len(list_generations(path)) == 2
+    assert (path / 'a.txt').read_text() == 'one'
+    assert os.path.samefile(path / 'a.txt', generation / 'a.txt')
+
+def test_publish_switches_link_without_touching_old_generation(published):
+    old = current_generation(published)
+    generation = new_generation(published)
+    (generation / 'a.txt').unlink()
+    (generation / 'a.txt').write_text('two')
+    publish(published, generation.name)
+
+    assert current_generation(published) == generation.name
+    assert (published / 'a.txt').read_text() == 'two'
+    assert (generations_dir(published) / old / 'a.txt').read_text() == 'one'
+
+def test_publish_rejects_unknown_generation(published):
+    with pytest.raises(ValueError):
+        publish(published, 'missing')
+
+def test_staged_generation_is_discarded_on_error(published):
+    before = list_generations(published)
+    with pytest.raises(RuntimeError):
+        with staged_generation(published):
+            raise RuntimeError('patch failed')
+    assert list_generations(published) == before
+
+def test_prune_keeps_published_generation(published):
+    current = current_generation(published)
+    names = [new_generation(published).name for _ in range(3)]
+    assert prune_generations(published, 1) == names[:2]
+    assert list_generations(published) == [current, names[-1]]
+
+def make_manager(tmp_path, url='https://example.com/app.exe'):
+    version_dir = tmp_path / 'upstream' / 'manifests' / 'e' / 'Example' / 'App' / '1.0.0'
+    version_dir.mkdir(parents=True, exist_ok=True)
+    (version_dir / 'Example.App.installer.yaml').write_text(installer_manifest(url))
+
+    config = {**WingetMirrorManager.DEFAULT_CONFIG, 'server_url': SERVER_URL,
+              'patch_dir': str(tmp_path / 'patched'), 'precompress': {'gzip': False, 'brotli': False}}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    state = {'path': str(tmp_path), 'downloads': {'Example.App': {'versions': {'1.0.0': {'files': {}}}}}}
+    (tmp_path / 'state.json').write_text(json.dumps(state))
+    manager = WingetMirrorManager(tmp_path / 'config.json', tmp_path / 'state.json')
+    manager._tree = WorkingTree(tmp_path / 'upstream' / 'manifests')
+    return manager
+
+def patched_manifest(tmp_path):
+    return (tmp_path / 'patched' / 'manifests' / 'e' / 'Example' / 'App' / '1.0.0'
+            / 'Example.App.installer.yaml').read_text()
+
+def test_patch_repo_publishes_generations_and_rolls_back(tmp_path):
+    manager = make_manager(tmp_path)
+    assert manager.patch_repo() == 1
+    first = current_generation(tmp_path / 'patched')
+    assert f'{SERVER_URL}/downloads/Example/App/1.0.0/app.exe' in patched_manifest(tmp_path)
+
+    # Nothing changed: no generation is staged
+    assert manager.patch_repo() == 0
+    assert list_generations(tmp_path / 'patched') == [first]
+
+    manager = make_manager(tmp_path, url='https://example.com/app-2.exe')
+    assert manager.patch_repo() == 1
+    second = current_generation(tmp_path / 'patched')
+    assert second != first
+    assert 'app-2.exe' in patched_manifest(tmp_path)
+
+    assert manager.rollback_patches() == first
+    assert 'app-2.exe' not in patched_manifest(tmp_path)
+    assert manager.rollback_patches(generation='missing') is None
@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_core import PATCH_STATE_FILE  # noqa: E402
+from winget_mirror_rest import RestCatalog  # noqa: E402
+
+def singleton(package_id, package_version, name='Example App'):
+    return (
+        f'PackageIdentifier: {package_id}\n'
+        f'PackageVersion: {package_version}\n'
+        'PackageLocale: en-US\n'
+        'Publisher: Example\n'
+        f'PackageName: {name}\n'
+        'Installers:\n'
+        '- Architecture: x64\n'
+        '  InstallerUrl: https://mirror.example.com/downloads/app.exe\n'
+        '  InstallerSha256: 0000000000000000000000000000000000000000000000000000000000000000\n'
+        'ManifestType: singleton\n'
+        'ManifestVersion: 1.6.0\n'
+    )
+
+def write_patch_dir(patch_path, versions, name='Example App'):
+    """Write singleton manifests for Example.App and a .patch-state.json listing them."""
+    state = {}
+    for version, package_version in versions.items():
+        version_dir = patch_path / 'manifests' / 'e' / 'Example' / 'App' / version
+        version_dir.mkdir(parents=True, exist_ok=True)
+        (version_dir / 'Example.App.yaml').write_text(singleton('Example.App', package_version, name))
+        state[version] = {'fingerprint': f'{version}-{name}', 'files': ['Example.App.yaml']}
+    state_path = patch_path / PATCH_STATE_FILE
+    state_path.write_text(json.dumps({'patcher_version': 2, 'versions': {'Example.App': state}}))
+    # reload() looks at the mtime, which may not tick between two quick writes
+    stat = state_path.stat()
+    os.utime(state_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+def manifest_versions(catalog):
+    body, _ = catalog.package_manifests('Example.App')
+    return [entry['PackageVersion'] for entry in json.loads(body)['Data']['Versions']]
+
+def test_float_like_version_keeps_directory_string(tmp_path):
+    write_patch_dir(tmp_path, {'1.10': '1.10', '1.9': '1.9'})
+    catalog = RestCatalog(tmp_path)
+    assert catalog.reload()
+
+    assert manifest_versions(catalog) == ['1.10', '1.9']
+    assert catalog.package_manifests('Example.App', version='1.10') is not None
+    body, _ = catalog.search({'Query': {'KeyWord': 'example', 'MatchType': 'Substring'}})
+    result = json.loads(body)['Data'][0]
+    assert [v['PackageVersion'] for v in result['Versions']] == ['1.10', '1.9']
+
+def test_reload_picks_up_changed_versions(tmp_path):
+    write_patch_dir(tmp_path, {'1.0': '1.0'})
+    catalog = RestCatalog(tmp_path)
+    catalog.reload()
+    _, etag = catalog.package_manifests('Example.App')
+    assert not catalog.reload()
+
+    write_patch_dir(tmp_path, {'1.0': '1.0', '2.0': '2.0'}, name='Renamed App')
+    assert catalog.reload()
+    assert manifest_versions(catalog) == ['2.0', '1.0']
+    assert catalog.package_manifests('Example.App')[1] != etag
+    assert catalog.search({'Query': {'KeyWord': 'renamed', 'MatchType': 'Substring'}}) is not None
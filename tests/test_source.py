@@ -0,0 +1,89 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_manifest import load_manifest  # noqa: E402
+from winget_mirror_source import build_source  # noqa: E402
+
+def write_version(patch_path, package_id, version, package_version):
+    pub, pkg = package_id.split('.', 1)
+    version_dir = patch_path / 'manifests' / pub[0].lower() / pub / pkg / version
+    version_dir.mkdir(parents=True)
+    files = {
+        f'{package_id}.yaml': (
+            f'PackageIdentifier: {package_id}\n'
+            f'PackageVersion: {package_version}\n'
+            'DefaultLocale: en-US\n'
+            'ManifestType: version\n'
+            'ManifestVersion: 1.6.0\n'
+        ),
+        f'{package_id}.locale.en-US.yaml': (
+            f'PackageIdentifier: {package_id}\n'
+            f'PackageVersion: {package_version}\n'
+            'PackageLocale: en-US\n'
+            'PackageName: Example App\n'
+            'Tags:\n'
+            '- example\n'
+            'ManifestType: defaultLocale\n'
+            'ManifestVersion: 1.6.0\n'
+        ),
+        f'{package_id}.installer.yaml': (
+            f'PackageIdentifier: {package_id}\n'
+            f'PackageVersion: {package_version}\n'
+            'Installers:\n'
+            '- Architecture: x64\n'
+            '  InstallerUrl: https://mirror.example.com/downloads/app.exe\n'
+            '  InstallerSha256: 0000000000000000000000000000000000000000000000000000000000000000\n'
+            'ManifestType: installer\n'
+            'ManifestVersion: 1.6.0\n'
+        ),
+    }
+    for name, text in files.items():
+        (version_dir / name).write_text(text)
+    return {'fingerprint': f'{package_id}-{version}', 'files': sorted(files)}
+
+def build(tmp_path, patched_versions):
+    return build_source(tmp_path / 'patched', tmp_path / 'source', patched_versions,
+                        'Example.Source', 'CN=Example', 'Example Source')
+
+def indexed_versions(source_path):
+    conn = sqlite3.connect(source_path / 'index.db')
+    try:
+        return sorted(conn.execute(
+            "SELECT ids.id, versions.version FROM manifest "
+            "JOIN ids ON ids.rowid = manifest.id JOIN versions ON versions.rowid = manifest.version"
+        ))
+    finally:
+        conn.close()
+
+def test_float_like_version_keeps_directory_string(tmp_path):
+    patched = {'Example.App': {'1.10': write_version(tmp_path / 'patched', 'Example.App', '1.10', '1.10')}}
+    counts = build(tmp_path, patched)
+    assert counts['added'] == 1 and counts['packaged']
+
+    assert indexed_versions(tmp_path / 'source') == [('Example.App', '1.10')]
+
+    merged_files = list((tmp_path / 'source' / 'manifests').rglob('*.yaml'))
+    assert len(merged_files) == 1
+    assert '/1.10/' in merged_files[0].as_posix()
+    merged = load_manifest(merged_files[0].read_bytes())
+    assert merged['PackageVersion'] == '1.10'
+    assert merged['ManifestType'] == 'merged'
+    assert merged['PackageName'] == 'Example App'
+
+def test_unchanged_versions_are_skipped_and_removed_versions_dropped(tmp_path):
+    patched = {'Example.App': {
+        '1.0': write_version(tmp_path / 'patched', 'Example.App', '1.0', '1.0'),
+        '2.0': write_version(tmp_path / 'patched', 'Example.App', '2.0', '2.0'),
+    }}
+    assert build(tmp_path, patched)['added'] == 2
+
+    counts = build(tmp_path, patched)
+    assert (counts['added'], counts['unchanged'], counts['packaged']) == (0, 2, False)
+
+    del patched['Example.App']['1.0']
+    counts = build(tmp_path, patched)
+    assert (counts['removed'], counts['unchanged'], counts['packaged']) == (1, 1, True)
+    assert [version for _, version in indexed_versions(tmp_path / 'source')] == ['2.0']
+    assert not list((tmp_path / 'source' / 'manifests').rglob('1.0'))
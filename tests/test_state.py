@@ -0,0 +1,82 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_state import JsonStateStore, SqliteStateStore, open_state_store  # noqa: E402
+
+def bootstrap_state(tmp_path):
+    return {
+        'path': str(tmp_path),
+        'last_sync': '2025-01-01T00:00:00',
+        'downloads': {
+            'Example.App': {
+                'versions': {
+                    '1.0': {'files': {'app.exe': 'aa'}, 'pinned': False},
+                    '2.0': {'files': {'app.exe': 'bb'}, 'pinned': True},
+                },
+            },
+        },
+    }
+
+def open_sqlite(tmp_path):
+    return SqliteStateStore(tmp_path / 'state.db', tmp_path / 'state.json')
+
+def test_migrates_state_json_to_sqlite(tmp_path):
+    state = bootstrap_state(tmp_path)
+    (tmp_path / 'state.json').write_text(json.dumps(state))
+
+    store = open_sqlite(tmp_path)
+    assert store.load(state) == state
+    store.close()
+
+    stub = json.loads((tmp_path / 'state.json').read_text())
+    assert stub == {'path': str(tmp_path), 'state_backend': 'sqlite'}
+    assert json.loads((tmp_path / 'state.json.bak').read_text()) == state
+
+    store = open_sqlite(tmp_path)
+    assert store.load(stub) == state
+    store.close()
+
+def test_saves_changed_packages_only(tmp_path):
+    state = bootstrap_state(tmp_path)
+    (tmp_path / 'state.json').write_text(json.dumps(state))
+    store = open_sqlite(tmp_path)
+    state = store.load(state)
+
+    state['downloads']['Example.App']['versions']['3.0'] = {'files': {'app.exe': 'cc'}}
+    del state['downloads']['Example.App']['versions']['1.0']
+    state['downloads']['Other.App'] = {'versions': {'1.0': {'files': {}}}}
+    # Other.App is outside the scope of this save
+    store.save(state, package_ids={'Example.App'})
+    store.close()
+
+    store = open_sqlite(tmp_path)
+    loaded = store.load({})
+    store.close()
+    assert sorted(loaded['downloads']['Example.App']['versions']) == ['2.0', '3.0']
+    assert 'Other.App' not in loaded['downloads']
+
+def test_restores_from_backup_when_database_is_missing(tmp_path):
+    state = bootstrap_state(tmp_path)
+    (tmp_path / 'state.json').write_text(json.dumps(state))
+    store = open_sqlite(tmp_path)
+    store.load(state)
+    store.close()
+    stub = json.loads((tmp_path / 'state.json').read_text())
+
+    (tmp_path / 'state.db').unlink()
+    store = open_sqlite(tmp_path)
+    assert store.load(stub) == state
+    store.close()
+
+def test_json_store_refuses_migrated_state(tmp_path):
+    store = JsonStateStore(tmp_path / 'state.json')
+    with pytest.raises(ValueError):
+        store.load({'path': str(tmp_path), 'state_backend': 'sqlite'})
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        open_state_store({'state_backend': 'redis'}, tmp_path, tmp_path / 'state.json')
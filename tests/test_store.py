@@ -0,0 +1,87 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_store import InstallerLookup, ObjectStore  # noqa: E402
+
+def write_installer(path, data=b'installer'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+def test_add_deduplicates_identical_installers(tmp_path):
+    store = ObjectStore(tmp_path / 'objects')
+    first = tmp_path / 'downloads' / 'A' / 'App' / '1.0' / 'app.exe'
+    second = tmp_path / 'downloads' / 'B' / 'App' / '1.0' / 'app.exe'
+    sha256 = write_installer(first)
+    write_installer(second)
+
+    store.add(first, sha256)
+    store.add(second, sha256)
+    assert store.contains(sha256)
+    assert os.path.samefile(first, store.path_for(sha256))
+    assert os.path.samefile(second, store.path_for(sha256))
+    assert [sha for sha, _ in store.objects()] == [sha256]
+
+@pytest.mark.parametrize('link_mode', ['hardlink', 'symlink', 'copy'])
+def test_link_modes(tmp_path, link_mode):
+    store = ObjectStore(tmp_path / 'objects', link_mode=link_mode)
+    source = tmp_path / 'app.exe'
+    sha256 = write_installer(source)
+    store.add(source, sha256)
+
+    dest = tmp_path / 'downloads' / 'app.exe'
+    assert store.link(sha256, dest) == link_mode
+    assert dest.read_bytes() == b'installer'
+    assert dest.is_symlink() == (link_mode == 'symlink')
+
+def test_unknown_link_mode(tmp_path):
+    with pytest.raises(ValueError):
+        ObjectStore(tmp_path / 'objects', link_mode='reflink')
+
+def test_collect_garbage_keeps_referenced_and_linked_objects(tmp_path):
+    store = ObjectStore(tmp_path / 'objects')
+    kept = tmp_path / 'kept.exe'
+    kept_sha = write_installer(kept, b'kept')
+    store.add(kept, kept_sha)
+    referenced = tmp_path / 'referenced.exe'
+    referenced_sha = write_installer(referenced, b'referenced')
+    store.add(referenced, referenced_sha)
+    orphan = tmp_path / 'orphan.exe'
+    orphan_sha = write_installer(orphan, b'orphan')
+    store.add(orphan, orphan_sha)
+    referenced.unlink()
+    orphan.unlink()
+
+    assert store.collect_garbage({referenced_sha}) == (1, len(b'orphan'))
+    assert sorted(sha for sha, _ in store.objects()) == sorted([kept_sha, referenced_sha])
+
+def test_lookup_materializes_from_recorded_downloads(tmp_path):
+    downloads_dir = tmp_path / 'downloads'
+    sha256 = write_installer(downloads_dir / 'A' / 'App' / '1.0' / 'app.exe')
+    downloads = {'A.App': {'versions': {'1.0': {'files': {'app.exe': sha256.upper()}}}}}
+    lookup = InstallerLookup(downloads_dir, downloads)
+
+    dest = downloads_dir / 'A' / 'App' / '2.0' / 'app.exe'
+    assert lookup.materialize(sha256, dest) == 'hardlink'
+    assert dest.read_bytes() == b'installer'
+    assert lookup.find('0' * 64) is None
+    assert lookup.materialize('0' * 64, tmp_path / 'missing.exe') is None
+
+def test_lookup_takes_installers_into_the_store(tmp_path):
+    downloads_dir = tmp_path / 'downloads'
+    source = downloads_dir / 'A' / 'App' / '1.0' / 'app.exe'
+    sha256 = write_installer(source)
+    store = ObjectStore(tmp_path / 'objects')
+    lookup = InstallerLookup(downloads_dir, {}, store=store)
+    lookup.record(sha256, source)
+
+    dest = downloads_dir / 'B' / 'App' / '1.0' / 'app.exe'
+    lookup.materialize(sha256, dest)
+    assert store.contains(sha256)
+    assert os.path.samefile(dest, store.path_for(sha256))
+    assert lookup.find(sha256) == store.path_for(sha256)
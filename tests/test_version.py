@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from winget_mirror_core import version_sort_key  # noqa: E402
+
+@pytest.mark.parametrize('older, newer', [
+    ('1.9', '1.10'),
+    ('1.0-beta', '1.0'),
+    ('1.0b1', '1.0'),
+    ('1.0', '1.0.1'),
+    ('2.0', 'v2.1'),
+    ('99999.0', 'latest'),
+    ('unknown', '0.0.1'),
+    ('1.2.40.592', '1.3'),
+])
+def test_orders_winget_versions(older, newer):
+    assert version_sort_key(older) < version_sort_key(newer)
+
+@pytest.mark.parametrize('a, b', [
+    ('1.0', '1.0.0'),
+    ('1.0', 'v1.0'),
+    ('1.0-Beta', '1.0-beta'),
+    ('', 'unknown'),
+])
+def test_equal_versions(a, b):
+    assert version_sort_key(a) == version_sort_key(b)
+
+def test_zero_padding_keeps_direction():
+    # Missing parts count as 0, so '1.0' compares like '1.0.0.0'
+    assert version_sort_key('1.0.0.0-beta') < version_sort_key('1.0') < version_sort_key('1.0.0.1')
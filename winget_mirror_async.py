@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from tqdm import tqdm
+
+from winget_mirror_network import resume_validator
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def async_available():
+    """Return True if the async download backend can be used (aiohttp is installed)."""
+    return aiohttp is not None
+
+class DownloadError(Exception):
+    """A download failed. retry is True for failures worth another attempt (429/5xx, connection errors)."""
+
+    def __init__(self, message, retry=False, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+def _retry_after(headers):
+    try:
+        return max(0.0, float(headers.get('Retry-After', '')))
+    except ValueError:
+        return None
+
+class AsyncDownloader:
+    """Downloads installers concurrently on a single asyncio event loop.
+
+    The alternative to one thread per download: hundreds of transfers can
+    be in flight at once without a thread (and its stack) each, which pays
+    off when mirroring thousands of mostly small installers. Semantics match
+    download_file: the body is hashed while it streams into '<file>.part',
+    interrupted transfers resume with Range/If-Range, and the file is renamed
+    into place only once complete. Connection errors, timeouts and 429/5xx
+    responses are retried with exponential backoff, honouring Retry-After;
+    any other HTTP error skips the installer.
+
+    Requires aiohttp; check async_available() first.
+    """
+
+    def __init__(self, scheduler=None, chunk_size=DEFAULT_CHUNK_SIZE, max_connections_per_host=4, retries=5,
+                 backoff_factor=1.0, connect_timeout=10, read_timeout=60):
+        if aiohttp is None:
+            raise RuntimeError("The async download backend requires aiohttp (pip install aiohttp)")
+        self.scheduler = scheduler
+        self.chunk_size = chunk_size
+        self.max_connections_per_host = max_connections_per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    @classmethod
+    def from_config(cls, config, scheduler=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Build a downloader from the 'http' section of config.json."""
+        http_cfg = config.get('http', {})
+        return cls(
+            scheduler=scheduler,
+            chunk_size=chunk_size,
+            max_connections_per_host=http_cfg.get('max_connections_per_host', 4),
+            retries=http_cfg.get('retries', 5),
+            backoff_factor=http_cfg.get('backoff_factor', 1.0),
+            connect_timeout=http_cfg.get('connect_timeout', 10),
+            read_timeout=http_cfg.get('read_timeout', 60),
+        )
+
+    def _session(self, jobs):
+        connector = aiohttp.TCPConnector(limit=jobs, limit_per_host=self.max_connections_per_host)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+
+    def _slot(self, url):
+        if self.scheduler is None:
+            return _NoSlot()
+        return self.scheduler.async_slot(url)
+
+    async def _with_retries(self, func, *args):
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = DownloadError(f"Request failed: {e!r}", retry=True)
+            except DownloadError as e:
+                error = e
+            if not error.retry or attempt >= self.retries:
+                raise error
+            delay = error.retry_after
+            if delay is None:
+                delay = self.backoff_factor * (2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _content_length(self, session, url):
+        async with self._slot(url):
+            async with session.head(url, allow_redirects=True) as response:
+                if response.status in RETRY_STATUSES:
+                    raise DownloadError(f"HTTP {response.status}", retry=True,
+                                        retry_after=_retry_after(response.headers))
+                if response.status >= 400:
+                    return None
+                return int(response.headers['Content-Length'])
+
+    def content_lengths(self, urls, jobs):
+        """Return the Content-Length of each URL (None where unknown), probed with HEAD requests."""
+        async def probe(session, gate, url):
+            async with gate:
+                try:
+                    return await self._with_retries(self._content_length, session, url)
+                except (DownloadError, KeyError, ValueError):
+                    return None
+
+        async def run():
+            gate = asyncio.Semaphore(jobs)
+            async with self._session(jobs) as session:
+                return await asyncio.gather(*(probe(session, gate, url) for url in urls))
+
+        return asyncio.run(run())
+
+    async def _download(self, session, url, filepath, progress):
+        part_path = filepath.with_name(filepath.name + '.part')
+        meta_path = filepath.with_name(filepath.name + '.part.json')
+
+        sha = hashlib.sha256()
+        offset = 0
+        headers = {'Accept-Encoding': 'identity'}
+
+        if part_path.exists():
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            if meta.get('url') == url and meta.get('validator'):
+                with open(part_path, 'rb') as f:
+                    while chunk := f.read(self.chunk_size):
+                        sha.update(chunk)
+                        offset += len(chunk)
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                    headers['If-Range'] = meta['validator']
+
+        async with self._slot(url) as throttle:
+            response = await session.get(url, headers=headers)
+            try:
+                if offset and response.status == 416:
+                    # Range not satisfiable: the partial file no longer fits the remote one
+                    response.release()
+                    offset = 0
+                    sha = hashlib.sha256()
+                    del headers['Range'], headers['If-Range']
+                    response = await session.get(url, headers=headers)
+                if response.status in RETRY_STATUSES:
+                    raise DownloadError(f"HTTP error: {response.status} {response.reason} for url: {url}",
+                                        retry=True, retry_after=_retry_after(response.headers))
+                if response.status >= 400:
+                    raise DownloadError(f"HTTP error: {response.status} {response.reason} for url: {url}")
+
+                content_range = response.headers.get('Content-Range', '')
+                if offset and not (response.status == 206 and content_range.startswith(f'bytes {offset}-')):
+                    # The server ignored the range or the validator did not match
+                    offset = 0
+                    sha = hashlib.sha256()
+
+                if offset:
+                    print(f"Resuming {url} at byte {offset}")
+
+                validator = resume_validator(response.headers)
+                if validator:
+                    with open(meta_path, 'w') as f:
+                        json.dump({'url': url, 'validator': validator}, f)
+                else:
+                    meta_path.unlink(missing_ok=True)
+
+                content_length = int(response.headers.get('Content-Length', 0))
+                total_size = offset + content_length if content_length else 0
+                written = offset
+                progress.total += content_length
+                progress.refresh()
+
+                try:
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        async for data in response.content.iter_chunked(self.chunk_size):
+                            sha.update(data)
+                            size = f.write(data)
+                            written += size
+                            progress.update(size)
+                            await throttle.charge_async(size)
+
+                    if total_size and written != total_size:
+                        raise DownloadError(f"Connection closed after {written} of {total_size} bytes", retry=True)
+                except BaseException:
+                    # Only count what arrived; a retry adds the remaining bytes again
+                    progress.total -= content_length - (written - offset)
+                    progress.refresh()
+                    raise
+            finally:
+                response.release()
+
+        os.replace(part_path, filepath)
+        meta_path.unlink(missing_ok=True)
+        return sha.hexdigest()
+
+    def download_all(self, items, jobs, on_done):
+        """Download every (key, url, filepath) in items, at most jobs at a time, in the given order.
+
+        on_done(key, sha256, error) is called on the event loop thread as each
+        transfer finishes: with the SHA256 hex digest on success, or with
+        sha256 None and a DownloadError once the installer is given up on.
+        The .part file of a failed transfer is kept so a later run resumes it.
+        """
+        async def worker(session, queue, progress):
+            while True:
+                try:
+                    key, url, filepath = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    sha256 = await self._with_retries(self._download, session, url, Path(filepath), progress)
+                except DownloadError as e:
+                    on_done(key, None, e)
+                except Exception as e:
+                    on_done(key, None, e)
+                else:
+                    on_done(key, sha256, None)
+
+        async def run():
+            queue = asyncio.Queue()
+            for item in items:
+                queue.put_nowait(item)
+            workers = min(jobs, queue.qsize())
+            with tqdm(desc='Downloading', total=0, unit='iB', unit_scale=True, unit_divisor=1024) as progress:
+                async with self._session(jobs) as session:
+                    await asyncio.gather(*(worker(session, queue, progress) for _ in range(workers)))
+
+        asyncio.run(run())
+
+class _NoSlot:
+    """Stand-in for DownloadScheduler.async_slot when downloads are not scheduled."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def charge_async(self, nbytes):
+        pass
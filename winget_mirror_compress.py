@@ -0,0 +1,69 @@
+import gzip
+import os
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PRECOMPRESSED_SUFFIXES = ('.gz', '.br')
+
+def brotli_available():
+    """Return True if '.br' siblings can be written (the brotli package is installed)."""
+    return brotli is not None
+
+def precompress_formats(config):
+    """Return the sibling suffixes to write, from the 'precompress' section of config.json.
+
+    '.br' is only included when brotli is enabled and installed.
+    """
+    precompress_cfg = config.get('precompress', {})
+    formats = []
+    if precompress_cfg.get('gzip', True):
+        formats.append('.gz')
+    if precompress_cfg.get('brotli', True) and brotli_available():
+        formats.append('.br')
+    return tuple(formats)
+
+def _compress(data, suffix):
+    if suffix == '.gz':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+def _sibling(path, suffix):
+    return path.with_name(path.name + suffix)
+
+def write_precompressed(path, data, formats):
+    """Write '<path>.gz' / '<path>.br' siblings of a served file for nginx's gzip_static.
+
+    Siblings for suffixes not in formats are removed, so a stale
+    precompressed copy is never served for a rewritten file.
+
+    Args:
+        path: The uncompressed file
+        data: Its contents
+        formats: Suffixes to write, as returned by precompress_formats()
+    """
+    path = Path(path)
+    for suffix in PRECOMPRESSED_SUFFIXES:
+        target = _sibling(path, suffix)
+        if suffix not in formats:
+            target.unlink(missing_ok=True)
+            continue
+        tmp_path = target.with_name(target.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(_compress(data, suffix))
+        os.replace(tmp_path, target)
+
+def precompressed_current(path, formats):
+    """Return True if exactly the siblings in formats exist next to path."""
+    path = Path(path)
+    return all(_sibling(path, suffix).is_file() == (suffix in formats) for suffix in PRECOMPRESSED_SUFFIXES)
+
+def remove_precompressed(path):
+    """Delete the precompressed siblings of path, if any."""
+    path = Path(path)
+    for suffix in PRECOMPRESSED_SUFFIXES:
+        _sibling(path, suffix).unlink(missing_ok=True)
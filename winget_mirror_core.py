@@ -1,14 +1,50 @@
 import json
-import yaml
+import os
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hashlib
 import datetime
 import shutil
+import copy
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from git import Repo, RemoteProgress
+from git import Repo, RemoteProgress, GitCommandError
 from tqdm import tqdm
 from packaging import version
 from packaging.version import Version, InvalidVersion
+from winget_mirror_index import ManifestIndex, INDEX_FORMAT
+from winget_mirror_manifest import (
+    load_manifest, dump_manifest, rewrite_installer_urls, INSTALLER_MANIFEST_TYPES, YAMLError
+)
+from winget_mirror_tree import WorkingTree, GitObjectTree
+from winget_mirror_state import open_state_store
+from winget_mirror_store import ObjectStore, InstallerLookup
+from winget_mirror_network import DownloadScheduler, Throttle, resume_validator
+from winget_mirror_async import AsyncDownloader, async_available
+from winget_mirror_source import build_source
+from winget_mirror_publish import (
+    staged_generation, publish, discard_generation, prune_generations, list_generations, current_generation
+)
+from winget_mirror_compress import (
+    precompress_formats, write_precompressed, precompressed_current, remove_precompressed
+)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DOWNLOAD_BACKENDS = ('threads', 'async')
+_NO_THROTTLE = Throttle([])
+
+PATCHER_VERSION = 2
+"""Bumped whenever patch_repo's output format changes, so every version is re-patched."""
+PATCH_STATE_FILE = '.patch-state.json'
 
 class GitProgress(RemoteProgress):
     def update(self, op_code, cur_count, max_count=None, message=''):
@@ -17,8 +53,67 @@ class GitProgress(RemoteProgress):
         else:
             print(f"\r{op_code} {cur_count} {message}", end='', flush=True)
 
+VERSION_SCHEME = 'winget-1'
+"""Identifies the ordering implemented by version_sort_key; stored in the manifest index."""
+
+_VERSION_PART = re.compile(r'(\d*)(.*)', re.DOTALL)
+_ZERO_PART = (0, 1, '')
+
+@lru_cache(maxsize=65536)
+def version_sort_key(v):
+    """Return a sort key that totally orders winget version strings.
+
+    Follows the winget client's comparison: the version is split on '.',
+    each part is compared by its leading integer and then by the rest of the
+    part, case-insensitively, with a part that has text after the number
+    ('0-beta', '0b1') sorting before the bare number. Missing parts count as
+    0, so '1.0' == '1.0.0', and a leading 'v' is ignored ('v2024.01'). 'latest'
+    sorts above every other version and 'unknown' below.
+
+    The key is a tuple of ints and strings, so it is cheap to compare and
+    to memoize.
+
+    Args:
+        v: Version string
+
+    Returns:
+        tuple: Key such that version_sort_key(a) < version_sort_key(b) when a is older than b
+    """
+    text = v.strip().lower()
+    if text == 'latest':
+        return (2,)
+    if text == 'unknown' or not text:
+        return (0,)
+    if text[0] == 'v' and text[1:2].isdigit():
+        text = text[1:]
+
+    parts = []
+    for part in text.split('.'):
+        number, rest = _VERSION_PART.match(part.strip()).groups()
+        parts.append((int(number) if number else 0, 0 if rest else 1, rest))
+    while parts and parts[-1] == _ZERO_PART:
+        parts.pop()
+
+    # Missing trailing parts are implicitly 0. A zero part is tagged with the
+    # direction of the next non-zero part and the key ends with an untagged
+    # zero, so a shorter version compares like one padded with zeros.
+    key = []
+    direction = 0
+    for part in reversed(parts):
+        if part == _ZERO_PART:
+            key.append((*part, direction))
+        else:
+            key.append((*part, 0))
+            direction = 1 if part > _ZERO_PART else -1
+    key.reverse()
+    key.append((*_ZERO_PART, 0))
+    return (1, tuple(key))
+
 def parse_version_safe(v):
-    """Parse version string, handling non-PEP 440 versions like '1.2.40.592'."""
+    """Parse version string, handling non-PEP 440 versions like '1.2.40.592'.
+
+    Kept for compatibility; ordering of versions uses version_sort_key.
+    """
     try:
         return version.parse(v)
     except InvalidVersion:
@@ -35,6 +130,275 @@ def parse_version_safe(v):
         fallback_str = '.'.join(str(p) for p in parts)
         return Version(fallback_str)
 
+class HttpClient:
+    """Pooled HTTP session shared by all downloads of a WingetMirrorManager.
+
+    Connections are kept alive and reused per host. At most
+    max_connections_per_host connections are opened to a single host; further
+    requests to that host wait for a free connection. Connection errors and
+    429/5xx responses are retried with exponential backoff, honouring
+    Retry-After.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_connections_per_host=4, retries=5, backoff_factor=1.0,
+                 connect_timeout=10, read_timeout=60, max_hosts=32):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a client from the 'http' section of config.json."""
+        http_cfg = config.get('http', {})
+        return cls(
+            max_connections_per_host=http_cfg.get('max_connections_per_host', 4),
+            retries=http_cfg.get('retries', 5),
+            backoff_factor=http_cfg.get('backoff_factor', 1.0),
+            connect_timeout=http_cfg.get('connect_timeout', 10),
+            read_timeout=http_cfg.get('read_timeout', 60),
+        )
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('allow_redirects', True)
+        return self.session.head(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+def _update_hash_from_file(sha, filepath, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Feed the contents of filepath into sha chunk by chunk and return the number of bytes read.
+
+    progress, if given, is called with the size of each chunk.
+    """
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    total = 0
+    with open(filepath, 'rb') as f:
+        while n := f.readinto(buf):
+            sha.update(view[:n])
+            total += n
+            if progress is not None:
+                progress(n)
+    return total
+
+def hash_file(filepath, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Compute the SHA256 hex digest of a file, reading it chunk_size bytes at a time.
+
+    hashlib releases the GIL while hashing large buffers, so several files can
+    be hashed in parallel from threads.
+    """
+    sha = hashlib.sha256()
+    _update_hash_from_file(sha, filepath, chunk_size, progress)
+    return sha.hexdigest()
+
+def verification_record(filepath, sha256, st=None):
+    """Return the state entry recording that filepath hashed to sha256.
+
+    st is the os.stat() result taken before hashing; it defaults to the
+    file's current status. validate-hash skips re-hashing a file while its
+    size, mtime and inode still match the record.
+    """
+    if st is None:
+        st = os.stat(filepath)
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "ino": st.st_ino,
+        "sha256": sha256,
+        "verified_at": datetime.datetime.now().isoformat()
+    }
+
+def _patched_version_dir(output_path, pub, pkg, version):
+    """Directory holding the patched manifests of one package version."""
+    return Path(output_path) / "manifests" / pub[0].lower() / pub / pkg / version
+
+def patch_version_manifests(package_id, version, server_url, target_dir, sources, dropped=(), precompress=()):
+    """Write the patched manifests of one package version into target_dir.
+
+    Runs in patch_repo's worker processes, so it only takes picklable
+    arguments and does no git access.
+
+    Args:
+        package_id: Package identifier (Publisher.Package)
+        version: Package version
+        server_url: Base URL the downloads are served from
+        target_dir: Output directory of this version
+        sources: List of (filename, bytes) source manifests
+        dropped: Filenames patched earlier that no longer exist upstream
+        precompress: Suffixes of precompressed siblings to write ('.gz', '.br')
+
+    Returns:
+        list: Messages describing the patched URLs
+    """
+    pub, pkg = package_id.split(".", 1)
+    target_dir = Path(target_dir)
+    messages = []
+    outputs = []
+
+    def new_url(original_url):
+        filename = Path(original_url).name
+        return f"{server_url.rstrip('/')}/downloads/{pub}/{pkg}/{version}/{filename}"
+
+    for manifest_name, data in sources:
+        result = rewrite_installer_urls(data, new_url)
+        if result is not None:
+            patched, replaced = result
+        else:
+            # Constructs the text rewriter does not handle: fall back to a YAML round trip
+            manifest = load_manifest(data)
+            replaced = []
+            if manifest.get("ManifestType") in INSTALLER_MANIFEST_TYPES and "Installers" in manifest:
+                for installer in manifest["Installers"]:
+                    if "InstallerUrl" in installer:
+                        original_url = installer["InstallerUrl"]
+                        installer["InstallerUrl"] = new_url(original_url)
+                        replaced.append((original_url, installer["InstallerUrl"]))
+            patched = dump_manifest(manifest).encode('utf-8') if replaced else data
+
+        for original_url, url in replaced:
+            messages.append(f"Patched {package_id} {version}: {original_url} -> {url}")
+        outputs.append((manifest_name, patched))
+
+    # Only write once every manifest converted, so a bad manifest leaves the previous output intact
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for manifest_name, patched in outputs:
+        # Replace rather than rewrite: the file may be hardlinked into older generations
+        tmp_path = target_dir / (manifest_name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(patched)
+        os.replace(tmp_path, target_dir / manifest_name)
+        write_precompressed(target_dir / manifest_name, patched, precompress)
+
+    # Manifest files dropped upstream since the last patch
+    for name in dropped:
+        (target_dir / name).unlink(missing_ok=True)
+        remove_precompressed(target_dir / name)
+
+    messages.append(f"Patched manifests for {package_id} {version}")
+    return messages
+
+def download_file(url, filepath, chunk_size=DEFAULT_CHUNK_SIZE, http=None, scheduler=None):
+    """Download url to filepath through a resumable '.part' file.
+
+    The transfer is written to '<filepath>.part' and atomically renamed to
+    filepath once complete, so an interrupted download never shows up as a
+    finished file. If a .part file from an earlier attempt exists, the hash of
+    the bytes already on disk is restored and the transfer resumes with a
+    Range request guarded by If-Range; if the remote file changed, the server
+    sends the whole body and the download starts over.
+
+    Requests go through http (an HttpClient) when given, otherwise through
+    the module-level requests.get. With scheduler (a DownloadScheduler) the
+    transfer waits for a slot on the URL's host and is throttled to the
+    configured bandwidth limits.
+
+    Returns:
+        str: SHA256 hex digest of the downloaded file.
+
+    Raises:
+        requests.exceptions.RequestException: The transfer failed. The .part
+            file is kept so the next call can resume it.
+    """
+    filepath = Path(filepath)
+    part_path = filepath.with_name(filepath.name + '.part')
+    meta_path = filepath.with_name(filepath.name + '.part.json')
+
+    sha = hashlib.sha256()
+    offset = 0
+    headers = {'Accept-Encoding': 'identity'}
+
+    if part_path.exists():
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if meta.get('url') == url and meta.get('validator'):
+            offset = _update_hash_from_file(sha, part_path, chunk_size)
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = meta['validator']
+
+    get = http.get if http else requests.get
+    with scheduler.slot(url) if scheduler else nullcontext(_NO_THROTTLE) as throttle:
+        response = get(url, stream=True, headers=headers)
+        try:
+            if offset and response.status_code == 416:
+                # Range not satisfiable: the partial file no longer fits the remote one
+                response.close()
+                offset = 0
+                sha = hashlib.sha256()
+                del headers['Range'], headers['If-Range']
+                response = get(url, stream=True, headers=headers)
+            response.raise_for_status()
+
+            content_range = response.headers.get('Content-Range', '')
+            if offset and not (response.status_code == 206 and content_range.startswith(f'bytes {offset}-')):
+                # The server ignored the range or the validator did not match
+                offset = 0
+                sha = hashlib.sha256()
+
+            if offset:
+                print(f"Resuming {url} at byte {offset}")
+
+            validator = resume_validator(response.headers)
+            if validator:
+                with open(meta_path, 'w') as f:
+                    json.dump({'url': url, 'validator': validator}, f)
+            else:
+                meta_path.unlink(missing_ok=True)
+
+            content_length = int(response.headers.get('content-length', 0))
+            total_size = offset + content_length if content_length else 0
+            written = offset
+
+            with open(part_path, 'ab' if offset else 'wb') as f, tqdm(
+                desc=filepath.name,
+                initial=offset,
+                total=total_size,
+                unit='iB',
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as bar:
+                for data in response.iter_content(chunk_size=chunk_size):
+                    sha.update(data)
+                    size = f.write(data)
+                    written += size
+                    bar.update(size)
+                    throttle.charge(size)
+
+            if total_size and written != total_size:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Connection closed after {written} of {total_size} bytes")
+        finally:
+            response.close()
+
+    os.replace(part_path, filepath)
+    meta_path.unlink(missing_ok=True)
+    return sha.hexdigest()
+
 def load_config_and_state():
     """Load and return config and state from files, or None if not found."""
     config_path = Path('config.json')
@@ -70,76 +434,61 @@ def get_matching_publishers(mirror_dir, publisher):
 
     return matching
 
-def process_package(package_id, mirror_dir, downloads_dir, downloaded, repo, version_filter=None):
-    """Process a single package: find version (latest or explicit), download if needed, update state."""
+def _store_file(store, filepath, sha256):
+    """Move filepath into the object store, if any; failures leave the plain file in place."""
+    if store is None:
+        return
+    try:
+        store.add(filepath, sha256)
+    except OSError as e:
+        print(f"Warning: Could not add {filepath} to the object store: {e}")
+
+def resolve_package(package_id, tree, version_filter=None):
+    """Work out what process_package would download for a package, without touching the network.
+
+    Picks the version (latest or version_filter) and its x64 installer,
+    falling back to x86.
+
+    Returns:
+        dict: {"package_id", "pub", "pkg", "version", "pinned", "url",
+        "sha256", "filename"}, or None if there is nothing to download.
+    """
     try:
         pub, pkg = package_id.split('.', 1)
     except ValueError:
         print(f"Warning: Invalid package_id format: {package_id}")
-        return False
+        return None
 
-    manifests_dir = mirror_dir / 'manifests'
-    first_letter = pub[0].lower()
-    publisher_path = manifests_dir / first_letter / pub
-    package_path = publisher_path / pkg
-
-    if not package_path.is_dir():
+    versions = tree.versions(pub, pkg)
+    if versions is None:
         print(f"Warning: Package directory not found for {package_id}")
-        return False
+        return None
 
-    versions = [p.name for p in package_path.iterdir() if p.is_dir()]
-    valid_versions = []
-    for v in versions:
-        try:
-            parse_version_safe(v)
-            valid_versions.append(v)
-        except:
-            continue
-
-    if not valid_versions:
-        return False
+    if not versions:
+        return None
 
     # Explicit version support
     if version_filter:
-        if version_filter not in valid_versions:
+        if version_filter not in versions:
             print(f"Requested version {version_filter} not found for {package_id}")
-            return False
+            return None
         target_version = version_filter
     else:
-        target_version = max(valid_versions, key=parse_version_safe)
+        target_version = max(versions, key=version_sort_key)
 
-    yaml_path = package_path / target_version / f'{pub}.{pkg}.yaml'
-    if not yaml_path.exists():
-        return False
+    manifest_data = tree.read(pub, pkg, target_version, f'{pub}.{pkg}.yaml')
+    if manifest_data is None:
+        return None
 
-    with open(yaml_path) as f:
-        manifest = yaml.safe_load(f)
+    manifest = load_manifest(manifest_data)
 
-    installer_yaml_path = package_path / target_version / f'{pub}.{pkg}.installer.yaml'
-    if installer_yaml_path.exists():
-        with open(installer_yaml_path) as f:
-            installer_manifest = yaml.safe_load(f)
+    installer_data = tree.read(pub, pkg, target_version, f'{pub}.{pkg}.installer.yaml')
+    if installer_data is not None:
+        installer_manifest = load_manifest(installer_data)
         installers = installer_manifest.get('Installers', [])
     else:
         installers = manifest.get('Installers', [])
 
-    download_dir = downloads_dir / pub / pkg / target_version
-    download_dir.mkdir(parents=True, exist_ok=True)
-
-    if package_id not in downloaded:
-        downloaded[package_id] = {
-            'versions': {}
-        }
-
-    downloaded[package_id]['versions'][target_version] = {
-        'git_rev': repo.head.commit.hexsha,
-        'files': {},
-        'timestamp': datetime.datetime.now().isoformat(),
-        'pinned': bool(version_filter)  # True if user passed --version
-    }
-
-    downloaded_new = False
-
     # Select installer: prefer x64, fallback to x86
     chosen_installer = None
     for inst in installers:
@@ -154,26 +503,61 @@ def process_package(package_id, mirror_dir, downloads_dir, downloaded, repo, ver
 
     if not chosen_installer:
         print(f"Skipping {package_id} — no x64/x86 installer with URL")
-        return False
+        return None
 
-    # Proceed with download
     url = chosen_installer["InstallerUrl"]
-    sha256 = chosen_installer.get("InstallerSha256")
-    filename = Path(url).name
-    filepath = download_dir / filename
+    return {
+        "package_id": package_id,
+        "pub": pub,
+        "pkg": pkg,
+        "version": target_version,
+        "pinned": bool(version_filter),  # True if user passed --version
+        "url": url,
+        "sha256": chosen_installer.get("InstallerSha256"),
+        "filename": Path(url).name,
+    }
+
+def transfer_package(plan, downloads_dir, downloaded, git_rev, chunk_size=DEFAULT_CHUNK_SIZE, http=None,
+                     store=None, lookup=None, scheduler=None):
+    """Bring the installer chosen by resolve_package into downloads_dir and record it in downloaded.
+
+    An existing file is only hashed; an installer already present elsewhere
+    in the mirror (per lookup) is linked into place; anything else is
+    downloaded, through scheduler's per-host and bandwidth limits when given.
+
+    Returns:
+        bool: True if the package version is downloaded and recorded.
+    """
+    package_id, target_version, filename = plan["package_id"], plan["version"], plan["filename"]
+    url, sha256 = plan["url"], plan["sha256"]
+
+    filepath = start_version(plan, downloads_dir, downloaded, git_rev)
+    downloaded_new = False
 
     if filepath.exists():
         if filename not in downloaded[package_id]['versions'][target_version]['files']:
-            with open(filepath, 'rb') as f:
-                computed_hash = hashlib.sha256(f.read()).hexdigest()
+            computed_hash = hash_file(filepath, chunk_size)
+            _store_file(store, filepath, computed_hash)
             downloaded[package_id]['versions'][target_version]['files'][filename] = computed_hash
+            downloaded[package_id]['versions'][target_version]['verified'] = {
+                filename: verification_record(filepath, computed_hash)
+            }
+
+    elif lookup is not None and sha256 and (mode := lookup.materialize(sha256, filepath)):
+        # Same bytes already mirrored under another version or package
+        downloaded_new = True
+        computed_hash = sha256.lower()
+        print(f"Reused local copy of {computed_hash} for {filepath} ({mode})")
+        downloaded[package_id]['versions'][target_version]['files'][filename] = computed_hash
+        downloaded[package_id]['versions'][target_version]['verified'] = {
+            filename: verification_record(filepath, computed_hash)
+        }
 
     else:
         downloaded_new = True
         print(f"Downloading {url} to {filepath}")
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
+            computed_hash = download_file(url, filepath, chunk_size, http=http, scheduler=scheduler)
         except requests.exceptions.HTTPError as e:
             print(f"Skipping {package_id} — HTTP error: {e}")
             return False
@@ -181,29 +565,7 @@ def process_package(package_id, mirror_dir, downloads_dir, downloaded, repo, ver
             print(f"Skipping {package_id} — Request failed: {e}")
             return False
 
-        total_size = int(response.headers.get('content-length', 0))
-
-        with open(filepath, 'wb') as f, tqdm(
-            desc=filename,
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as bar:
-            for data in response.iter_content(chunk_size=1024):
-                size = f.write(data)
-                bar.update(size)
-
-        with open(filepath, 'rb') as f:
-            computed_hash = hashlib.sha256(f.read()).hexdigest()
-
-        if sha256 and computed_hash != sha256.lower():
-            print(f"Warning: Hash mismatch for {filepath}, expected {sha256}, got {computed_hash}")
-
-        downloaded[package_id]['versions'][target_version]['files'][filename] = computed_hash
-
-
-
+        record_download(plan, downloaded, filepath, computed_hash, store=store, lookup=lookup)
 
     # Set timestamp after processing all installers
     if downloaded[package_id]['versions'][target_version]['files']:
@@ -213,13 +575,128 @@ def process_package(package_id, mirror_dir, downloads_dir, downloaded, repo, ver
         return True
     return False
 
+def start_version(plan, downloads_dir, downloaded, git_rev):
+    """Create the download directory and a fresh state entry for plan's version.
+
+    Returns:
+        Path: Where the installer is to be stored.
+    """
+    package_id, target_version = plan["package_id"], plan["version"]
+    download_dir = downloads_dir / plan["pub"] / plan["pkg"] / target_version
+    download_dir.mkdir(parents=True, exist_ok=True)
+
+    if package_id not in downloaded:
+        downloaded[package_id] = {
+            'versions': {}
+        }
+
+    downloaded[package_id]['versions'][target_version] = {
+        'git_rev': git_rev,
+        'files': {},
+        'timestamp': datetime.datetime.now().isoformat(),
+        'pinned': plan["pinned"]
+    }
+    return download_dir / plan["filename"]
+
+def record_download(plan, downloaded, filepath, computed_hash, store=None, lookup=None):
+    """Record an installer freshly downloaded for plan: check its hash, store it and update downloaded."""
+    sha256 = plan["sha256"]
+    if sha256 and computed_hash != sha256.lower():
+        print(f"Warning: Hash mismatch for {filepath}, expected {sha256}, got {computed_hash}")
+
+    _store_file(store, filepath, computed_hash)
+    if lookup is not None:
+        lookup.record(computed_hash, filepath)
+    vdata = downloaded[plan["package_id"]]['versions'][plan["version"]]
+    vdata['files'][plan["filename"]] = computed_hash
+    vdata['verified'] = {
+        plan["filename"]: verification_record(filepath, computed_hash)
+    }
+
+def process_package(package_id, mirror_dir, downloads_dir, downloaded, repo, version_filter=None, git_rev=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, http=None, tree=None, store=None, lookup=None, scheduler=None):
+    """Process a single package: find version (latest or explicit), download if needed, update state.
+
+    Runs resolve_package and then transfer_package. git_rev may be passed
+    to avoid reading the repository HEAD, which is not safe to do from
+    several worker threads at once. Installers are hashed while they stream
+    in, chunk_size bytes at a time, over http (an HttpClient) when given.
+    Manifests are read through tree (a WorkingTree or GitObjectTree),
+    defaulting to the checked out manifests under mirror_dir. With store (an
+    ObjectStore), downloaded installers are kept in the content-addressed
+    store. With lookup (an InstallerLookup), an installer whose
+    InstallerSha256 is already present anywhere in the mirror is linked or
+    copied into place without any network traffic.
+    """
+    if tree is None:
+        tree = WorkingTree(Path(mirror_dir) / 'manifests')
+
+    plan = resolve_package(package_id, tree, version_filter)
+    if plan is None:
+        return False
+    return transfer_package(plan, downloads_dir, downloaded, git_rev or repo.head.commit.hexsha, chunk_size,
+                            http=http, store=store, lookup=lookup, scheduler=scheduler)
+
 class WingetMirrorManager:
     DEFAULT_CONFIG = {
         "repo_url": "https://github.com/microsoft/winget-pkgs",
         "revision": "master",
         "mirror_dir": "mirror",
+        "repo_mode": "sparse",
+        "clone": {
+            "filter": "blob:none",
+            "depth": None,
+            "shallow_since": None,
+            "single_branch": True
+        },
         "patch_dir": "patched-manifests",
+        "patch_generations": 3,
         "server_url": "https://localhost/winget",
+        "source_dir": "source",
+        "source_package": {
+            "identity_name": "WingetMirror.Source",
+            "publisher": "CN=winget-mirror",
+            "display_name": "Winget Mirror"
+        },
+        "rest": {
+            "host": "0.0.0.0",
+            "port": 8080,
+            "base_path": "/api",
+            "source_identifier": "winget-mirror",
+            "reload_interval": 5,
+            "certfile": None,
+            "keyfile": None
+        },
+        "precompress": {
+            "gzip": True,
+            "brotli": True
+        },
+        "state_backend": "json",
+        "download": {
+            "chunk_size_mb": 4,
+            "backend": "threads"
+        },
+        "http": {
+            "max_connections_per_host": 4,
+            "retries": 5,
+            "backoff_factor": 1.0,
+            "connect_timeout": 10,
+            "read_timeout": 60
+        },
+        "network": {
+            "max_bandwidth_mbps": None,
+            "per_host": {
+                "max_concurrency": 4,
+                "max_bandwidth_mbps": None,
+                "requests_per_second": None
+            },
+            "hosts": {},
+            "small_first": True
+        },
+        "store": {
+            "enabled": True,
+            "link_mode": "hardlink"
+        },
         "cleanup": {
             "max_unpinned_versions": 5,
             "max_unpinned_age_months": 6
@@ -240,13 +717,26 @@ class WingetMirrorManager:
             self.config = json.load(f)
 
         with open(self.state_path) as f:
-            self.state = json.load(f)
-
-        self.path = Path(self.state['path'])
+            bootstrap = json.load(f)
+
+        self.path = Path(bootstrap['path'])
+        self.state_store = open_state_store(self.config, self.path, self.path / 'state.json')
+        self.state = self.state_store.load(bootstrap)
+        self._batch_depth = 0
+        self._pending_save = None
+        self._pending_unpublish = []
         self.mirror_dir = self.path / self.config['mirror_dir']
         self.patch_dir = self.path / self.config['patch_dir']
         self.downloads_dir = self.path / 'downloads'
+        self.objects_dir = self.path / 'objects'
+        self.index_path = self.path / 'index.db'
         self.repo = Repo(self.mirror_dir) if self.mirror_dir.exists() else None
+        self._http = None
+        self._index = None
+        self._tree = None
+        self._store = None
+        self._lookup = None
+        self._scheduler = None
 
     @classmethod
     def initialize(cls, path):
@@ -296,62 +786,641 @@ class WingetMirrorManager:
         return {
             'path': self.path,
             'mirror_dir': self.mirror_dir,
-            'downloads_dir': self.downloads_dir
+            'downloads_dir': self.downloads_dir,
+            'objects_dir': self.objects_dir
+        }
+
+    @property
+    def http(self):
+        """Shared HttpClient, created on first use from the 'http' section of config.json."""
+        if self._http is None:
+            self._http = HttpClient.from_config(self.config)
+        return self._http
+
+    def chunk_size(self):
+        """Return the read/write chunk size in bytes from the 'download' section of config.json."""
+        chunk_size_mb = self.config.get('download', {}).get('chunk_size_mb', DEFAULT_CHUNK_SIZE // (1024 * 1024))
+        return max(1, int(chunk_size_mb * 1024 * 1024))
+
+    def download_options(self):
+        """Return keyword arguments for process_package derived from config.json."""
+        return {
+            'chunk_size': self.chunk_size(),
+            'http': self.http,
+            'tree': self.tree,
+            'store': self.store,
+            'lookup': self.installer_lookup,
+            'scheduler': self.scheduler
+        }
+
+    def download_backend(self, backend=None):
+        """Resolve the download backend from an explicit choice or config.json.
+
+        Returns:
+            str: 'threads' or 'async', or None (after printing why) if the
+            backend is unknown or aiohttp is not installed.
+        """
+        backend = backend or self.config.get('download', {}).get('backend', 'threads')
+        if backend not in DOWNLOAD_BACKENDS:
+            print(f"Unknown download backend '{backend}', expected one of: {', '.join(DOWNLOAD_BACKENDS)}")
+            return None
+        if backend == 'async' and not async_available():
+            print("The async download backend requires aiohttp. Install it with 'pip install aiohttp'.")
+            return None
+        return backend
+
+    @property
+    def scheduler(self):
+        """Shared DownloadScheduler, created on first use from the 'network' section of config.json."""
+        if self._scheduler is None:
+            self._scheduler = DownloadScheduler.from_config(self.config)
+        return self._scheduler
+
+    @property
+    def installer_lookup(self):
+        """InstallerLookup over the object store and every installer recorded in state."""
+        if self._lookup is None:
+            self._lookup = InstallerLookup(self.downloads_dir, self.state.setdefault('downloads', {}), self.store)
+            # Index state now, before worker threads start and the main thread merges their results
+            self._lookup.find('')
+        return self._lookup
+
+    @property
+    def store(self):
+        """ObjectStore under '<path>/objects', or None if disabled in config.json."""
+        store_cfg = {**self.DEFAULT_CONFIG['store'], **self.config.get('store', {})}
+        if not store_cfg['enabled']:
+            return None
+        if self._store is None:
+            self._store = ObjectStore(self.objects_dir, store_cfg['link_mode'])
+        return self._store
+
+    def collect_garbage(self):
+        """Delete stored installers no longer referenced by any downloaded version.
+
+        Returns:
+            int: Number of objects removed.
+        """
+        if self.store is None:
+            return 0
+        referenced = {
+            sha256
+            for package_info in self.state.get('downloads', {}).values()
+            for vdata in package_info.get('versions', {}).values()
+            for sha256 in vdata.get('files', {}).values()
         }
+        removed, freed = self.store.collect_garbage(referenced)
+        if removed:
+            print(f"Removed {removed} unreferenced objects from the store ({freed / 2**20:.1f} MB)")
+        return removed
 
-    def save_state(self):
-        with open(self.path / 'state.json', 'w') as f:
-            json.dump(self.state, f, indent=4)
+    def save_state(self, package_ids=None):
+        """Persist state through the configured state store.
+
+        package_ids limits the write to those packages (plus top-level keys);
+        None writes everything that changed. Inside batch_state() the write is
+        deferred until the outermost batch ends.
+        """
+        if self._batch_depth:
+            # None: nothing pending, True: everything, set: those packages
+            if package_ids is None or self._pending_save is True:
+                self._pending_save = True
+            else:
+                self._pending_save = (self._pending_save or set()) | set(package_ids)
+            return
+        self.state_store.save(self.state, package_ids)
+
+    @contextmanager
+    def batch_state(self):
+        """Group the save_state calls made inside the block into a single write."""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._pending_save is not None:
+                pending, self._pending_save = self._pending_save, None
+                self.save_state(None if pending is True else pending)
+            if not self._batch_depth and self._pending_unpublish:
+                pending, self._pending_unpublish = self._pending_unpublish, []
+                self.unpublish_patches(pending)
+
+    @property
+    def tree(self):
+        """Manifest reader for the synced repository: a GitObjectTree for bare mirrors, else a WorkingTree."""
+        if self._tree is None and self.repo is not None:
+            if self.repo.bare:
+                self._tree = GitObjectTree(self.mirror_dir)
+            else:
+                self._tree = WorkingTree(self.mirror_dir / 'manifests')
+        return self._tree
+
+    @property
+    def index(self):
+        """ManifestIndex of the synced repository, or None if missing or built from another revision."""
+        if self._index is None:
+            if self.repo is None or not self.index_path.exists():
+                return None
+            index = ManifestIndex(self.index_path, version_sort_key)
+            if (index.git_rev != self.repo.head.commit.hexsha or index.version_scheme != VERSION_SCHEME
+                    or index.format != INDEX_FORMAT):
+                index.close()
+                return None
+            self._index = index
+        return self._index
+
+    def changed_versions(self, since_rev):
+        """Return the (package_id, version) pairs whose manifests changed between since_rev and HEAD.
+
+        Only trees are compared, so this is cheap even on a partial clone.
+        Returns None if since_rev is unknown or not in the repository, in which
+        case callers must assume everything changed.
+        """
+        if not since_rev or self.repo is None:
+            return None
+        head = self.repo.head.commit.hexsha
+        if since_rev == head:
+            return set()
+        try:
+            output = self.repo.git.diff('--name-only', '--no-renames', '-z', since_rev, head, '--', 'manifests/')
+        except GitCommandError:
+            return None
+
+        changes = set()
+        for path in output.split('\0'):
+            parts = path.split('/')
+            # manifests/<letter>/<publisher>/<package>/<version>/<file>
+            if len(parts) >= 6:
+                changes.add((f'{parts[2]}.{parts[3]}', parts[4]))
+        return changes
+
+    def update_index(self):
+        """Bring the manifest index up to HEAD, re-indexing only packages changed since it was built."""
+        if self.index_path.exists():
+            index = ManifestIndex(self.index_path, version_sort_key)
+            changes = self.changed_versions(index.git_rev)
+            if changes is not None and index.version_scheme == VERSION_SCHEME and index.format == INDEX_FORMAT:
+                packages = {tuple(package_id.split('.', 1)) for package_id, _ in changes}
+                index.update(self.tree, packages, self.repo.head.commit.hexsha)
+                if self._index is not None:
+                    self._index.close()
+                self._index = index
+                print(f"Updated manifest index for {len(packages)} changed packages")
+                return index
+            index.close()
+        return self.build_index()
+
+    def build_index(self):
+        """Rebuild the manifest index from the checked out manifests tree."""
+        if self._index is not None:
+            self._index.close()
+        print("Building manifest index...")
+        self._index = ManifestIndex.build(
+            self.index_path, self.tree, self.repo.head.commit.hexsha, version_sort_key, VERSION_SCHEME
+        )
+        count = self._index.conn.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+        print(f"Indexed {count} packages")
+        return self._index
+
+    def search_packages(self, query, limit=50):
+        """Search package names, monikers, tags and descriptions; see ManifestIndex.search.
+
+        Returns:
+            list: Ranked matches, or None if the manifest index is missing or out of date.
+        """
+        if self.index is None:
+            return None
+        return self.index.search(query, limit)
 
     def get_matching_publishers(self, publisher):
-        return get_matching_publishers(str(self.mirror_dir), publisher)
+        if self.index is not None:
+            return self.index.publishers(publisher)
+        if self.tree is None:
+            return []
+        return self.tree.publishers(publisher)
+
+    def get_packages(self, publisher, prefix=''):
+        """Return names of packages of publisher whose name starts with prefix (case-insensitive)."""
+        if self.index is not None:
+            return self.index.packages(publisher, prefix)
+        if self.tree is None:
+            return []
+        return [p for p in self.tree.packages(publisher) if p.lower().startswith(prefix.lower())]
 
     def get_package(self, package_id):
         return WingetPackage(self, package_id)
 
+    def validate_hashes(self, package_ids=None, jobs=1, full=False, sample=0.0):
+        """Validate the SHA256 hashes of downloaded files against state.
+
+        Files of all packages are hashed chunk by chunk on a pool of jobs
+        threads, so memory use stays bounded and large mirrors are validated
+        at disk speed. Progress and throughput are reported on stderr.
+
+        Every file that matches is recorded in its version's 'verified' entry
+        in state with its size, mtime and inode. On later runs a file whose
+        size, mtime and inode are unchanged is reported as a cached match
+        without being read, unless full is set or it is picked by sample.
+
+        Args:
+            package_ids: Packages to validate; None validates every downloaded package
+            jobs: Number of files hashed concurrently
+            full: Re-hash every file, ignoring the verification cache
+            sample: Fraction (0-1) of unchanged files to re-hash anyway, to detect bit rot
+
+        Returns:
+            dict: {"all_valid": bool, "packages": {package_id: package results}}
+        """
+        if package_ids is None:
+            package_ids = list(self.state.get('downloads', {}))
+        downloads = self.state.get('downloads', {})
+
+        results = {"all_valid": True, "packages": {}}
+        checks = []
+        cached = 0
+        for package_id in package_ids:
+            pkg_results, pkg_checks = self.get_package(package_id).plan_validation()
+            results["packages"][package_id] = pkg_results
+            for version, filename, filepath, expected_hash in pkg_checks:
+                try:
+                    st = filepath.stat()
+                except OSError:
+                    st = None
+                vdata = downloads[package_id]['versions'][version]
+                entry = vdata.get('verified', {}).get(filename)
+                if (not full and st is not None and entry
+                        and entry.get('sha256') == expected_hash
+                        and entry.get('size') == st.st_size
+                        and entry.get('mtime_ns') == st.st_mtime_ns
+                        and entry.get('ino') == st.st_ino
+                        and not (sample and random.random() < sample)):
+                    pkg_results["versions"][version]["files"][filename] = {
+                        "status": "MATCH",
+                        "expected": expected_hash,
+                        "computed": entry['sha256'],
+                        "cached": True,
+                        "verified_at": entry.get('verified_at')
+                    }
+                    cached += 1
+                    continue
+                checks.append((package_id, version, filename, filepath, expected_hash, st))
+
+        total_bytes = sum(check[5].st_size for check in checks if check[5] is not None)
+        chunk_size = self.chunk_size()
+
+        lock = threading.Lock()
+        started = time.monotonic()
+        changed_packages = set()
+        with tqdm(total=total_bytes, unit='B', unit_scale=True, unit_divisor=1024,
+                  desc=f"Hashing {len(checks)} files", file=sys.stderr, disable=None) as bar:
+            def progress(n):
+                with lock:
+                    bar.update(n)
+
+            def check_file(check):
+                filepath = check[3]
+                try:
+                    computed_hash = hash_file(filepath, chunk_size, progress)
+                except OSError as e:
+                    return check, None, str(e)
+                return check, computed_hash, None
+
+            if jobs <= 1:
+                outcomes = map(check_file, checks)
+            else:
+                executor = ThreadPoolExecutor(max_workers=jobs)
+                outcomes = executor.map(check_file, checks)
+            try:
+                for (package_id, version, filename, filepath, expected_hash, st), computed_hash, error in outcomes:
+                    pkg_results = results["packages"][package_id]
+                    version_results = pkg_results["versions"][version]
+                    match = computed_hash == expected_hash
+                    file_results = {
+                        "status": "MATCH" if match else ("ERROR" if error else "MISMATCH"),
+                        "expected": expected_hash,
+                        "computed": computed_hash
+                    }
+                    if error:
+                        file_results["error"] = error
+                    version_results["files"][filename] = file_results
+                    if not match:
+                        version_results["valid"] = False
+                        pkg_results["valid"] = False
+
+                    verified = downloads[package_id]['versions'][version].setdefault('verified', {})
+                    if match and st is not None:
+                        verified[filename] = verification_record(filepath, computed_hash, st)
+                    else:
+                        verified.pop(filename, None)
+                    changed_packages.add(package_id)
+            finally:
+                if jobs > 1:
+                    executor.shutdown()
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(
+            f"Hashed {len(checks)} files, {total_bytes / 2**20:.1f} MB in {elapsed:.1f}s "
+            f"({total_bytes / 2**20 / elapsed:.1f} MB/s); {cached} unchanged files skipped",
+            file=sys.stderr
+        )
+        if changed_packages:
+            self.save_state(package_ids=changed_packages)
+
+        results["all_valid"] = all(p.get("valid") for p in results["packages"].values())
+        return results
+
+    def download_packages(self, targets, jobs=1, backend='threads'):
+        """Download several packages, optionally using a pool of worker threads or an event loop.
+
+        All targets are first resolved to an installer from the manifests.
+        Unless network.small_first is disabled, the sizes of installers that
+        have to be downloaded are probed with HEAD requests and the smallest
+        are transferred first, so most packages become available early in a
+        long sync. Transfers go through the manager's DownloadScheduler.
+
+        Each worker downloads into a private copy of the package's state
+        entry; the copies are merged back into state['downloads'] on the
+        calling thread as workers finish. With backend 'async', installers
+        are instead fetched by an AsyncDownloader, up to jobs transfers at a
+        time on a single thread. The caller is responsible for calling
+        save_state once all downloads are done.
+
+        Args:
+            targets: Iterable of (package_id, version) tuples; version may be None
+                to select the latest version.
+            jobs: Number of packages processed concurrently.
+            backend: 'threads' or 'async' (requires aiohttp).
+
+        Returns:
+            set: Package ids that were downloaded or are up to date.
+        """
+        downloaded = self.state.setdefault('downloads', {})
+        succeeded = set()
+
+        git_rev = self.repo.head.commit.hexsha
+        options = self.download_options()
+        tree = options.pop('tree')
+
+        fetcher = None
+        if backend == 'async':
+            fetcher = AsyncDownloader.from_config(self.config, scheduler=self.scheduler,
+                                                  chunk_size=options['chunk_size'])
+
+        plans = [plan for package_id, version in targets
+                 if (plan := resolve_package(package_id, tree, version)) is not None]
+        if self.scheduler.small_first and len(plans) > 1:
+            plans = self._order_small_first(plans, jobs, fetcher)
+
+        if fetcher is not None:
+            return self._download_async(fetcher, plans, jobs, git_rev, options)
+
+        if jobs <= 1:
+            for plan in plans:
+                if transfer_package(plan, self.downloads_dir, downloaded, git_rev, **options):
+                    succeeded.add(plan["package_id"])
+            return succeeded
+
+        def worker(plan, entry):
+            package_id = plan["package_id"]
+            local = {package_id: entry} if entry is not None else {}
+            ok = transfer_package(plan, self.downloads_dir, local, git_rev, **options)
+            return ok, local.get(package_id)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+            for plan in plans:
+                package_id = plan["package_id"]
+                entry = copy.deepcopy(downloaded.get(package_id))
+                futures[executor.submit(worker, plan, entry)] = package_id
+
+            for future in as_completed(futures):
+                package_id = futures[future]
+                try:
+                    ok, entry = future.result()
+                except Exception as e:
+                    print(f"Skipping {package_id} — {e}")
+                    continue
+                if entry is not None:
+                    downloaded[package_id] = entry
+                if ok:
+                    succeeded.add(package_id)
+
+        return succeeded
+
+    def _download_async(self, fetcher, plans, jobs, git_rev, options):
+        """Transfer plans with an AsyncDownloader; installers already available locally are placed first."""
+        downloaded = self.state['downloads']
+        succeeded = set()
+        lookup = options['lookup']
+
+        pending = []
+        for plan in plans:
+            filepath = self.downloads_dir / plan["pub"] / plan["pkg"] / plan["version"] / plan["filename"]
+            if filepath.exists() or (plan["sha256"] and lookup.find(plan["sha256"])):
+                if transfer_package(plan, self.downloads_dir, downloaded, git_rev, **options):
+                    succeeded.add(plan["package_id"])
+                continue
+            filepath = start_version(plan, self.downloads_dir, downloaded, git_rev)
+            print(f"Downloading {plan['url']} to {filepath}")
+            pending.append((plan, plan["url"], filepath))
+
+        def on_done(plan, sha256, error):
+            package_id = plan["package_id"]
+            if error is not None:
+                print(f"Skipping {package_id} — {error}")
+                return
+            filepath = self.downloads_dir / plan["pub"] / plan["pkg"] / plan["version"] / plan["filename"]
+            record_download(plan, downloaded, filepath, sha256, store=options['store'], lookup=lookup)
+            downloaded[package_id]['timestamp'] = datetime.datetime.now().isoformat()
+            succeeded.add(package_id)
+
+        if pending:
+            fetcher.download_all(pending, max(1, jobs), on_done)
+        return succeeded
+
+    def _order_small_first(self, plans, jobs, fetcher=None):
+        """Return plans ordered by installer size, smallest first.
+
+        Installers already on disk or available locally cost nothing and go
+        first; the rest are sized with a HEAD request (through the scheduler,
+        so per-host limits apply), on fetcher's event loop when an
+        AsyncDownloader is given. Installers whose size is unknown go last.
+        """
+        lookup = self.installer_lookup
+
+        def is_local(plan):
+            filepath = self.downloads_dir / plan["pub"] / plan["pkg"] / plan["version"] / plan["filename"]
+            return filepath.exists() or bool(plan["sha256"] and lookup.find(plan["sha256"]))
+
+        def probe(plan):
+            try:
+                with self.scheduler.slot(plan["url"]):
+                    response = self.http.head(plan["url"])
+                if response.ok:
+                    return int(response.headers["Content-Length"])
+            except (requests.exceptions.RequestException, KeyError, ValueError):
+                pass
+            return None
+
+        remote = [plan for plan in plans if not is_local(plan)]
+        if not remote:
+            return plans
+        print(f"Probing the size of {len(remote)} installers...")
+        if fetcher is not None:
+            lengths = fetcher.content_lengths([plan["url"] for plan in remote], max(1, jobs))
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+                lengths = list(executor.map(probe, remote))
+        sizes = dict(zip((id(plan) for plan in remote), lengths))
+
+        def order(plan):
+            size = sizes.get(id(plan), 0)
+            return (size is None, size or 0)
+
+        return sorted(plans, key=order)
+
+    def _checkout_revision(self, repo):
+        """Check out the configured revision, moving a local branch to its fetched remote head."""
+        revision = self.config['revision']
+        remote_ref = f'origin/{revision}'
+        if remote_ref in [ref.name for ref in repo.remotes.origin.refs]:
+            repo.git.checkout('-B', revision, remote_ref)
+        else:
+            repo.git.checkout(revision)
+
     def sync_repo(self):
-        """Sync the winget-pkgs git repository to the configured revision."""
+        """Sync the winget-pkgs git repository to the configured revision.
+
+        With repo_mode "sparse" (the default) the manifests/ directory is
+        checked out; with repo_mode "bare" the mirror keeps only a blobless
+        object database and manifests are read from git objects on demand.
+
+        Then updates the manifest index from the manifests that changed since
+        it was last built.
+        """
         repo_path = self.mirror_dir
+        bare = self.config.get('repo_mode', 'sparse') == 'bare'
+
+        if self.repo is not None and self.repo.bare != bare:
+            raise ValueError(
+                f"{repo_path} was not created in repo_mode '{self.config.get('repo_mode', 'sparse')}'. "
+                f"Remove it or change repo_mode in config.json."
+            )
+
+        if bare:
+            repo = self._sync_bare(repo_path)
+        else:
+            repo = self._sync_sparse(repo_path)
+
+        print(f"Synced repo to {self.config['revision']} at {repo_path}")
+        self.repo = repo
+        if self._tree is not None:
+            self._tree.close()
+            self._tree = None
+        self.update_index()
+        return repo
+
+    def _clone_config(self):
+        return {**self.DEFAULT_CONFIG['clone'], **self.config.get('clone', {})}
+
+    def _single_branch(self):
+        """True if only the configured revision should be fetched; a commit sha cannot be cloned by name."""
+        revision = self.config['revision']
+        return bool(self._clone_config().get('single_branch')) and not re.fullmatch(r'[0-9a-f]{7,40}', revision)
+
+    def _fetch_options(self):
+        """Keyword arguments for git fetch that keep a shallow mirror shallow."""
+        clone_cfg = self._clone_config()
+        options = {}
+        if clone_cfg.get('depth'):
+            options['depth'] = int(clone_cfg['depth'])
+        if clone_cfg.get('shallow_since'):
+            options['shallow_since'] = clone_cfg['shallow_since']
+        return options
+
+    def _clone_options(self):
+        """Keyword arguments for git clone from the 'clone' section of config.json."""
+        options = self._fetch_options()
+        clone_cfg = self._clone_config()
+        if clone_cfg.get('filter'):
+            options['filter'] = clone_cfg['filter']
+        if self._single_branch():
+            options['single_branch'] = True
+            options['branch'] = self.config['revision']
+        return options
+
+    def _sync_sparse(self, repo_path):
         if repo_path.exists():
             print("Updating repository...")
             repo = Repo(repo_path)
-            # Ensure sparse checkout is configured
+            # Ensure cone-mode sparse checkout is configured (converts the legacy sparse-checkout file)
             try:
-                sparse_enabled = repo.git.config('--get', 'core.sparseCheckout').strip()
-            except:
-                sparse_enabled = None
-            if not sparse_enabled:
-                repo.git.config('core.sparseCheckout', 'true')
-                sparse_checkout_file = repo_path / '.git' / 'info' / 'sparse-checkout'
-                sparse_checkout_file.parent.mkdir(parents=True, exist_ok=True)
-                with open(sparse_checkout_file, 'w') as f:
-                    f.write('manifests/\n')
-                # Re-checkout to apply sparse checkout
-                repo.git.checkout(self.config['revision'])
-            else:
-                repo.remotes.origin.fetch(progress=GitProgress())
-                repo.git.checkout(self.config['revision'])
+                cone_enabled = repo.git.config('--get', 'core.sparseCheckoutCone').strip() == 'true'
+            except GitCommandError:
+                cone_enabled = False
+            if not cone_enabled:
+                repo.git.sparse_checkout('set', '--cone', 'manifests')
+            repo.remotes.origin.fetch(progress=GitProgress(), **self._fetch_options())
+            self._checkout_revision(repo)
         else:
             print("Warning: Initial clone may take several minutes depending on your internet connection.")
             print("Cloning repository with sparse checkout...")
-            repo = Repo.clone_from(self.config['repo_url'], repo_path, no_checkout=True, progress=GitProgress())
-            # Set up sparse checkout
-            repo.git.config('core.sparseCheckout', 'true')
-            sparse_checkout_file = repo_path / '.git' / 'info' / 'sparse-checkout'
-            sparse_checkout_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(sparse_checkout_file, 'w') as f:
-                f.write('manifests/\n')
-            # Checkout with sparse
-            repo.git.checkout(self.config['revision'])
+            repo = Repo.clone_from(self.config['repo_url'], repo_path, no_checkout=True, progress=GitProgress(),
+                                   **self._clone_options())
+            # Set up cone-mode sparse checkout, then checkout with sparse
+            repo.git.sparse_checkout('set', '--cone', 'manifests')
+            self._checkout_revision(repo)
+        return repo
 
-        print(f"Synced repo to {self.config['revision']} at {repo_path}")
-        self.repo = repo
+    def _sync_bare(self, repo_path):
+        """Clone or fetch a bare mirror and point its detached HEAD at the configured revision.
+
+        Bare mirrors are always partial clones (at least --filter=blob:none),
+        since manifests are read from git objects on demand.
+        """
+        revision = self.config['revision']
+        if repo_path.exists():
+            print("Updating repository...")
+            repo = Repo(repo_path)
+        else:
+            print("Cloning repository without checkout (bare, partial)...")
+            options = self._clone_options()
+            options.setdefault('filter', 'blob:none')
+            repo = Repo.clone_from(self.config['repo_url'], repo_path, bare=True, progress=GitProgress(), **options)
+            # A bare clone has no fetch refspec; track remote branches like a normal clone does
+            branches = revision if self._single_branch() else '*'
+            repo.git.config('remote.origin.fetch', f'+refs/heads/{branches}:refs/remotes/origin/{branches}')
+        repo.remotes.origin.fetch(progress=GitProgress(), **self._fetch_options())
+
+        remote_ref = f'origin/{revision}'
+        target = remote_ref if remote_ref in [ref.name for ref in repo.remotes.origin.refs] else revision
+        sha = repo.git.rev_parse(f'{target}^{{commit}}')
+        repo.git.update_ref('--no-deref', 'HEAD', sha)
         return repo
 
-    def patch_repo(self, server_url=None, patch_dir=None):
+    def patch_repo(self, server_url=None, patch_dir=None, jobs=1):
         """Create patched manifests with corrected InstallerURL paths.
 
         Uses server_url and patch_dir from config.json if not provided.
+        With jobs > 1, versions are parsed and written by a pool of jobs
+        worker processes.
+
+        Patching is incremental: each patched version is recorded in
+        '<patch_dir>/.patch-state.json' with a fingerprint of its source
+        manifests, server_url and PATCHER_VERSION, and is only rewritten when
+        that fingerprint changes. Patched versions that are no longer in state
+        are removed from patch_dir.
+
+        Every patched manifest gets '.gz' (and, with brotli installed, '.br')
+        siblings at maximum compression, per the 'precompress' section of
+        config.json, for nginx to serve with gzip_static.
+
+        With 'patch_generations' > 0 in config.json, the output is written to
+        a new generation directory that starts as a hardlinked copy of the
+        published one, and patch_dir is then atomically switched to it (see
+        winget_mirror_publish). Clients never see a half-patched tree, and the
+        last patch_generations generations are kept for rollback_patches. A
+        run that finds nothing to patch or remove leaves patch_dir untouched.
         """
         if not self.state.get("downloads"):
             print("No downloaded packages found in state.json")
@@ -364,52 +1433,317 @@ class WingetMirrorManager:
             print("Error: server_url and patch_dir must be set in config or passed explicitly")
             return 0
 
-        output_path = Path(patch_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
-
-        patched_count = 0
+        published_path = Path(patch_dir)
+        keep_generations = self.config.get("patch_generations", self.DEFAULT_CONFIG["patch_generations"])
+        if not keep_generations:
+            published_path.mkdir(parents=True, exist_ok=True)
+
+        # Compare against the published tree first, so a run with nothing
+        # to do does not stage (and hardlink-copy) a new generation
+        patch_state_path = published_path / PATCH_STATE_FILE
+        previous = None
+        if patch_state_path.exists():
+            with open(patch_state_path) as f:
+                previous = json.load(f).get("versions", {})
+
+        precompress = precompress_formats(self.config)
+        tree = self.tree
+        patched = {}
+        pending = []
+        skipped_count = 0
 
         for package_id, package_info in self.state["downloads"].items():
             pub, pkg = package_id.split(".", 1)
-            versions = package_info.get("versions", {})
-
-            for version, vdata in versions.items():
-                first_letter = pub[0].lower()
-                source_manifest_dir = (
-                    self.mirror_dir / "manifests" / first_letter / pub / pkg / version
-                )
-                if not source_manifest_dir.exists():
+
+            for version in package_info.get("versions", {}):
+                source_files = tree.files(pub, pkg, version)
+                if not source_files:
                     print(f"Warning: Source manifest not found for {package_id} {version}")
                     continue
 
-                target_manifest_dir = (
-                    output_path / "manifests" / first_letter / pub / pkg / version
-                )
-                target_manifest_dir.mkdir(parents=True, exist_ok=True)
-
-                for manifest_file in source_manifest_dir.glob("*.yaml"):
-                    target_file = target_manifest_dir / manifest_file.name
-                    with open(manifest_file) as f:
-                        manifest = yaml.safe_load(f)
+                fingerprint = self._patch_fingerprint(tree, pub, pkg, version, source_files, server_url)
+                patched.setdefault(package_id, {})[version] = {
+                    "fingerprint": fingerprint,
+                    "files": source_files,
+                }
+                target_manifest_dir = _patched_version_dir(published_path, pub, pkg, version)
+                last = (previous or {}).get(package_id, {}).get(version)
+                if (last and last.get("fingerprint") == fingerprint
+                        and all((target_manifest_dir / name).is_file()
+                                and precompressed_current(target_manifest_dir / name, precompress)
+                                for name in source_files)):
+                    skipped_count += 1
+                    continue
+                pending.append((package_id, version, source_files, last))
 
-                    if manifest.get("ManifestType") == "installer" and "Installers" in manifest:
-                        for installer in manifest["Installers"]:
-                            if "InstallerUrl" in installer:
-                                original_url = installer["InstallerUrl"]
-                                filename = Path(original_url).name
-                                new_url = f"{server_url.rstrip('/')}/downloads/{pub}/{pkg}/{version}/{filename}"
-                                installer["InstallerUrl"] = new_url
-                                print(f"Patched {package_id} {version}: {original_url} -> {new_url}")
+        if self.state.pop("last_patch", None) is not None:
+            # Superseded by .patch-state.json
+            self.save_state()
 
-                    with open(target_file, "w") as f:
-                        yaml.dump(manifest, f, default_flow_style=False, sort_keys=False)
+        if not pending and patched == previous:
+            if skipped_count:
+                print(f"Skipped {skipped_count} unchanged package versions")
+            print("Patched manifests are up to date")
+            return 0
 
+        # A generation left unpublished by an error is deleted again
+        staging = staged_generation(published_path) if keep_generations else nullcontext(published_path)
+        with staging as output_path:
+            tree.prefetch([(*package_id.split(".", 1), version) for package_id, version, _, _ in pending])
+
+            def patch_jobs():
+                # Manifests are read here: the tree's git process cannot be shared with workers
+                for package_id, version, source_files, last in pending:
+                    pub, pkg = package_id.split(".", 1)
+                    sources = [(name, tree.read(pub, pkg, version, name)) for name in source_files]
+                    dropped = sorted(set((last or {}).get("files", [])) - set(source_files))
+                    target_manifest_dir = _patched_version_dir(output_path, pub, pkg, version)
+                    yield package_id, version, server_url, str(target_manifest_dir), sources, dropped, precompress
+
+            patched_count = 0
+            failed_count = 0
+
+            def handle(job, future):
+                nonlocal patched_count, failed_count
+                package_id, version = job[0], job[1]
+                try:
+                    messages = future.result() if future is not None else patch_version_manifests(*job)
+                except Exception as e:
+                    print(f"Warning: Failed to patch {package_id} {version}: {e!r}")
+                    # Keep the previous output and its fingerprint, so it stays
+                    # published and the next run retries it
+                    last = (previous or {}).get(package_id, {}).get(version)
+                    if last:
+                        patched[package_id][version] = last
+                    else:
+                        del patched[package_id][version]
+                    failed_count += 1
+                    return
+                for message in messages:
+                    print(message)
                 patched_count += 1
-                print(f"Patched manifests for {package_id} {version}")
 
+            if jobs <= 1:
+                for job in patch_jobs():
+                    handle(job, None)
+            else:
+                remaining = patch_jobs()
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    in_flight = {}
+                    try:
+                        for job in remaining:
+                            # Bound the manifests held in memory while workers catch up
+                            if len(in_flight) >= jobs * 4:
+                                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                                for future in done:
+                                    handle(in_flight.pop(future), future)
+                            in_flight[executor.submit(patch_version_manifests, *job)] = job
+                    except BrokenProcessPool:
+                        # A worker died; the versions it had in flight are reported as failed below
+                        print("Warning: Patch worker pool failed, patching the remaining versions in this process")
+                        handle(job, None)
+                    for future in as_completed(in_flight):
+                        handle(in_flight[future], future)
+                for job in remaining:
+                    handle(job, None)
+
+            removed_count = self._remove_stale_patches(output_path, previous, patched)
+            self._write_patch_state(output_path, patched)
+
+            if keep_generations:
+                if patched_count or removed_count or patched != previous:
+                    publish(published_path, output_path.name)
+                    print(f"Published generation {output_path.name}")
+                    for name in prune_generations(published_path, keep_generations):
+                        print(f"Removed old generation {name}")
+                else:
+                    discard_generation(output_path)
+
+        if skipped_count:
+            print(f"Skipped {skipped_count} unchanged package versions")
+        if failed_count:
+            print(f"Failed to patch {failed_count} package versions")
+        if removed_count:
+            print(f"Removed {removed_count} stale package versions")
         print(f"Successfully patched {patched_count} package versions")
         return patched_count
 
+    @staticmethod
+    def _write_patch_state(output_path, patched):
+        patch_state_path = output_path / PATCH_STATE_FILE
+        tmp_path = patch_state_path.with_name(patch_state_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"patcher_version": PATCHER_VERSION, "versions": patched}, f, indent=1)
+        os.replace(tmp_path, patch_state_path)
+
+    def unpublish_patches(self, versions):
+        """Remove the patched manifests of purged package versions.
+
+        With patch generations, the versions are removed in a new generation
+        that is then published, so the tree being served is never modified.
+        Inside batch_state() the removals are collected and published once
+        when the outermost block exits.
+
+        Args:
+            versions: List of (package_id, version) pairs
+        """
+        if self._batch_depth:
+            self._pending_unpublish.extend(versions)
+            return
+        patch_dir = self.config.get("patch_dir")
+        if not versions or not patch_dir:
+            return
+        published_path = Path(patch_dir)
+        patch_state_path = published_path / PATCH_STATE_FILE
+        previous = {}
+        if patch_state_path.exists():
+            with open(patch_state_path) as f:
+                previous = json.load(f).get("versions", {})
+
+        # Also drop version directories that .patch-state.json does not list
+        stale = {}
+        for package_id, version in versions:
+            pub, pkg = package_id.split(".", 1)
+            if (version in previous.get(package_id, {})
+                    or _patched_version_dir(published_path, pub, pkg, version).exists()):
+                stale.setdefault(package_id, {})[version] = {}
+        if not stale:
+            return
+        patched = {
+            package_id: {v: entry for v, entry in entries.items() if v not in stale.get(package_id, {})}
+            for package_id, entries in previous.items()
+        }
+        patched = {package_id: entries for package_id, entries in patched.items() if entries}
+
+        keep_generations = self.config.get("patch_generations", self.DEFAULT_CONFIG["patch_generations"])
+        staging = staged_generation(published_path) if keep_generations else nullcontext(published_path)
+        with staging as output_path:
+            self._remove_stale_patches(output_path, stale, patched)
+            self._write_patch_state(output_path, patched)
+            if keep_generations:
+                publish(published_path, output_path.name)
+                print(f"Published generation {output_path.name}")
+                for name in prune_generations(published_path, keep_generations):
+                    print(f"Removed old generation {name}")
+
+    def rollback_patches(self, generation=None, patch_dir=None):
+        """Publish an earlier generation of the patched manifests.
+
+        Args:
+            generation: Name of the generation to publish (default: the one
+                before the published generation)
+            patch_dir: Published patched manifests (default: patch_dir in config.json)
+
+        Returns:
+            str: The published generation, or None on error.
+        """
+        published_path = Path(patch_dir or self.config.get("patch_dir"))
+        names = list_generations(published_path)
+        current = current_generation(published_path)
+        if generation is None:
+            older = [name for name in names if current is None or name < current]
+            if not older:
+                print("No earlier generation to roll back to")
+                return None
+            generation = older[-1]
+        if generation not in names:
+            print(f"Error: Unknown generation {generation}. Available: {', '.join(names) or 'none'}")
+            return None
+
+        publish(published_path, generation)
+        print(f"Published generation {generation} (was {current})")
+        return generation
+
+    def build_source(self, patch_dir=None, source_dir=None):
+        """Build the winget pre-indexed source (source.msix) from the manifests patched by patch_repo.
+
+        Uses patch_dir and source_dir from config.json if not provided. Only
+        versions whose patch fingerprint changed since the last build are
+        merged and re-indexed.
+
+        Returns:
+            dict: Counts from winget_mirror_source.build_source, or None on error.
+        """
+        patch_dir = patch_dir or self.config.get("patch_dir")
+        source_dir = source_dir or self.config.get("source_dir", self.DEFAULT_CONFIG["source_dir"])
+        if not patch_dir or not source_dir:
+            print("Error: patch_dir and source_dir must be set in config or passed explicitly")
+            return None
+
+        patch_state_path = Path(patch_dir) / PATCH_STATE_FILE
+        if not patch_state_path.exists():
+            print(f"No patched manifests found in {patch_dir}. Run 'invoke patch-repo' first.")
+            return None
+        with open(patch_state_path) as f:
+            patched = json.load(f).get("versions", {})
+
+        package_cfg = {**self.DEFAULT_CONFIG["source_package"], **self.config.get("source_package", {})}
+        counts = build_source(
+            patch_dir, source_dir, patched,
+            package_cfg["identity_name"], package_cfg["publisher"], package_cfg["display_name"],
+            precompress=precompress_formats(self.config),
+        )
+
+        if counts["unchanged"]:
+            print(f"Skipped {counts['unchanged']} unchanged package versions")
+        if counts["failed"]:
+            print(f"Failed to add {counts['failed']} package versions")
+        if counts["removed"]:
+            print(f"Removed {counts['removed']} package versions")
+        print(f"Indexed {counts['added']} package versions")
+        if counts["packaged"]:
+            print(f"Wrote {Path(source_dir) / 'source.msix'}")
+        else:
+            print("Source is up to date")
+        return counts
+
+    @staticmethod
+    def _patch_fingerprint(tree, pub, pkg, version, source_files, server_url):
+        """Return a digest of everything the patched output of one version depends on."""
+        fingerprint = {
+            "patcher_version": PATCHER_VERSION,
+            "server_url": server_url,
+            "files": {name: tree.file_id(pub, pkg, version, name) for name in source_files},
+        }
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def _remove_stale_patches(output_path, previous, patched):
+        """Delete patched version directories that are not in patched.
+
+        previous is the version map of the last .patch-state.json; if there
+        was none, the patched manifests tree is scanned instead.
+
+        Returns:
+            int: Number of version directories removed.
+        """
+        if previous is not None:
+            stale = [
+                (package_id, version)
+                for package_id, versions in previous.items()
+                for version in versions
+                if version not in patched.get(package_id, {})
+            ]
+        else:
+            stale = []
+            for version_dir in (output_path / "manifests").glob("*/*/*/*"):
+                pub, pkg = version_dir.parent.parent.name, version_dir.parent.name
+                if version_dir.is_dir() and version_dir.name not in patched.get(f"{pub}.{pkg}", {}):
+                    stale.append((f"{pub}.{pkg}", version_dir.name))
+
+        manifests_root = output_path / "manifests"
+        for package_id, version in stale:
+            pub, pkg = package_id.split(".", 1)
+            version_dir = _patched_version_dir(output_path, pub, pkg, version)
+            shutil.rmtree(version_dir, ignore_errors=True)
+            # Prune package, publisher and letter directories left empty
+            parent = version_dir.parent
+            while parent != manifests_root and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            print(f"Removed stale patched manifests for {package_id} {version}")
+        return len(stale)
+
 class WingetPackage:
     def __init__(self, manager, package_id):
         self.manager = manager
@@ -418,40 +1752,40 @@ class WingetPackage:
 
     def get_latest_version(self):
         """Get the latest version of this package from the repository."""
-        manifests_dir = self.manager.mirror_dir / 'manifests'
-        first_letter = self.pub[0].lower()
-        publisher_path = manifests_dir / first_letter / self.pub
-        package_path = publisher_path / self.pkg
+        if self.manager.index is not None:
+            return self.manager.index.latest_version(self.package_id)
 
-        if not package_path.is_dir():
+        if self.manager.tree is None:
             return None
-
-        versions = [p.name for p in package_path.iterdir() if p.is_dir()]
-        valid_versions = []
-        for v in versions:
-            try:
-                parse_version_safe(v)
-                valid_versions.append(v)
-            except:
-                continue
-
-        if not valid_versions:
+        versions = self.manager.tree.versions(self.pub, self.pkg)
+        if not versions:
             return None
 
-        return max(valid_versions, key=parse_version_safe)
+        return max(versions, key=version_sort_key)
 
     def download(self, version=None):
         """Download the latest version of this package."""
         downloaded = self.manager.state.setdefault('downloads', {})
-        return process_package(self.package_id, self.manager.mirror_dir, self.manager.downloads_dir, downloaded, self.manager.repo, version_filter=version)
+        return process_package(self.package_id, self.manager.mirror_dir, self.manager.downloads_dir, downloaded, self.manager.repo, version_filter=version, **self.manager.download_options())
 
-    def validate_hashes(self):
+    def validate_hashes(self, jobs=1):
         """Validate SHA256 hashes of downloaded files for this package."""
+        return self.manager.validate_hashes([self.package_id], jobs=jobs)["packages"][self.package_id]
+
+    def plan_validation(self):
+        """Compare the download directories with state, without hashing anything.
+
+        Returns:
+            tuple: (results, checks) where results has the validate_hashes shape with
+            the "files" entries still empty, and checks lists the
+            (version, filename, filepath, expected_hash) files that need hashing.
+        """
         package_info = self.manager.state.get('downloads', {}).get(self.package_id)
         if not package_info:
-            return {"valid": False, "error": "Package not in state"}
+            return {"valid": False, "error": "Package not in state"}, []
 
         results = {"valid": True, "versions": {}}
+        checks = []
 
         for version, vdata in package_info.get("versions", {}).items():
             expected_files = vdata.get("files", {})
@@ -480,20 +1814,7 @@ class WingetPackage:
                     version_results["missing_files"].append(filename)
                     version_results["valid"] = False
                     continue
-
-                filepath = actual_files[filename]
-                with open(filepath, 'rb') as f:
-                    computed_hash = hashlib.sha256(f.read()).hexdigest()
-
-                match = computed_hash == expected_hash
-                status = "MATCH" if match else "MISMATCH"
-                version_results["files"][filename] = {
-                    "status": status,
-                    "expected": expected_hash,
-                    "computed": computed_hash
-                }
-                if not match:
-                    version_results["valid"] = False
+                checks.append((version, filename, actual_files[filename], expected_hash))
 
             expected_filenames = set(expected_files.keys())
             actual_filenames = set(actual_files.keys())
@@ -505,7 +1826,7 @@ class WingetPackage:
             if not version_results["valid"]:
                 results["valid"] = False
 
-        return results
+        return results, checks
 
     def purge(self, version=None):
         """Purge downloaded files, state, and patched manifests for this package.
@@ -521,15 +1842,7 @@ class WingetPackage:
             return False
 
         purged_any = False
-
-        # Resolve patch_dir to an absolute path for reliability
-        patch_root_cfg = self.manager.config.get("patch_dir", "patched-manifests")
-        patch_root = Path(patch_root_cfg)
-        if not patch_root.is_absolute():
-            # Prefer anchoring to the repo root or a known base; adjust as needed
-            base = getattr(self.manager, "repo_root", Path.cwd())
-            patch_root = (base / patch_root).resolve()
-
+        purged = []
         for v in list(versions.keys()):
             if version and v != version:
                 continue
@@ -540,41 +1853,21 @@ class WingetPackage:
                 shutil.rmtree(package_dir)
             print(f"Downloads removed (or not present): {package_dir}")
 
-            # Remove patched manifests
-            first_letter = self.pub[0].lower()
-            patched_dir = patch_root / "manifests" / first_letter / self.pub / self.pkg / v
-            print(f"Attempting to remove patched manifests at: {patched_dir}")
-
-            if patched_dir.exists():
-                shutil.rmtree(patched_dir)
-                print(f"Removed patched manifests for {self.package_id} {v}")
-            else:
-                # Extra diagnostics to spot mismatches
-                print("Patched manifests directory not found.")
-                print(f"Exists check — parent package dir: {(patch_root / 'manifests' / first_letter / self.pub / self.pkg)}")
-                print(f"Exists check — publisher dir: {(patch_root / 'manifests' / first_letter / self.pub)}")
-                print(f"Exists check — letter dir: {(patch_root / 'manifests' / first_letter)}")
-                # Optional: list nearby entries for visual confirmation
-                parent_pkg_dir = (patch_root / "manifests" / first_letter / self.pub / self.pkg)
-                if parent_pkg_dir.exists():
-                    try:
-                        print("Contents of package dir:")
-                        for child in parent_pkg_dir.iterdir():
-                            print(f"  - {child.name}")
-                    except Exception:
-                        pass
-
             # Remove from state
             del versions[v]
+            purged.append((self.package_id, v))
             purged_any = True
             print(f"Purged {self.package_id} {v}")
 
+        # Patched manifests are removed in a new generation, never in the published tree
+        self.manager.unpublish_patches(purged)
+
         # If no versions left, remove package entry entirely
         if not versions:
             del self.manager.state["downloads"][self.package_id]
 
         if purged_any:
-            self.manager.save_state()
+            self.manager.save_state(package_ids=[self.package_id])
         return purged_any
 
     def get_status(self):
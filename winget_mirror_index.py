@@ -0,0 +1,448 @@
+import difflib
+import os
+import sqlite3
+from pathlib import Path
+from winget_mirror_manifest import load_manifest, YAMLError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS packages (
+    package_id TEXT PRIMARY KEY,
+    publisher TEXT NOT NULL,
+    package TEXT NOT NULL,
+    publisher_lower TEXT NOT NULL,
+    package_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packages_publisher ON packages (publisher_lower, package_lower);
+CREATE TABLE IF NOT EXISTS versions (
+    package_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    sort_key INTEGER NOT NULL,
+    manifest_dir TEXT NOT NULL,
+    PRIMARY KEY (package_id, version)
+);
+CREATE TABLE IF NOT EXISTS manifests (
+    package_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (package_id, version, filename)
+);
+CREATE TABLE IF NOT EXISTS installers (
+    package_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    architecture TEXT,
+    url TEXT,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS installers_version ON installers (package_id, version);
+CREATE INDEX IF NOT EXISTS installers_sha256 ON installers (sha256);
+CREATE TABLE IF NOT EXISTS metadata (
+    package_id TEXT PRIMARY KEY,
+    version TEXT,
+    name TEXT,
+    moniker TEXT,
+    tags TEXT,
+    publisher_name TEXT,
+    description TEXT
+);
+"""
+
+# Trigram full-text index over the metadata table; needs SQLite 3.34+ built with FTS5.
+# rowid matches the metadata row of the same package.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS metadata_search USING fts5(
+    package_id, name, moniker, tags, publisher_name, description, tokenize='trigram'
+);
+"""
+
+INDEX_FORMAT = '2'
+"""Bumped whenever the index schema changes, so older index.db files are rebuilt."""
+
+SEARCH_FIELDS = ('PackageName', 'Moniker', 'Tags', 'Publisher', 'ShortDescription')
+
+def _prefix_range(prefix):
+    """Return (low, high) bounds matching every string that starts with prefix."""
+    return prefix, prefix + '\U0010ffff'
+
+def read_installers(tree, pub, pkg, version):
+    """Return the Installers list of a package version's manifests.
+
+    Prefers the multi-file '<id>.installer.yaml' manifest and falls back to
+    the singleton '<id>.yaml' manifest, like process_package does.
+    """
+    package_id = f'{pub}.{pkg}'
+    data = tree.read(pub, pkg, version, f'{package_id}.installer.yaml')
+    if data is None:
+        data = tree.read(pub, pkg, version, f'{package_id}.yaml')
+    if data is None:
+        return []
+    try:
+        manifest = load_manifest(data)
+    except YAMLError:
+        return []
+    if not isinstance(manifest, dict):
+        return []
+    return manifest.get('Installers') or []
+
+def read_metadata(tree, pub, pkg, version):
+    """Return the search fields of a package version's default locale manifest.
+
+    The default locale is named by the version manifest's DefaultLocale; for
+    singleton manifests the fields are read from '<id>.yaml' itself.
+
+    Returns:
+        dict: The SEARCH_FIELDS present in the manifest (empty if none)
+    """
+    package_id = f'{pub}.{pkg}'
+    manifest = _load(tree.read(pub, pkg, version, f'{package_id}.yaml'))
+    if manifest.get('ManifestType') != 'singleton':
+        locale = manifest.get('DefaultLocale') or 'en-US'
+        manifest = _load(tree.read(pub, pkg, version, f'{package_id}.locale.{locale}.yaml'))
+    return {field: manifest[field] for field in SEARCH_FIELDS if manifest.get(field)}
+
+def _load(data):
+    if data is None:
+        return {}
+    try:
+        manifest = load_manifest(data)
+    except YAMLError:
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+class ManifestIndex:
+    """SQLite index of publishers, packages, versions and installers in the manifests tree.
+
+    The index mirrors the '<letter>/<publisher>/<package>/<version>' layout of
+    the winget-pkgs 'manifests' directory, read through a WorkingTree or
+    GitObjectTree, so lookups that used to walk the tree become indexed
+    queries. Versions carry a sort_key, their rank within
+    the package according to version_key, so the latest version is the one
+    with the highest sort_key.
+    """
+
+    def __init__(self, db_path, version_key):
+        self.db_path = Path(db_path)
+        self.version_key = version_key
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.executescript(SEARCH_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def git_rev(self):
+        """Revision of the manifests tree the index was built from, or None if never built."""
+        return self.get_meta('git_rev')
+
+    @property
+    def version_scheme(self):
+        """Name of the version ordering the sort keys were computed with."""
+        return self.get_meta('version_scheme')
+
+    @property
+    def format(self):
+        """INDEX_FORMAT the index was built with, or None for indexes older than the format marker."""
+        return self.get_meta('format')
+
+    @classmethod
+    def build(cls, db_path, tree, git_rev, version_key, version_scheme=None):
+        """Build a fresh index of tree and atomically replace db_path with it.
+
+        Returns:
+            ManifestIndex: The newly built index.
+        """
+        db_path = Path(db_path)
+        tmp_path = db_path.with_name(db_path.name + '.tmp')
+        tmp_path.unlink(missing_ok=True)
+
+        tree.prefetch()
+        index = cls(tmp_path, version_key)
+        with index.conn:
+            for pub, pkg, versions in tree.walk():
+                index._add_package(tree, pub, pkg, versions)
+            index.set_meta('git_rev', git_rev)
+            index.set_meta('version_scheme', version_scheme)
+            index.set_meta('format', INDEX_FORMAT)
+        index.close()
+
+        os.replace(tmp_path, db_path)
+        return cls(db_path, version_key)
+
+    def update(self, tree, package_keys, git_rev):
+        """Re-index only the given (publisher, package) pairs and record git_rev.
+
+        Packages that no longer exist in tree are dropped from the index.
+        """
+        with self.conn:
+            for pub, pkg in package_keys:
+                package_id = f'{pub}.{pkg}'
+                if self.fts:
+                    self.conn.execute(
+                        "DELETE FROM metadata_search WHERE rowid IN (SELECT rowid FROM metadata WHERE package_id = ?)",
+                        (package_id,)
+                    )
+                for table in ('packages', 'versions', 'manifests', 'installers', 'metadata'):
+                    self.conn.execute(f"DELETE FROM {table} WHERE package_id = ?", (package_id,))
+                versions = tree.versions(pub, pkg)
+                if versions:
+                    tree.prefetch([(pub, pkg, version) for version in versions])
+                    self._add_package(tree, pub, pkg, versions)
+            self.set_meta('git_rev', git_rev)
+
+    def _add_package(self, tree, pub, pkg, version_names):
+        package_id = f'{pub}.{pkg}'
+        self.conn.execute(
+            "INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)",
+            (package_id, pub, pkg, pub.lower(), pkg.lower())
+        )
+        ranked = sorted(version_names, key=self.version_key)
+        for rank, version in enumerate(ranked):
+            self.conn.execute(
+                "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)",
+                (package_id, version, rank, f'manifests/{pub[0].lower()}/{pub}/{pkg}/{version}')
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)",
+                [(package_id, version, name) for name in tree.files(pub, pkg, version) or []]
+            )
+            self.conn.executemany(
+                "INSERT INTO installers VALUES (?, ?, ?, ?, ?)",
+                [
+                    (package_id, version, inst.get('Architecture'), inst.get('InstallerUrl'),
+                     (inst.get('InstallerSha256') or '').lower() or None)
+                    for inst in read_installers(tree, pub, pkg, version) if isinstance(inst, dict)
+                ]
+            )
+        if ranked:
+            self._add_metadata(package_id, ranked[-1], read_metadata(tree, pub, pkg, ranked[-1]))
+
+    def _add_metadata(self, package_id, version, metadata):
+        tags = metadata.get('Tags') or []
+        if not isinstance(tags, list):
+            tags = [tags]
+        row = (
+            package_id,
+            version,
+            str(metadata.get('PackageName', '')),
+            str(metadata.get('Moniker', '')),
+            ', '.join(str(tag) for tag in tags),
+            str(metadata.get('Publisher', '')),
+            str(metadata.get('ShortDescription', '')),
+        )
+        cursor = self.conn.execute(
+            "INSERT INTO metadata (package_id, version, name, moniker, tags, publisher_name, description) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            row
+        )
+        if self.fts:
+            self.conn.execute(
+                "INSERT INTO metadata_search (rowid, package_id, name, moniker, tags, publisher_name, description) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cursor.lastrowid, package_id) + row[2:]
+            )
+
+    def publishers(self, prefix):
+        """Return publishers whose name starts with prefix (case-insensitive)."""
+        low, high = _prefix_range(prefix.lower())
+        rows = self.conn.execute(
+            "SELECT DISTINCT publisher FROM packages WHERE publisher_lower >= ? AND publisher_lower < ? "
+            "ORDER BY publisher",
+            (low, high)
+        )
+        return [row[0] for row in rows]
+
+    def packages(self, publisher, prefix=''):
+        """Return package names of publisher whose name starts with prefix (case-insensitive)."""
+        low, high = _prefix_range(prefix.lower())
+        rows = self.conn.execute(
+            "SELECT package FROM packages WHERE publisher = ? AND package_lower >= ? AND package_lower < ? "
+            "ORDER BY package",
+            (publisher, low, high)
+        )
+        return [row[0] for row in rows]
+
+    def versions(self, package_id):
+        """Return the versions of package_id, oldest first."""
+        rows = self.conn.execute(
+            "SELECT version FROM versions WHERE package_id = ? ORDER BY sort_key", (package_id,)
+        )
+        return [row[0] for row in rows]
+
+    def latest_version(self, package_id):
+        row = self.conn.execute(
+            "SELECT version FROM versions WHERE package_id = ? ORDER BY sort_key DESC LIMIT 1", (package_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def manifest_paths(self, package_id, version):
+        """Return the repository-relative paths of the manifest files of one package version."""
+        row = self.conn.execute(
+            "SELECT manifest_dir FROM versions WHERE package_id = ? AND version = ?", (package_id, version)
+        ).fetchone()
+        if not row:
+            return []
+        rows = self.conn.execute(
+            "SELECT filename FROM manifests WHERE package_id = ? AND version = ? ORDER BY filename",
+            (package_id, version)
+        )
+        return [f'{row[0]}/{name}' for (name,) in rows]
+
+    def installers(self, package_id, version):
+        """Return the installers of one package version as dicts."""
+        rows = self.conn.execute(
+            "SELECT architecture, url, sha256 FROM installers WHERE package_id = ? AND version = ?",
+            (package_id, version)
+        )
+        return [{'Architecture': a, 'InstallerUrl': u, 'InstallerSha256': h} for a, u, h in rows]
+
+    def package_metadata(self, package_id):
+        """Return the search metadata of package_id's latest version, shaped like a search() result, or None."""
+        row = self.conn.execute(
+            f"SELECT {self._COLUMNS} FROM metadata m WHERE m.package_id = ?", (package_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        package_id, version, name, moniker, tags, publisher, description = row
+        return {
+            'package_id': package_id,
+            'version': version,
+            'name': name,
+            'moniker': moniker,
+            'tags': [tag for tag in tags.split(', ') if tag] if tags else [],
+            'publisher': publisher,
+            'description': description,
+        }
+
+    def search(self, query, limit=50):
+        """Return the packages whose metadata best matches query, best first.
+
+        Every whitespace-separated term must match the package identifier,
+        PackageName, Moniker, a tag, the publisher or the ShortDescription,
+        as a whole value, a prefix or a substring; earlier fields and closer
+        matches rank higher. Candidates come from the trigram index when
+        SQLite supports it. If no package matches, packages with an
+        identifier, name, moniker or tag similar to every term are returned
+        instead, so small typos still find the package.
+
+        Returns:
+            list: Dicts with package_id, version (the latest), name, moniker,
+            tags, publisher, description, match ('exact', 'prefix',
+            'substring' or 'fuzzy') and score.
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        results = self._rank(self._candidates(terms), terms)
+        if not results:
+            results = self._rank(self._fuzzy_candidates(terms), terms, fuzzy=True)
+        results.sort(key=lambda r: (-r['score'], r['package_id'].lower()))
+        return results[:limit]
+
+    _COLUMNS = "m.package_id, m.version, m.name, m.moniker, m.tags, m.publisher_name, m.description"
+
+    def _candidates(self, terms):
+        long_terms = [term for term in terms if len(term) >= 3]
+        if self.fts and long_terms:
+            return self.conn.execute(
+                f"SELECT {self._COLUMNS} FROM metadata_search s JOIN metadata m ON m.rowid = s.rowid "
+                "WHERE metadata_search MATCH ?",
+                (' AND '.join(_fts_phrase(term) for term in long_terms),)
+            ).fetchall()
+        # Trigrams need at least three characters; short queries scan the metadata table
+        return self.conn.execute(f"SELECT {self._COLUMNS} FROM metadata m").fetchall()
+
+    def _fuzzy_candidates(self, terms, limit=500):
+        if not self.fts:
+            return self.conn.execute(f"SELECT {self._COLUMNS} FROM metadata m").fetchall()
+        trigrams = set().union(*(_trigrams(term) for term in terms))
+        if not trigrams:
+            return []
+        return self.conn.execute(
+            f"SELECT {self._COLUMNS} FROM metadata_search s JOIN metadata m ON m.rowid = s.rowid "
+            "WHERE metadata_search MATCH ? ORDER BY rank LIMIT ?",
+            (' OR '.join(_fts_phrase(trigram) for trigram in sorted(trigrams)), limit)
+        ).fetchall()
+
+    @staticmethod
+    def _rank(rows, terms, fuzzy=False):
+        kinds = ('fuzzy', 'substring', 'prefix', 'exact')
+        phrase = ' '.join(terms)
+        results = []
+        for package_id, version, name, moniker, tags, publisher, description in rows:
+            tag_list = [tag for tag in tags.split(', ') if tag] if tags else []
+            primary = [package_id.lower(), package_id.split('.', 1)[-1].lower(), name.lower(), moniker.lower()]
+            words = {word for field in primary for word in field.replace('.', ' ').replace('-', ' ').split()}
+            lower_tags = [tag.lower() for tag in tag_list]
+
+            total = 0
+            weakest = 'exact'
+            for term in terms:
+                score, kind = _term_score(term, primary, words, lower_tags, publisher.lower(), description.lower())
+                if not score and fuzzy:
+                    ratio = max(
+                        (difflib.SequenceMatcher(None, term, candidate).ratio()
+                         for candidate in words | set(primary) | set(lower_tags)),
+                        default=0
+                    )
+                    if ratio >= 0.75:
+                        score, kind = int(ratio * 40), 'fuzzy'
+                if not score:
+                    break
+                total += score
+                weakest = min(weakest, kind, key=kinds.index)
+            else:
+                if phrase in primary:
+                    total += 100
+                results.append({
+                    'package_id': package_id,
+                    'version': version,
+                    'name': name,
+                    'moniker': moniker,
+                    'tags': tag_list,
+                    'publisher': publisher,
+                    'description': description,
+                    'match': weakest,
+                    'score': total,
+                })
+        return results
+
+def _term_score(term, primary, words, tags, publisher, description):
+    """Score one lowercase search term against a package's lowercase fields."""
+    if term in primary:
+        return 100, 'exact'
+    if term in tags:
+        return 90, 'exact'
+    if any(field.startswith(term) for field in primary):
+        return 80, 'prefix'
+    if any(word.startswith(term) for word in words):
+        return 70, 'prefix'
+    if any(tag.startswith(term) for tag in tags):
+        return 60, 'prefix'
+    if any(term in field for field in primary):
+        return 50, 'substring'
+    if any(term in tag for tag in tags) or term in publisher:
+        return 40, 'substring'
+    if term in description:
+        return 20, 'substring'
+    return 0, None
@@ -0,0 +1,126 @@
+import json
+import re
+
+import yaml
+
+# libyaml's C parser/emitter is several times faster than the pure-Python
+# implementation; PyYAML only provides it when built against libyaml.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+YAMLError = yaml.YAMLError
+
+def using_libyaml():
+    """Return True if manifests are parsed and emitted by libyaml."""
+    return SafeLoader is not yaml.SafeLoader
+
+def load_manifest(data, loader=None):
+    """Parse a manifest from bytes or str.
+
+    Args:
+        data: Manifest content
+        loader: Loader class to use instead of SafeLoader
+
+    Returns:
+        The parsed document (normally a dict)
+    """
+    return yaml.load(data, Loader=loader or SafeLoader)
+
+def dump_manifest(manifest, stream=None, dumper=None):
+    """Emit a manifest as block-style YAML, keeping key order.
+
+    Args:
+        manifest: Document to emit
+        stream: File object to write to; if None the YAML is returned as a str
+        dumper: Dumper class to use instead of SafeDumper
+    """
+    return yaml.dump(
+        manifest, stream, Dumper=dumper or SafeDumper,
+        default_flow_style=False, sort_keys=False
+    )
+
+INSTALLER_MANIFEST_TYPES = ('installer', 'singleton')
+
+_MANIFEST_TYPE = re.compile(r'^ManifestType[ \t]*:[ \t]*["\']?([A-Za-z]+)', re.MULTILINE)
+_INSTALLER_URL_KEY = re.compile(r'^[ \t]*(?:-[ \t]+)?["\']?InstallerUrl\b')
+# A plain value may not start with a YAML indicator (block scalar, anchor,
+# alias, tag, directive, reserved or flow collection); those lines are
+# left to the YAML round trip.
+_INSTALLER_URL_LINE = re.compile(
+    r'^(?P<prefix>(?P<indent>[ \t]*(?:-[ \t]+)?)InstallerUrl[ \t]*:[ \t]+)'
+    r'(?P<value>"(?:[^"\\\r\n]|\\.)*"|\'(?:[^\'\r\n]|\'\')*\'|[^ \t#"\'|>&*!%@`{}\[\]\r\n][^\r\n]*?)'
+    r'(?P<suffix>[ \t]+#[^\r\n]*|[ \t]*)(?P<eol>\r?\n?)$'
+)
+_PLAIN_SAFE = re.compile(r'[A-Za-z0-9][^\s#\'"]*')
+
+def _quote_like(url, original):
+    """Render url as a YAML scalar in the quoting style of original."""
+    if original.startswith('"'):
+        return json.dumps(url)
+    if original.startswith("'") or not _PLAIN_SAFE.fullmatch(url) or url.endswith(':'):
+        return "'" + url.replace("'", "''") + "'"
+    return url
+
+def rewrite_installer_urls(data, new_url):
+    """Replace the InstallerUrl values of an installer or singleton manifest in place.
+
+    Only the scalar after each 'InstallerUrl:' key is substituted; comments,
+    key order, quoting and line endings of the original bytes are kept.
+    Manifests of other types are returned unchanged.
+
+    Args:
+        data: Manifest bytes
+        new_url: Function mapping an original InstallerUrl to its replacement
+
+    Returns:
+        tuple: (new bytes, [(original_url, replacement_url), ...]), or None if
+        the manifest uses YAML constructs this rewriter does not handle
+        (flow mappings, multi-line scalars, ...) and must be round-tripped instead.
+    """
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    match = _MANIFEST_TYPE.search(text)
+    if match is None:
+        return None
+    if match.group(1).lower() not in INSTALLER_MANIFEST_TYPES:
+        return data, []
+
+    lines = re.findall(r'[^\n]*\n|[^\n]+', text)
+    replaced = []
+    found = 0
+    for i, line in enumerate(lines):
+        if 'InstallerUrl' not in line:
+            continue
+        found += line.count('InstallerUrl')
+        if not _INSTALLER_URL_KEY.match(line):
+            return None
+        m = _INSTALLER_URL_LINE.match(line)
+        if m is None:
+            return None
+
+        value = m.group('value')
+        if value[0] in '"\'':
+            original_url = load_manifest(value)
+        else:
+            # A plain scalar may continue on more-indented lines
+            column = len(m.group('indent'))
+            for following in lines[i + 1:]:
+                stripped = following.lstrip(' \t')
+                if not stripped.strip() or stripped.startswith('#'):
+                    continue
+                if len(following) - len(stripped) > column:
+                    return None
+                break
+            original_url = value
+        if not isinstance(original_url, str):
+            return None
+
+        url = new_url(original_url)
+        lines[i] = m.group('prefix') + _quote_like(url, value) + m.group('suffix') + m.group('eol')
+        replaced.append((original_url, url))
+
+    if found != len(replaced):
+        return None
+    return ''.join(lines).encode('utf-8'), replaced
@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+def _mbps_to_bytes(mbps):
+    """Convert a megabits-per-second setting to bytes per second (None/0 = unlimited)."""
+    return mbps * 1_000_000 / 8 if mbps else None
+
+def resume_validator(headers):
+    """Return a validator usable in If-Range, or None. Weak ETags are not allowed there."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, holding at most burst tokens.
+
+    consume() blocks until the requested tokens are available. A bucket
+    with rate None never blocks.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount):
+        """Take amount tokens if available; otherwise return the seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Amounts larger than the bucket are let through once it is full
+            needed = min(amount, self.burst)
+            if self._tokens >= needed:
+                self._tokens -= amount
+                return 0
+            return (needed - self._tokens) / self.rate
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        while wait := self._reserve(amount):
+            time.sleep(wait)
+
+    async def consume_async(self, amount):
+        """Like consume(), but waits without blocking the event loop."""
+        if not self.rate:
+            return
+        while wait := self._reserve(amount):
+            await asyncio.sleep(wait)
+
+def _cap_concurrency(settings, pool_size, name):
+    """Limit settings['max_concurrency'] to the connection pool size pool_size."""
+    if not pool_size:
+        return settings
+    concurrency = settings.get('max_concurrency')
+    if concurrency is None:
+        settings['max_concurrency'] = pool_size
+    elif concurrency > pool_size:
+        print(f"Warning: {name}.max_concurrency ({concurrency}) exceeds http.max_connections_per_host "
+              f"({pool_size}); using {pool_size}")
+        settings['max_concurrency'] = pool_size
+    return settings
+
+class _HostLimits:
+    def __init__(self, max_concurrency, bandwidth, requests_per_second):
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.bandwidth = TokenBucket(bandwidth)
+        self.requests = TokenBucket(requests_per_second, 1) if requests_per_second else TokenBucket(None)
+
+class Throttle:
+    """Bandwidth accounting for one transfer; charge() blocks to keep within the limits."""
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+
+    def charge(self, nbytes):
+        for bucket in self._buckets:
+            bucket.consume(nbytes)
+
+    async def charge_async(self, nbytes):
+        for bucket in self._buckets:
+            await bucket.consume_async(nbytes)
+
+class DownloadScheduler:
+    """Per-host and global limits for installer downloads.
+
+    - a global token bucket caps total bandwidth,
+    - each host gets a concurrency cap, an optional bandwidth cap and an
+      optional request rate,
+    - per-host settings can be overridden for individual hosts (a host entry
+      also applies to its subdomains).
+
+    Built from the 'network' section of config.json. Per-host concurrency
+    can not exceed the HTTP connection pool ('http.max_connections_per_host'),
+    since every transfer needs a pooled connection; from_config() caps it
+    there.
+    """
+
+    DEFAULT_HOST = {
+        "max_concurrency": 4,
+        "max_bandwidth_mbps": None,
+        "requests_per_second": None,
+    }
+
+    def __init__(self, max_bandwidth_mbps=None, per_host=None, hosts=None, small_first=True):
+        self.bandwidth = TokenBucket(_mbps_to_bytes(max_bandwidth_mbps))
+        self.per_host = {**self.DEFAULT_HOST, **(per_host or {})}
+        self.hosts = {name.lower(): settings for name, settings in (hosts or {}).items()}
+        self.small_first = small_first
+        self._limits = {}
+        self._async_slots = {}
+        self._async_loop = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a scheduler from the 'network' section of config.json.
+
+        max_concurrency is limited to http.max_connections_per_host: null
+        means as many transfers as the connection pool allows, and larger
+        values are capped with a warning.
+        """
+        network_cfg = config.get('network', {})
+        pool_size = config.get('http', {}).get('max_connections_per_host', 4)
+        per_host = _cap_concurrency(
+            {**cls.DEFAULT_HOST, **(network_cfg.get('per_host') or {})}, pool_size, 'network.per_host'
+        )
+        hosts = {
+            name: _cap_concurrency(dict(settings), pool_size, f'network.hosts.{name}')
+            if 'max_concurrency' in settings else settings
+            for name, settings in (network_cfg.get('hosts') or {}).items()
+        }
+        return cls(
+            max_bandwidth_mbps=network_cfg.get('max_bandwidth_mbps'),
+            per_host=per_host,
+            hosts=hosts,
+            small_first=network_cfg.get('small_first', True),
+        )
+
+    def _settings_for(self, host):
+        settings = dict(self.per_host)
+        for name, overrides in self.hosts.items():
+            if host == name or host.endswith('.' + name):
+                settings.update(overrides)
+                break
+        return settings
+
+    def _host_limits(self, host):
+        with self._lock:
+            limits = self._limits.get(host)
+            if limits is None:
+                settings = self._settings_for(host)
+                limits = self._limits[host] = _HostLimits(
+                    settings.get('max_concurrency'),
+                    _mbps_to_bytes(settings.get('max_bandwidth_mbps')),
+                    settings.get('requests_per_second'),
+                )
+            return limits
+
+    @contextmanager
+    def slot(self, url):
+        """Hold one of the host's transfer slots for the duration of the block.
+
+        Yields:
+            Throttle: Call charge(n) for every n bytes received.
+        """
+        host = (urlparse(url).hostname or '').lower()
+        limits = self._host_limits(host)
+        if limits.slots is not None:
+            limits.slots.acquire()
+        try:
+            limits.requests.consume(1)
+            yield Throttle([self.bandwidth, limits.bandwidth])
+        finally:
+            if limits.slots is not None:
+                limits.slots.release()
+
+    @asynccontextmanager
+    async def async_slot(self, url):
+        """Asyncio counterpart of slot(), for downloads running on an event loop."""
+        host = (urlparse(url).hostname or '').lower()
+        limits = self._host_limits(host)
+        loop = asyncio.get_running_loop()
+        if loop is not self._async_loop:
+            # asyncio semaphores are bound to the loop they are first used on, and
+            # the HEAD probe and the downloads each run on their own loop
+            self._async_loop = loop
+            self._async_slots = {}
+        slots = self._async_slots.get(host)
+        if slots is None and limits.slots is not None:
+            slots = self._async_slots[host] = asyncio.Semaphore(limits.max_concurrency)
+        if slots is not None:
+            await slots.acquire()
+        try:
+            await limits.requests.consume_async(1)
+            yield Throttle([self.bandwidth, limits.bandwidth])
+        finally:
+            if slots is not None:
+                slots.release()
@@ -0,0 +1,131 @@
+import datetime
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+GENERATIONS_SUFFIX = '.generations'
+
+def generations_dir(published_path):
+    """Return the directory holding the generations published at published_path."""
+    published_path = Path(published_path)
+    return published_path.with_name(published_path.name + GENERATIONS_SUFFIX)
+
+def list_generations(published_path):
+    """Return the generation names, oldest first."""
+    root = generations_dir(published_path)
+    if not root.is_dir():
+        return []
+    return sorted(p.name for p in root.iterdir() if p.is_dir() and not p.name.startswith('.'))
+
+def current_generation(published_path):
+    """Return the name of the published generation, or None if published_path is not a generation link."""
+    published_path = Path(published_path)
+    if not published_path.is_symlink():
+        return None
+    target = Path(os.readlink(published_path))
+    if target.parent.name != generations_dir(published_path).name:
+        return None
+    return target.name
+
+def _new_name(root):
+    name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    candidate, n = name, 0
+    while (root / candidate).exists():
+        n += 1
+        candidate = f'{name}-{n}'
+    return candidate
+
+def _link_tree(source, target):
+    """Recreate the tree at source under target, hardlinking every file."""
+    for root, dirs, files in os.walk(source):
+        relative = Path(root).relative_to(source)
+        (target / relative).mkdir(exist_ok=True)
+        for name in files:
+            src = Path(root) / name
+            dst = target / relative / name
+            try:
+                os.link(src, dst)
+            except OSError:
+                # Cross-device or no hardlink support
+                shutil.copy2(src, dst)
+
+def new_generation(published_path):
+    """Create the next generation as a hardlinked copy of the published one.
+
+    Files in the new generation share their inodes with the published
+    generation, so they must be replaced (write a temporary file, then
+    os.replace) rather than rewritten in place. A published_path that is
+    still a plain directory is first moved into the generations directory
+    as the initial generation.
+
+    Returns:
+        Path: The new, unpublished generation directory.
+    """
+    published_path = Path(published_path)
+    root = generations_dir(published_path)
+    root.mkdir(parents=True, exist_ok=True)
+
+    if published_path.is_dir() and not published_path.is_symlink():
+        initial = root / _new_name(root)
+        print(f"Moving {published_path} into {initial}")
+        os.rename(published_path, initial)
+        publish(published_path, initial.name)
+
+    generation = root / _new_name(root)
+    current = current_generation(published_path)
+    if current and (root / current).is_dir():
+        try:
+            _link_tree(root / current, generation)
+        except BaseException:
+            discard_generation(generation)
+            raise
+    else:
+        generation.mkdir()
+    return generation
+
+@contextmanager
+def staged_generation(published_path):
+    """Yield a new generation (see new_generation) and delete it again if the block raises.
+
+    A generation the block already published is kept.
+    """
+    generation = new_generation(published_path)
+    try:
+        yield generation
+    except BaseException:
+        if current_generation(published_path) != generation.name:
+            discard_generation(generation)
+        raise
+
+def publish(published_path, name):
+    """Atomically point published_path at generation name.
+
+    A new symlink is created next to published_path and renamed over it,
+    so readers see either the old or the new generation, never a mix.
+    """
+    published_path = Path(published_path)
+    root = generations_dir(published_path)
+    if not (root / name).is_dir():
+        raise ValueError(f"Unknown generation: {name}")
+    tmp_link = published_path.with_name(published_path.name + '.tmp-link')
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(os.path.join(root.name, name), tmp_link, target_is_directory=True)
+    os.replace(tmp_link, published_path)
+
+def discard_generation(generation):
+    """Delete an unpublished generation directory."""
+    shutil.rmtree(generation, ignore_errors=True)
+
+def prune_generations(published_path, keep):
+    """Delete all but the keep newest generations; the published one is always kept.
+
+    Returns:
+        list: Names of the deleted generations.
+    """
+    current = current_generation(published_path)
+    names = list_generations(published_path)
+    stale = [name for name in names[:max(0, len(names) - keep)] if name != current]
+    for name in stale:
+        shutil.rmtree(generations_dir(published_path) / name, ignore_errors=True)
+    return stale
@@ -0,0 +1,473 @@
+import datetime
+import difflib
+import fnmatch
+import hashlib
+import json
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from winget_mirror_core import PATCH_STATE_FILE, version_sort_key
+from winget_mirror_manifest import load_manifest, YAMLError
+from winget_mirror_tree import WorkingTree
+
+SERVER_SUPPORTED_VERSIONS = ['1.0.0', '1.1.0']
+
+# Fields of a defaultLocale/locale manifest; the rest of a singleton
+# manifest (besides the version fields) describes the installers.
+LOCALE_FIELDS = frozenset([
+    'PackageLocale', 'Publisher', 'PublisherUrl', 'PublisherSupportUrl', 'PrivacyUrl', 'Author',
+    'PackageName', 'PackageUrl', 'License', 'LicenseUrl', 'Copyright', 'CopyrightUrl',
+    'ShortDescription', 'Description', 'Moniker', 'Tags', 'Agreements', 'ReleaseNotes',
+    'ReleaseNotesUrl', 'PurchaseUrl', 'InstallationNotes', 'Documentations', 'Icons',
+])
+VERSION_FIELDS = frozenset([
+    'PackageIdentifier', 'PackageVersion', 'DefaultLocale', 'Channel', 'ManifestType', 'ManifestVersion',
+])
+
+MATCH_FIELDS = ('PackageIdentifier', 'PackageName', 'Moniker', 'Command', 'Tag', 'PackageFamilyName',
+                'ProductCode')
+# Fields a Query keyword is matched against, as winget's own sources do
+QUERY_FIELDS = ('PackageIdentifier', 'PackageName', 'Moniker', 'Command', 'Tag')
+
+RESPONSE_CACHE_SIZE = 4096
+
+def _json_bytes(value):
+    # YAML dates (e.g. ReleaseDate) are not JSON types
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+def _etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def _strip(document, fields):
+    return {key: value for key, value in document.items() if key not in fields}
+
+def rest_version(documents, version=None):
+    """Convert the manifests of one package version to a winget REST 'Versions' entry.
+
+    Installer fields given at the root of the installer manifest are copied
+    into every installer, which is how the REST schema expects them.
+
+    Args:
+        documents: Parsed manifests of the version
+        version: PackageVersion to report, normally the version directory
+            name; an unquoted 'PackageVersion: 1.10' loads as the float 1.1,
+            so the manifest value is only used when this is not given
+    """
+    by_type = {}
+    for document in documents:
+        if isinstance(document, dict):
+            by_type.setdefault(str(document.get('ManifestType', '')).lower(), []).append(document)
+
+    if 'singleton' in by_type:
+        singleton = by_type['singleton'][0]
+        version_manifest = singleton
+        default_locale = {key: value for key, value in singleton.items() if key in LOCALE_FIELDS}
+        installer_manifest = _strip(singleton, LOCALE_FIELDS)
+        locales = []
+    else:
+        version_manifest = (by_type.get('version') or [{}])[0]
+        default_locale = _strip((by_type.get('defaultlocale') or [{}])[0], VERSION_FIELDS)
+        installer_manifest = (by_type.get('installer') or [{}])[0]
+        locales = [_strip(locale, VERSION_FIELDS) for locale in by_type.get('locale', [])]
+
+    root = _strip(installer_manifest, VERSION_FIELDS | {'Installers'})
+    installers = []
+    for installer in installer_manifest.get('Installers') or []:
+        if not isinstance(installer, dict):
+            continue
+        merged = dict(root)
+        for key, value in installer.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = {**merged[key], **value}
+            else:
+                merged[key] = value
+        installers.append(merged)
+
+    entry = {'PackageVersion': version or str(version_manifest.get('PackageVersion', ''))}
+    if version_manifest.get('Channel'):
+        entry['Channel'] = version_manifest['Channel']
+    entry['DefaultLocale'] = default_locale
+    if locales:
+        entry['Locales'] = sorted(locales, key=lambda locale: str(locale.get('PackageLocale', '')))
+    entry['Installers'] = installers
+    return entry
+
+def match_value(value, keyword, match_type):
+    """Apply a winget REST MatchType to one field value."""
+    value = str(value)
+    keyword = str(keyword)
+    if match_type == 'Exact':
+        return value == keyword
+    lowered, keyword = value.lower(), keyword.lower()
+    if match_type == 'CaseInsensitive':
+        return lowered == keyword
+    if match_type == 'StartsWith':
+        return lowered.startswith(keyword)
+    if match_type == 'Wildcard':
+        return fnmatch.fnmatchcase(lowered, keyword)
+    if match_type in ('Fuzzy', 'FuzzySubstring'):
+        if keyword in lowered:
+            return True
+        return difflib.SequenceMatcher(None, keyword, lowered).ratio() >= 0.8
+    # Substring, and anything the client sends that we do not know
+    return keyword in lowered
+
+class _Package:
+    """Pre-serialized REST responses and search fields of one package."""
+
+    def __init__(self, package_id, versions):
+        self.package_id = package_id
+        self.fingerprints = {version: fingerprint for version, (fingerprint, _) in versions.items()}
+        # Converted entries by version directory, reused by the next reload
+        self.entries = {version: entry for version, (_, entry) in versions.items()}
+        entries = sorted(
+            self.entries.values(),
+            key=lambda entry: version_sort_key(entry['PackageVersion']), reverse=True
+        )
+        # Each version is serialized once; responses are assembled from these
+        self.version_json = [(entry['PackageVersion'], entry.get('Channel'), _json_bytes(entry)) for entry in entries]
+
+        latest = entries[0] if entries else {'DefaultLocale': {}, 'Installers': []}
+        locale = latest['DefaultLocale']
+        self.fields = {
+            'PackageIdentifier': [package_id],
+            'PackageName': [locale.get('PackageName') or package_id],
+            'Moniker': [locale['Moniker']] if locale.get('Moniker') else [],
+            'Tag': [str(tag) for tag in locale.get('Tags') or []],
+            'Command': sorted({str(c) for entry in entries for i in entry['Installers'] for c in i.get('Commands') or []}),
+            'PackageFamilyName': sorted({
+                str(i['PackageFamilyName']) for entry in entries for i in entry['Installers']
+                if i.get('PackageFamilyName')
+            }),
+            'ProductCode': sorted({
+                str(code) for entry in entries for i in entry['Installers']
+                for code in [i.get('ProductCode')] + [
+                    e.get('ProductCode') for e in i.get('AppsAndFeaturesEntries') or [] if isinstance(e, dict)
+                ] if code
+            }),
+        }
+        self.search_result = {
+            'PackageIdentifier': package_id,
+            'PackageName': self.fields['PackageName'][0],
+            'Publisher': locale.get('Publisher') or package_id.split('.', 1)[0],
+            'Versions': [
+                {
+                    'PackageVersion': entry['PackageVersion'],
+                    **({'Channel': entry['Channel']} if entry.get('Channel') else {}),
+                    'PackageFamilyNames': sorted({
+                        str(i['PackageFamilyName']) for i in entry['Installers'] if i.get('PackageFamilyName')
+                    }),
+                    'ProductCodes': sorted({str(i['ProductCode']) for i in entry['Installers'] if i.get('ProductCode')}),
+                }
+                for entry in entries
+            ],
+        }
+
+    def matches(self, field, request_match):
+        keyword = request_match.get('KeyWord', '')
+        match_type = request_match.get('MatchType', 'Substring')
+        return any(match_value(value, keyword, match_type) for value in self.fields.get(field, []))
+
+    def manifest_body(self, version=None, channel=None):
+        """Return the packageManifests response body, optionally for one version/channel, or None."""
+        selected = [
+            data for v, c, data in self.version_json
+            if (version is None or v == version) and (channel is None or (c or '') == channel)
+        ]
+        if not selected:
+            return None
+        return (b'{"Data":{"PackageIdentifier":' + _json_bytes(self.package_id)
+                + b',"Versions":[' + b','.join(selected) + b']}}')
+
+class RestCatalog:
+    """In-memory winget REST view of the manifests written by patch_repo.
+
+    Reads '<patch_dir>/.patch-state.json' and the patched manifests it lists.
+    reload() re-reads only the package versions whose patch fingerprint
+    changed, so it is cheap to call after every patch-repo run. Responses
+    are cached as serialized bytes with an ETag until the next change.
+    """
+
+    def __init__(self, patch_dir, source_identifier='winget-mirror'):
+        self.patch_dir = Path(patch_dir)
+        self.state_path = self.patch_dir / PATCH_STATE_FILE
+        self.tree = WorkingTree(self.patch_dir / 'manifests')
+        self.source_identifier = source_identifier
+        self.packages = {}
+        self._state_mtime = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.information = self._response({
+            'Data': {
+                'SourceIdentifier': source_identifier,
+                'ServerSupportedVersions': SERVER_SUPPORTED_VERSIONS,
+                'UnsupportedPackageMatchFields': [],
+                'RequiredPackageMatchFields': [],
+                'UnsupportedQueryParameters': ['Market'],
+                'RequiredQueryParameters': [],
+            }
+        })
+
+    @staticmethod
+    def _response(payload):
+        body = _json_bytes(payload)
+        return body, _etag(body)
+
+    def reload(self):
+        """Pick up changes made by patch_repo since the last call.
+
+        Returns:
+            bool: True if the catalog changed.
+        """
+        try:
+            mtime = self.state_path.stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._state_mtime:
+            return False
+        with open(self.state_path) as f:
+            patched = json.load(f).get('versions', {})
+
+        packages = dict(self.packages)
+        changed = 0
+        for package_id in set(packages) - set(patched):
+            del packages[package_id]
+            changed += 1
+        for package_id, versions in patched.items():
+            current = packages.get(package_id)
+            fingerprints = {version: entry['fingerprint'] for version, entry in versions.items()}
+            if current is not None and current.fingerprints == fingerprints:
+                continue
+            package = self._load_package(package_id, versions)
+            if package is None:
+                packages.pop(package_id, None)
+            else:
+                packages[package_id] = package
+            changed += 1
+
+        # Swap in the new catalog; requests in flight keep the old one
+        with self._lock:
+            self.packages = packages
+            self._cache.clear()
+        self._state_mtime = mtime
+        if changed:
+            print(f"Loaded {changed} changed packages ({len(packages)} total)")
+        return bool(changed)
+
+    def _load_package(self, package_id, versions):
+        pub, pkg = package_id.split('.', 1)
+        current = self.packages.get(package_id)
+        loaded = {}
+        for version, entry in versions.items():
+            if current is not None and current.fingerprints.get(version) == entry['fingerprint']:
+                # Unchanged version: reuse the already converted entry
+                loaded[version] = (entry['fingerprint'], current.entries[version])
+                continue
+            try:
+                documents = [load_manifest(self.tree.read(pub, pkg, version, name) or b'') for name in entry['files']]
+                loaded[version] = (entry['fingerprint'], rest_version(documents, version))
+            except (YAMLError, AttributeError, TypeError) as e:
+                print(f"Warning: Could not load {package_id} {version}: {e}")
+        return _Package(package_id, loaded) if loaded else None
+
+    def _cached(self, key, build):
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+            packages = self.packages
+        response = build(packages)
+        with self._lock:
+            if self.packages is packages:
+                self._cache[key] = response
+                if len(self._cache) > RESPONSE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return response
+
+    def package_manifests(self, package_id, version=None, channel=None):
+        """Return (body, etag) for /packageManifests/{package_id}, or None if unknown."""
+        def build(packages):
+            package = packages.get(package_id)
+            if package is None:
+                return None
+            body = package.manifest_body(version, channel)
+            return None if body is None else (body, _etag(body))
+        return self._cached(('manifests', package_id, version, channel), build)
+
+    def search(self, request):
+        """Return (body, etag) for a /manifestSearch request, or None if nothing matches."""
+        key = ('search', json.dumps(request, sort_keys=True))
+
+        def build(packages):
+            unsupported = set()
+
+            def supported(match):
+                field = match.get('PackageMatchField')
+                if field not in MATCH_FIELDS:
+                    unsupported.add(str(field))
+                    return False
+                return True
+
+            query = request.get('Query') or {}
+            inclusions = [i for i in request.get('Inclusions') or [] if supported(i)]
+            filters = [f for f in request.get('Filters') or [] if supported(f)]
+
+            results = []
+            for package_id in sorted(packages, key=str.lower):
+                package = packages[package_id]
+                if query.get('KeyWord') or inclusions:
+                    included = query.get('KeyWord') and any(package.matches(field, query) for field in QUERY_FIELDS)
+                    if not included and not any(
+                        package.matches(i['PackageMatchField'], i.get('RequestMatch') or {}) for i in inclusions
+                    ):
+                        continue
+                if not all(package.matches(f['PackageMatchField'], f.get('RequestMatch') or {}) for f in filters):
+                    continue
+                results.append(package.search_result)
+
+            maximum = request.get('MaximumResults')
+            if isinstance(maximum, int) and maximum > 0:
+                results = results[:maximum]
+            if not results:
+                return None
+            return self._response({
+                'Data': results,
+                'RequiredPackageMatchFields': [],
+                'UnsupportedPackageMatchFields': sorted(unsupported),
+            })
+        return self._cached(key, build)
+
+class RestRequestHandler(BaseHTTPRequestHandler):
+    """winget REST source endpoints under server.base_path."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'winget-mirror'
+    # Headers and body go out in separate writes; with Nagle's algorithm
+    # each keep-alive response would stall on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b'', etag=None, content_type='application/json'):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if body:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_response(self, response):
+        body, etag = response
+        if etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+            self._send(304, etag=etag)
+        else:
+            self._send(200, body, etag)
+
+    def _error(self, status, code, message):
+        self._send(status, _json_bytes([{'ErrorCode': code, 'ErrorMessage': message}]))
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        base = self.server.base_path
+        if base and not (path == base or path.startswith(base + '/')):
+            return None, {}
+        return path[len(base):].rstrip('/') or '/', parse_qs(parts.query)
+
+    def do_GET(self):
+        path, query = self._route()
+        catalog = self.server.catalog
+        if path == '/information':
+            return self._send_response(catalog.information)
+        if path is not None and path.startswith('/packageManifests/'):
+            package_id = path[len('/packageManifests/'):]
+            response = catalog.package_manifests(
+                package_id, (query.get('Version') or [None])[0], (query.get('Channel') or [None])[0]
+            )
+            if response is None:
+                return self._send(204)
+            return self._send_response(response)
+        if path == '/health':
+            return self._send(200, b'healthy\n', content_type='text/plain')
+        self._error(404, 404, f"Not found: {self.path}")
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path, _ = self._route()
+        if path != '/manifestSearch':
+            return self._error(404, 404, f"Not found: {self.path}")
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            return self._error(400, 400, f"Invalid search request: {e}")
+        response = self.server.catalog.search(request)
+        if response is None:
+            return self._send(204)
+        self._send_response(response)
+
+class RestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, catalog, base_path='', verbose=False):
+        super().__init__(address, RestRequestHandler)
+        self.catalog = catalog
+        self.base_path = '/' + base_path.strip('/') if base_path.strip('/') else ''
+        self.verbose = verbose
+
+def serve(patch_dir, host='127.0.0.1', port=8080, base_path='/api', source_identifier='winget-mirror',
+          reload_interval=5.0, certfile=None, keyfile=None, verbose=False):
+    """Serve the patched manifests as a winget REST source until interrupted.
+
+    The catalog is loaded once at startup and reloaded in the background
+    whenever patch-repo rewrites .patch-state.json. winget only accepts REST
+    sources over HTTPS: pass certfile/keyfile, or put the server behind a
+    TLS-terminating reverse proxy.
+    """
+    catalog = RestCatalog(patch_dir, source_identifier)
+    started = time.perf_counter()
+    catalog.reload()
+    print(f"Loaded {len(catalog.packages)} packages in {time.perf_counter() - started:.2f}s")
+
+    server = RestServer((host, port), catalog, base_path, verbose)
+    scheme = 'http'
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(reload_interval):
+            try:
+                catalog.reload()
+            except (OSError, ValueError) as e:
+                print(f"Warning: Reload failed: {e}")
+
+    threading.Thread(target=watch, name='catalog-reload', daemon=True).start()
+    print(f"Serving winget REST source at {scheme}://{host}:{port}{server.base_path} "
+          f"({datetime.datetime.now().isoformat(timespec='seconds')})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,497 @@
+import base64
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+import zlib
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+from winget_mirror_compress import write_precompressed, precompressed_current, remove_precompressed
+from winget_mirror_manifest import load_manifest, dump_manifest, YAMLError
+
+SOURCE_SCHEMA_VERSION = (1, 0)
+"""Version of the winget pre-indexed source schema written to index.db."""
+
+# The winget 1.0 pre-indexed schema: one-to-one value tables, path parts
+# forming a tree of the manifest paths, the manifest table referencing them
+# all, and one-to-many tables for tags and commands.
+SOURCE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ids (rowid INTEGER PRIMARY KEY, id TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS ids_pkindex ON ids (id);
+CREATE TABLE IF NOT EXISTS names (rowid INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS names_pkindex ON names (name);
+CREATE TABLE IF NOT EXISTS monikers (rowid INTEGER PRIMARY KEY, moniker TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS monikers_pkindex ON monikers (moniker);
+CREATE TABLE IF NOT EXISTS versions (rowid INTEGER PRIMARY KEY, version TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS versions_pkindex ON versions (version);
+CREATE TABLE IF NOT EXISTS channels (rowid INTEGER PRIMARY KEY, channel TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS channels_pkindex ON channels (channel);
+CREATE TABLE IF NOT EXISTS pathparts (rowid INTEGER PRIMARY KEY, parent INT64, pathpart TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS pathparts_pkindex ON pathparts (parent, pathpart);
+CREATE TABLE IF NOT EXISTS manifest (
+    rowid INTEGER PRIMARY KEY,
+    id INT64 NOT NULL,
+    name INT64 NOT NULL,
+    moniker INT64 NOT NULL,
+    version INT64 NOT NULL,
+    channel INT64 NOT NULL,
+    pathpart INT64 NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS manifest_pkindex ON manifest (id, version, channel);
+CREATE UNIQUE INDEX IF NOT EXISTS manifest_pathpart_index ON manifest (pathpart);
+CREATE INDEX IF NOT EXISTS manifest_name_index ON manifest (name);
+CREATE INDEX IF NOT EXISTS manifest_moniker_index ON manifest (moniker);
+CREATE TABLE IF NOT EXISTS tags (rowid INTEGER PRIMARY KEY, tag TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS tags_pkindex ON tags (tag);
+CREATE TABLE IF NOT EXISTS tags_map (manifest INT64 NOT NULL, tag INT64 NOT NULL, PRIMARY KEY (tag, manifest)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_map_index ON tags_map (manifest);
+CREATE TABLE IF NOT EXISTS commands (rowid INTEGER PRIMARY KEY, command TEXT NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS commands_pkindex ON commands (command);
+CREATE TABLE IF NOT EXISTS commands_map (
+    manifest INT64 NOT NULL, command INT64 NOT NULL, PRIMARY KEY (command, manifest)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS commands_map_index ON commands_map (manifest);
+"""
+
+_VALUE_TABLES = (('ids', 'id'), ('names', 'name'), ('monikers', 'moniker'), ('versions', 'version'),
+                 ('channels', 'channel'))
+_MAP_TABLES = (('tags', 'tag'), ('commands', 'command'))
+
+# Keys that describe a single manifest file rather than the package version
+_FILE_KEYS = ('ManifestType', 'ManifestVersion')
+
+def merge_manifests(documents):
+    """Merge the multi-file manifests of one package version into a single 'merged' manifest.
+
+    This is the form the winget client reads from pre-indexed sources: the
+    version, default locale and installer manifests combined at the top
+    level, with the other locales listed under Localization. A singleton
+    manifest is returned unchanged.
+
+    Args:
+        documents: Parsed manifests of the version, in any order
+
+    Returns:
+        dict: The merged manifest, or None if there is no version or singleton manifest
+    """
+    by_type = {}
+    for document in documents:
+        if isinstance(document, dict):
+            by_type.setdefault(str(document.get('ManifestType', '')).lower(), []).append(document)
+
+    if 'singleton' in by_type:
+        return by_type['singleton'][0]
+    if 'version' not in by_type:
+        return None
+
+    version_manifest = by_type['version'][0]
+    merged = {}
+    for document in by_type.get('defaultlocale', []) + [version_manifest] + by_type.get('installer', []):
+        for key, value in document.items():
+            if key not in _FILE_KEYS:
+                merged[key] = value
+
+    localizations = []
+    for document in by_type.get('locale', []):
+        localizations.append({
+            key: value for key, value in document.items()
+            if key not in _FILE_KEYS and key not in ('PackageIdentifier', 'PackageVersion')
+        })
+    if localizations:
+        merged['Localization'] = sorted(localizations, key=lambda doc: str(doc.get('PackageLocale', '')))
+
+    merged['ManifestType'] = 'merged'
+    merged['ManifestVersion'] = version_manifest.get('ManifestVersion', '1.0.0')
+    return merged
+
+class SourceIndex:
+    """winget pre-indexed source database (the index.db inside source.msix).
+
+    Manifests are added and removed one version at a time, so the database
+    can be kept between builds and updated incrementally; remove_manifest
+    leaves unused names, tags and path parts behind until prune() runs.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SOURCE_SCHEMA)
+        major, minor = SOURCE_SCHEMA_VERSION
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+            [('majorVersion', str(major)), ('minorVersion', str(minor))]
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def _value_id(self, table, column, value):
+        self.conn.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,))
+        return self.conn.execute(f"SELECT rowid FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+
+    def _path_id(self, relpath, create):
+        parent = None
+        for part in relpath.split('/'):
+            row = self.conn.execute(
+                "SELECT rowid FROM pathparts WHERE parent IS ? AND pathpart = ?", (parent, part)
+            ).fetchone()
+            if row is None:
+                if not create:
+                    return None
+                row = (self.conn.execute(
+                    "INSERT INTO pathparts (parent, pathpart) VALUES (?, ?)", (parent, part)
+                ).lastrowid,)
+            parent = row[0]
+        return parent
+
+    def add_manifest(self, manifest, relpath):
+        """Index a merged manifest served at relpath (relative to the source root)."""
+        package_id = str(manifest['PackageIdentifier'])
+        row = (
+            self._value_id('ids', 'id', package_id),
+            self._value_id('names', 'name', str(manifest.get('PackageName') or package_id)),
+            self._value_id('monikers', 'moniker', str(manifest.get('Moniker') or '')),
+            self._value_id('versions', 'version', str(manifest['PackageVersion'])),
+            self._value_id('channels', 'channel', str(manifest.get('Channel') or '')),
+            self._path_id(relpath, create=True),
+        )
+        existing = self.conn.execute(
+            "SELECT rowid FROM manifest WHERE id = ? AND version = ? AND channel = ?", (row[0], row[3], row[4])
+        ).fetchone()
+        if existing is not None:
+            self._delete_manifest(existing[0])
+        manifest_id = self.conn.execute(
+            "INSERT INTO manifest (id, name, moniker, version, channel, pathpart) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            row
+        ).lastrowid
+
+        commands = set()
+        for installer in manifest.get('Installers') or []:
+            if isinstance(installer, dict):
+                commands.update(installer.get('Commands') or [])
+        commands.update(manifest.get('Commands') or [])
+        values = {'tags': set(manifest.get('Tags') or []), 'commands': commands}
+        for table, column in _MAP_TABLES:
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO {table}_map (manifest, {column}) VALUES (?, ?)",
+                [(manifest_id, self._value_id(table, column, str(value))) for value in sorted(values[table], key=str)]
+            )
+
+    def remove_manifest(self, relpath):
+        """Drop the manifest served at relpath, if indexed."""
+        pathpart = self._path_id(relpath, create=False)
+        if pathpart is None:
+            return
+        row = self.conn.execute("SELECT rowid FROM manifest WHERE pathpart = ?", (pathpart,)).fetchone()
+        if row is not None:
+            self._delete_manifest(row[0])
+
+    def _delete_manifest(self, manifest_id):
+        for table, _ in _MAP_TABLES:
+            self.conn.execute(f"DELETE FROM {table}_map WHERE manifest = ?", (manifest_id,))
+        self.conn.execute("DELETE FROM manifest WHERE rowid = ?", (manifest_id,))
+
+    def prune(self):
+        """Delete values and path parts no longer referenced by any manifest."""
+        for table, column in _VALUE_TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT {column} FROM manifest)")
+        for table, column in _MAP_TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT {column} FROM {table}_map)")
+        # Remove leaf path parts until only ancestors of indexed manifests remain
+        while self.conn.execute(
+            "DELETE FROM pathparts WHERE rowid NOT IN (SELECT pathpart FROM manifest) "
+            "AND rowid NOT IN (SELECT parent FROM pathparts WHERE parent IS NOT NULL)"
+        ).rowcount:
+            pass
+
+    def manifest_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
+
+    def export(self, dest):
+        """Write a compacted copy of the database to dest, as shipped in source.msix."""
+        dest = Path(dest)
+        tmp_path = dest.with_name(dest.name + '.tmp')
+        tmp_path.unlink(missing_ok=True)
+        self.conn.commit()
+        self.conn.execute("VACUUM INTO ?", (str(tmp_path),))
+        os.replace(tmp_path, dest)
+
+# --- source.msix packaging -------------------------------------------------
+
+BLOCK_SIZE = 64 * 1024
+
+APPX_MANIFEST = """<?xml version="1.0" encoding="utf-8"?>
+<Package xmlns="http://schemas.microsoft.com/appx/manifest/foundation/windows10" \
+xmlns:uap="http://schemas.microsoft.com/appx/manifest/uap/windows10" IgnorableNamespaces="uap">
+  <Identity Name={name} Publisher={publisher} Version={version} ProcessorArchitecture="neutral" />
+  <Properties>
+    <DisplayName>{display_name}</DisplayName>
+    <PublisherDisplayName>{display_name}</PublisherDisplayName>
+    <Logo>Assets\\StoreLogo.png</Logo>
+  </Properties>
+  <Resources>
+    <Resource Language="en-us" />
+  </Resources>
+  <Dependencies>
+    <TargetDeviceFamily Name="Windows.Universal" MinVersion="10.0.0.0" MaxVersionTested="10.0.0.0" />
+  </Dependencies>
+</Package>
+"""
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="db" ContentType="application/octet-stream"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Override PartName="/AppxManifest.xml" ContentType="application/vnd.ms-appx.manifest+xml"/>'
+    '<Override PartName="/AppxBlockMap.xml" ContentType="application/vnd.ms-appx.blockmap+xml"/>'
+    '</Types>'
+)
+
+def store_logo():
+    """Return a 1x1 transparent PNG for the Logo the package manifest has to name."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00\x00\x00\x00\x00'))
+            + chunk(b'IEND', b''))
+
+def package_version(now=None):
+    """Return a four-part package version that increases with time, as clients only take newer packages."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return f"{now.year - 2000}.{now.month * 100 + now.day}.{now.hour * 100 + now.minute}.{now.second}"
+
+def _compress_blocks(data):
+    """Deflate data in independently flushed 64 KiB blocks, as the block map requires.
+
+    Returns:
+        tuple: (compressed bytes, [(block sha256, compressed block size), ...])
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    chunks = []
+    blocks = []
+    for start in range(0, max(len(data), 1), BLOCK_SIZE):
+        block = data[start:start + BLOCK_SIZE]
+        last = start + BLOCK_SIZE >= len(data)
+        out = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+        chunks.append(out)
+        blocks.append((hashlib.sha256(block).digest(), len(out)))
+    return b''.join(chunks), blocks
+
+def _dos_time(timestamp):
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def write_msix(msix_path, files, identity_name, publisher, display_name, version=None):
+    """Write an unsigned MSIX package containing files.
+
+    The payload is deflated in 64 KiB blocks and described by
+    AppxBlockMap.xml, like packages produced by MakeAppx; the package is
+    not signed.
+
+    Args:
+        msix_path: Package to write
+        files: List of (package path with '/' separators, bytes); should
+            include 'Assets/StoreLogo.png' (see store_logo)
+        identity_name: Identity Name in AppxManifest.xml
+        publisher: Identity Publisher (a distinguished name such as 'CN=...')
+        display_name: DisplayName and PublisherDisplayName
+        version: Package version; defaults to package_version()
+    """
+    manifest = APPX_MANIFEST.format(
+        name=quoteattr(identity_name), publisher=quoteattr(publisher),
+        version=quoteattr(version or package_version()), display_name=escape(display_name),
+    ).encode('utf-8')
+
+    entries = []
+    block_map = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+        '<BlockMap xmlns="http://schemas.microsoft.com/appx/2010/blockmap" '
+        'HashMethod="http://www.w3.org/2001/04/xmlenc#sha256">',
+    ]
+    for name, data in list(files) + [('AppxManifest.xml', manifest)]:
+        compressed, blocks = _compress_blocks(data)
+        entries.append((name, data, compressed))
+        block_map.append(
+            f'<File Name={quoteattr(name.replace("/", chr(92)))} Size="{len(data)}" '
+            f'LfhSize="{30 + len(name.encode("utf-8"))}">'
+        )
+        block_map.extend(
+            f'<Block Hash="{base64.b64encode(digest).decode()}" Size="{size}"/>' for digest, size in blocks
+        )
+        block_map.append('</File>')
+    block_map.append('</BlockMap>')
+
+    for name, data in (('AppxBlockMap.xml', '\r\n'.join(block_map).encode('utf-8')),
+                       ('[Content_Types].xml', CONTENT_TYPES.encode('utf-8'))):
+        entries.append((name, data, zlib.compress(data, 9)[2:-4]))
+
+    dos_time, dos_date = _dos_time(time.time())
+    msix_path = Path(msix_path)
+    tmp_path = msix_path.with_name(msix_path.name + '.tmp')
+    central = []
+    with open(tmp_path, 'wb') as f:
+        for name, data, compressed in entries:
+            encoded = name.encode('utf-8')
+            crc = zlib.crc32(data)
+            offset = f.tell()
+            f.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0, 8, dos_time, dos_date,
+                                crc, len(compressed), len(data), len(encoded), 0))
+            f.write(encoded)
+            f.write(compressed)
+            central.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0, 8, dos_time, dos_date,
+                                       crc, len(compressed), len(data), len(encoded), 0, 0, 0, 0, 0, offset)
+                           + encoded)
+        directory_offset = f.tell()
+        for record in central:
+            f.write(record)
+        directory_size = f.tell() - directory_offset
+        f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(central), len(central),
+                            directory_size, directory_offset, 0))
+    tmp_path.replace(msix_path)
+
+# --- Incremental build -----------------------------------------------------
+
+SOURCE_STATE_FILE = '.source-state.json'
+SOURCE_DB_FILE = '.source-index.db'
+SOURCE_BUILDER_VERSION = 2
+"""Bumped whenever the merged manifests or index.db change format, forcing a full rebuild."""
+
+def _merged_manifest_path(pub, pkg, version, package_id, digest):
+    # The content hash in the path keeps a client that still has the previous
+    # index.db from fetching a newer manifest under the old path
+    return f'manifests/{pub[0].lower()}/{pub}/{pkg}/{version}/{digest[:8]}/{package_id}.yaml'
+
+def _remove_served_file(source_path, relpath):
+    """Delete a merged manifest and the directories it leaves empty."""
+    path = source_path / relpath
+    path.unlink(missing_ok=True)
+    remove_precompressed(path)
+    parent = path.parent
+    manifests_root = source_path / 'manifests'
+    while parent != manifests_root and parent.is_dir() and not any(parent.iterdir()):
+        parent.rmdir()
+        parent = parent.parent
+
+def build_source(patch_path, source_path, patched_versions, identity_name, publisher, display_name,
+                 precompress=()):
+    """Build or update a winget pre-indexed source from patched manifests.
+
+    For every version in patched_versions (the 'versions' map of
+    patch_repo's .patch-state.json), the patched manifests are merged into
+    one manifest under source_path/manifests and indexed in index.db, which
+    is then packaged as source_path/source.msix. Versions whose patch
+    fingerprint is unchanged since the previous build are left alone, and
+    the package is only rewritten when something changed. The merged
+    manifests and index.db get precompressed siblings for each suffix in
+    precompress ('.gz', '.br'); source.msix is already compressed.
+
+    Returns:
+        dict: Counts of 'added', 'unchanged', 'removed' and 'failed' versions,
+        and 'packaged' (True if source.msix was rewritten).
+    """
+    patch_path = Path(patch_path)
+    source_path = Path(source_path)
+    source_path.mkdir(parents=True, exist_ok=True)
+    state_path = source_path / SOURCE_STATE_FILE
+    db_path = source_path / SOURCE_DB_FILE
+    msix_path = source_path / 'source.msix'
+
+    previous = None
+    if state_path.exists() and db_path.exists():
+        with open(state_path) as f:
+            saved = json.load(f)
+        if saved.get('builder_version') == SOURCE_BUILDER_VERSION:
+            previous = saved.get('versions', {})
+    if previous is None:
+        # Start over: nothing on disk is known to match the database
+        db_path.unlink(missing_ok=True)
+        shutil.rmtree(source_path / 'manifests', ignore_errors=True)
+        previous = {}
+
+    counts = {'added': 0, 'unchanged': 0, 'removed': 0, 'failed': 0, 'packaged': False}
+    built = {}
+    index = SourceIndex(db_path)
+    try:
+        with index.conn:
+            for package_id, versions in patched_versions.items():
+                pub, pkg = package_id.split('.', 1)
+                for version, entry in versions.items():
+                    last = previous.get(package_id, {}).get(version)
+                    if (last and last['fingerprint'] == entry['fingerprint']
+                            and (source_path / last['path']).is_file()
+                            and precompressed_current(source_path / last['path'], precompress)):
+                        built.setdefault(package_id, {})[version] = last
+                        counts['unchanged'] += 1
+                        continue
+
+                    if last:
+                        index.remove_manifest(last['path'])
+                        _remove_served_file(source_path, last['path'])
+
+                    version_dir = patch_path / 'manifests' / pub[0].lower() / pub / pkg / version
+                    try:
+                        documents = [load_manifest((version_dir / name).read_bytes()) for name in entry['files']]
+                        merged = merge_manifests(documents)
+                        if merged is None:
+                            raise ValueError("no version or singleton manifest")
+                        # An unquoted 'PackageVersion: 1.10' loads as the float 1.1;
+                        # the directory names keep the strings as published
+                        merged['PackageIdentifier'] = package_id
+                        merged['PackageVersion'] = version
+                        data = dump_manifest(merged).encode('utf-8')
+                        relpath = _merged_manifest_path(pub, pkg, version, package_id,
+                                                        hashlib.sha256(data).hexdigest())
+                        index.add_manifest(merged, relpath)
+                    except (YAMLError, OSError, KeyError, TypeError, ValueError) as e:
+                        print(f"Warning: Could not add {package_id} {version} to the source: {e}")
+                        counts['failed'] += 1
+                        continue
+
+                    target = source_path / relpath
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = target.with_name(target.name + '.tmp')
+                    tmp_path.write_bytes(data)
+                    os.replace(tmp_path, target)
+                    write_precompressed(target, data, precompress)
+                    built.setdefault(package_id, {})[version] = {
+                        'fingerprint': entry['fingerprint'],
+                        'path': relpath,
+                    }
+                    counts['added'] += 1
+
+            for package_id, versions in previous.items():
+                for version, last in versions.items():
+                    if version not in built.get(package_id, {}) and version not in patched_versions.get(package_id, {}):
+                        index.remove_manifest(last['path'])
+                        _remove_served_file(source_path, last['path'])
+                        counts['removed'] += 1
+            index.prune()
+
+        export_path = source_path / 'index.db'
+        if (counts['added'] or counts['removed'] or counts['failed'] or not msix_path.exists()
+                or not precompressed_current(export_path, precompress)):
+            index.export(export_path)
+            write_precompressed(export_path, export_path.read_bytes(), precompress)
+            write_msix(
+                msix_path,
+                [('Public/index.db', export_path.read_bytes()), ('Assets/StoreLogo.png', store_logo())],
+                identity_name, publisher, display_name,
+            )
+            counts['packaged'] = True
+    finally:
+        index.close()
+
+    tmp_path = state_path.with_name(state_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'builder_version': SOURCE_BUILDER_VERSION, 'versions': built}, f, indent=1)
+    os.replace(tmp_path, state_path)
+    return counts
@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True)
+
+class JsonStateStore:
+    """State kept as a single JSON document in state.json.
+
+    Every save rewrites the whole file, through a temporary file that is
+    atomically renamed over state.json so a crash never leaves it truncated.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = Path(state_path)
+
+    def load(self, bootstrap):
+        """Return the state; for this store the bootstrap state.json is the state."""
+        if bootstrap.get('state_backend') == 'sqlite':
+            raise ValueError(
+                f"State in {self.state_path} was migrated to state.db. Set \"state_backend\": \"sqlite\" in config.json."
+            )
+        return bootstrap
+
+    def save(self, state, package_ids=None):
+        tmp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def close(self):
+        pass
+
+class SqliteStateStore:
+    """State kept in a SQLite database (WAL mode) with one row per package version.
+
+    The in-memory state keeps the state.json shape
+    (downloads -> package -> versions -> version -> files/pinned/timestamp/git_rev).
+    Top-level keys other than 'downloads' are stored in 'meta', package-level
+    fields other than 'versions' in 'packages', and each version in
+    'versions'. save() compares rows against what was last loaded or saved and
+    writes only the ones that changed, in a single transaction.
+
+    On first use the existing state.json is imported and replaced by a small
+    stub that only records 'path' and 'state_backend'; the original is kept as
+    state.json.bak.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS packages (
+        package_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS versions (
+        package_id TEXT NOT NULL,
+        version TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (package_id, version)
+    );
+    """
+
+    def __init__(self, db_path, state_path):
+        self.db_path = Path(db_path)
+        self.state_path = Path(state_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._saved = {}
+
+    def load(self, bootstrap):
+        """Return the state, importing bootstrap (the parsed state.json) on first use."""
+        migrated = self.conn.execute("SELECT 1 FROM meta WHERE key = 'path'").fetchone()
+        if not migrated:
+            self._migrate(bootstrap)
+
+        self._saved = {}
+        state = {}
+        for key, value in self.conn.execute("SELECT key, value FROM meta"):
+            state[key] = json.loads(value)
+            self._saved[('meta', key)] = value
+
+        downloads = state['downloads'] = {}
+        for package_id, data in self.conn.execute("SELECT package_id, data FROM packages"):
+            package_info = json.loads(data)
+            package_info['versions'] = {}
+            downloads[package_id] = package_info
+            self._saved[('package', package_id)] = data
+        for package_id, version, data in self.conn.execute("SELECT package_id, version, data FROM versions"):
+            downloads.setdefault(package_id, {'versions': {}})['versions'][version] = json.loads(data)
+            self._saved[('version', package_id, version)] = data
+        return state
+
+    def _migrate(self, bootstrap):
+        backup_path = self.state_path.with_name(self.state_path.name + '.bak')
+        if bootstrap.get('state_backend') == 'sqlite':
+            # state.json is already a stub; the database was removed, so restore from the backup
+            if not backup_path.exists():
+                raise ValueError(f"{self.db_path} is missing and there is no {backup_path} to restore it from")
+            with open(backup_path) as f:
+                bootstrap = json.load(f)
+
+        print(f"Migrating {self.state_path} to {self.db_path}...")
+        state = {k: v for k, v in bootstrap.items() if k != 'state_backend'}
+        self.save(state)
+
+        if not backup_path.exists():
+            shutil.copyfile(self.state_path, backup_path)
+        stub = {'path': state['path'], 'state_backend': 'sqlite'}
+        tmp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(stub, f, indent=4)
+        os.replace(tmp_path, self.state_path)
+        print(f"Migrated {len(state.get('downloads', {}))} packages; previous state kept in {backup_path}")
+
+    def _rows(self, state, package_ids):
+        """Return {row_key: serialized data} for the meta rows and the rows of package_ids (None = all)."""
+        rows = {}
+        for key, value in state.items():
+            if key != 'downloads':
+                rows[('meta', key)] = _dumps(value)
+
+        downloads = state.get('downloads', {})
+        for package_id in downloads if package_ids is None else package_ids:
+            package_info = downloads.get(package_id)
+            if package_info is None:
+                continue
+            rows[('package', package_id)] = _dumps({k: v for k, v in package_info.items() if k != 'versions'})
+            for version, vdata in package_info.get('versions', {}).items():
+                rows[('version', package_id, version)] = _dumps(vdata)
+        return rows
+
+    def save(self, state, package_ids=None):
+        """Write rows that changed since the last load/save.
+
+        If package_ids is given, only those packages (and the top-level keys)
+        are compared, so the cost is proportional to the change.
+        """
+        scope = None if package_ids is None else set(package_ids)
+        rows = self._rows(state, scope)
+
+        def in_scope(row_key):
+            return row_key[0] == 'meta' or scope is None or row_key[1] in scope
+
+        removed = [row_key for row_key in self._saved if in_scope(row_key) and row_key not in rows]
+        changed = {row_key: data for row_key, data in rows.items() if self._saved.get(row_key) != data}
+        if not removed and not changed:
+            return
+
+        with self.conn:
+            for row_key in removed:
+                if row_key[0] == 'meta':
+                    self.conn.execute("DELETE FROM meta WHERE key = ?", row_key[1:])
+                elif row_key[0] == 'package':
+                    self.conn.execute("DELETE FROM packages WHERE package_id = ?", row_key[1:])
+                else:
+                    self.conn.execute("DELETE FROM versions WHERE package_id = ? AND version = ?", row_key[1:])
+            for row_key, data in changed.items():
+                if row_key[0] == 'meta':
+                    self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (*row_key[1:], data))
+                elif row_key[0] == 'package':
+                    self.conn.execute("INSERT OR REPLACE INTO packages VALUES (?, ?)", (*row_key[1:], data))
+                else:
+                    self.conn.execute("INSERT OR REPLACE INTO versions VALUES (?, ?, ?)", (*row_key[1:], data))
+
+        for row_key in removed:
+            del self._saved[row_key]
+        self._saved.update(changed)
+
+    def close(self):
+        self.conn.close()
+
+def open_state_store(config, path, state_path):
+    """Return the state store selected by config['state_backend'] ("json" or "sqlite")."""
+    backend = config.get('state_backend', 'json')
+    if backend == 'sqlite':
+        return SqliteStateStore(Path(path) / 'state.db', state_path)
+    if backend == 'json':
+        return JsonStateStore(state_path)
+    raise ValueError(f"Unknown state_backend: {backend}")
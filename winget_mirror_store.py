@@ -0,0 +1,200 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+class ObjectStore:
+    """Content-addressed store of installers, keyed by SHA256.
+
+    Each installer is kept once as 'objects/<first two hex digits>/<rest>'.
+    The per-version paths under downloads/ that patched manifests and nginx
+    point at are links into the store: hardlinks when possible, falling back
+    to symlinks and finally to plain copies (e.g. across filesystems), so
+    identical installers published under several versions or packages are
+    stored only once.
+    """
+
+    def __init__(self, root, link_mode='hardlink'):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Unknown store link mode: {link_mode}")
+        self.root = Path(root)
+        self.link_mode = link_mode
+
+    def path_for(self, sha256):
+        sha256 = sha256.lower()
+        return self.root / sha256[:2] / sha256[2:]
+
+    def contains(self, sha256):
+        return self.path_for(sha256).is_file()
+
+    def _tmp_path(self, path):
+        return path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+    def add(self, filepath, sha256):
+        """Take a downloaded file into the store and replace it with a link to the stored object.
+
+        If an object with the same hash is already stored, filepath is
+        replaced by a link to it and its own bytes are dropped.
+        """
+        filepath = Path(filepath)
+        obj = self.path_for(sha256)
+        if not obj.is_file():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._tmp_path(obj)
+            if self.link_mode == 'copy':
+                shutil.copyfile(filepath, tmp)
+            else:
+                try:
+                    os.link(filepath, tmp)
+                except OSError:
+                    shutil.copyfile(filepath, tmp)
+            os.replace(tmp, obj)
+
+        if self.link_mode == 'symlink':
+            linked = filepath.is_symlink()
+        elif self.link_mode == 'hardlink':
+            linked = self._same_file(filepath, obj)
+        else:
+            linked = True
+        if not linked:
+            self.link(sha256, filepath)
+
+    def link(self, sha256, dest):
+        """Make dest a link to the stored object, trying the configured link mode first.
+
+        Returns:
+            str: The link mode used ('hardlink', 'symlink' or 'copy').
+        """
+        dest = Path(dest)
+        obj = self.path_for(sha256)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_path(dest)
+        for mode in LINK_MODES[LINK_MODES.index(self.link_mode):]:
+            try:
+                if mode == 'hardlink':
+                    os.link(obj, tmp)
+                elif mode == 'symlink':
+                    os.symlink(os.path.relpath(obj, dest.parent), tmp)
+                else:
+                    shutil.copyfile(obj, tmp)
+            except OSError:
+                tmp.unlink(missing_ok=True)
+                continue
+            os.replace(tmp, dest)
+            return mode
+        raise OSError(f"Could not link {dest} to {obj}")
+
+    @staticmethod
+    def _same_file(a, b):
+        try:
+            return os.path.samefile(a, b)
+        except OSError:
+            return False
+
+    def objects(self):
+        """Yield (sha256, path) for every stored object."""
+        if not self.root.is_dir():
+            return
+        for prefix in self.root.iterdir():
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for obj in prefix.iterdir():
+                if obj.is_file() and not obj.name.endswith('.tmp'):
+                    yield prefix.name + obj.name, obj
+
+    def collect_garbage(self, referenced):
+        """Delete stored objects that are neither in referenced nor hardlinked from anywhere.
+
+        Args:
+            referenced: Set of SHA256 hex digests still recorded in state
+
+        Returns:
+            tuple: (number of objects removed, bytes freed)
+        """
+        removed = 0
+        freed = 0
+        for sha256, obj in list(self.objects()):
+            st = obj.stat()
+            if sha256 in referenced or st.st_nlink > 1:
+                continue
+            obj.unlink()
+            removed += 1
+            freed += st.st_size
+        return removed, freed
+
+class InstallerLookup:
+    """Global SHA256 -> local file lookup over the whole mirror.
+
+    Consults the object store first, then every installer recorded in
+    state['downloads'] (so mirrors with the store disabled, or files
+    downloaded before it existed, are covered too). Used before a download
+    so that an installer already present anywhere in the mirror is linked
+    or copied into place instead of fetched again.
+    """
+
+    def __init__(self, downloads_dir, downloads, store=None):
+        self.downloads_dir = Path(downloads_dir)
+        self.downloads = downloads
+        self.store = store
+        self._paths = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._paths is None:
+            paths = {}
+            for package_id, package_info in self.downloads.items():
+                pub, pkg = package_id.split('.', 1)
+                for version, vdata in package_info.get('versions', {}).items():
+                    for filename, sha256 in vdata.get('files', {}).items():
+                        paths.setdefault(sha256.lower(), []).append(
+                            self.downloads_dir / pub / pkg / version / filename
+                        )
+            self._paths = paths
+        return self._paths
+
+    def record(self, sha256, path):
+        """Register a file that was just downloaded."""
+        with self._lock:
+            self._load().setdefault(sha256.lower(), []).append(Path(path))
+
+    def find(self, sha256):
+        """Return a local file with the given SHA256, or None."""
+        sha256 = sha256.lower()
+        if self.store is not None and self.store.contains(sha256):
+            return self.store.path_for(sha256)
+        with self._lock:
+            candidates = list(self._load().get(sha256, []))
+        for path in candidates:
+            if path.is_file():
+                return path
+        return None
+
+    def materialize(self, sha256, dest):
+        """Place a local copy of the installer with the given SHA256 at dest.
+
+        Returns:
+            str: How it was placed ('hardlink', 'symlink' or 'copy'), or None
+            if no local file has that hash.
+        """
+        source = self.find(sha256)
+        if source is None:
+            return None
+        dest = Path(dest)
+        if self.store is not None:
+            if not self.store.contains(sha256):
+                self.store.add(source, sha256)
+            mode = self.store.link(sha256, dest)
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(f'{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            try:
+                os.link(source, tmp)
+                mode = 'hardlink'
+            except OSError:
+                shutil.copyfile(source, tmp)
+                mode = 'copy'
+            os.replace(tmp, dest)
+        self.record(sha256, dest)
+        return mode
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import subprocess
+import threading
+from pathlib import Path
+
+class WorkingTree:
+    """Manifests read from a checked out 'manifests' directory.
+
+    All lookups use the '<letter>/<publisher>/<package>/<version>/<file>.yaml'
+    layout of the winget-pkgs repository.
+    """
+
+    def __init__(self, manifests_dir):
+        self.manifests_dir = Path(manifests_dir)
+
+    def _package_path(self, pub, pkg):
+        return self.manifests_dir / pub[0].lower() / pub / pkg
+
+    def publishers(self, prefix):
+        """Return publishers whose name starts with prefix (case-insensitive)."""
+        letter_dir = self.manifests_dir / prefix[0].lower()
+        if not letter_dir.is_dir():
+            return []
+        return sorted(
+            p.name for p in letter_dir.iterdir()
+            if p.is_dir() and p.name.lower().startswith(prefix.lower())
+        )
+
+    def packages(self, pub):
+        """Return the package names of publisher pub."""
+        publisher_path = self.manifests_dir / pub[0].lower() / pub
+        if not publisher_path.is_dir():
+            return []
+        return sorted(p.name for p in publisher_path.iterdir() if p.is_dir())
+
+    def versions(self, pub, pkg):
+        """Return the version names of a package, or None if the package does not exist."""
+        package_path = self._package_path(pub, pkg)
+        if not package_path.is_dir():
+            return None
+        return [p.name for p in package_path.iterdir() if p.is_dir()]
+
+    def files(self, pub, pkg, version):
+        """Return the manifest file names of a package version, or None if the version does not exist."""
+        version_path = self._package_path(pub, pkg) / version
+        if not version_path.is_dir():
+            return None
+        return sorted(p.name for p in version_path.glob('*.yaml'))
+
+    def read(self, pub, pkg, version, filename):
+        """Return the bytes of one manifest file, or None if it does not exist."""
+        try:
+            return (self._package_path(pub, pkg) / version / filename).read_bytes()
+        except OSError:
+            return None
+
+    def file_id(self, pub, pkg, version, filename):
+        """Return an identifier that changes whenever the file's content changes (its SHA256), or None."""
+        data = self.read(pub, pkg, version, filename)
+        return None if data is None else hashlib.sha256(data).hexdigest()
+
+    def walk(self):
+        """Yield (publisher, package, version_names) for every package with at least one version."""
+        if not self.manifests_dir.is_dir():
+            return
+        for letter in self.manifests_dir.iterdir():
+            if not letter.is_dir():
+                continue
+            for pub in letter.iterdir():
+                if not pub.is_dir():
+                    continue
+                for pkg in pub.iterdir():
+                    if not pkg.is_dir():
+                        continue
+                    versions = [v.name for v in pkg.iterdir() if v.is_dir()]
+                    if versions:
+                        yield pub.name, pkg.name, versions
+
+    def prefetch(self, keys=None):
+        """Nothing to do: every file is already on disk."""
+
+    def close(self):
+        pass
+
+class GitObjectTree:
+    """Manifests read straight from the git object database at a revision, without a checkout.
+
+    The tree of rev is listed once with 'git ls-tree' and blobs are read
+    through a persistent 'git cat-file --batch' process. In a partial clone
+    (--filter=blob:none) missing blobs are fetched from the promisor remote in
+    batches by prefetch() rather than one round trip per file. Trees that
+    were already prefetched are remembered, so reads after a prefetch start
+    no further git processes.
+    """
+
+    FETCH_BATCH = 5000
+
+    def __init__(self, repo_path, rev='HEAD', remote='origin'):
+        self.repo_path = Path(repo_path)
+        self.rev = rev
+        self.remote = remote
+        self._packages = None
+        self._load_lock = threading.Lock()
+        self._cat_lock = threading.Lock()
+        self._cat_file = None
+        self._prefetch_lock = threading.Lock()
+        self._prefetched = set()
+        self._prefetched_all = False
+
+    def _git(self, *args, input=None):
+        result = subprocess.run(
+            ['git', '-C', str(self.repo_path), *args],
+            input=input, capture_output=True, check=True
+        )
+        return result.stdout
+
+    def _load(self):
+        """Return {(publisher, package): {version: [tree_oid, {filename: blob_oid}]}} for rev."""
+        with self._load_lock:
+            if self._packages is not None:
+                return self._packages
+            packages = {}
+            output = self._git('ls-tree', '-r', '-t', '-z', self.rev, '--', 'manifests/')
+            for entry in output.split(b'\0'):
+                if not entry:
+                    continue
+                info, path = entry.split(b'\t', 1)
+                _, object_type, oid = info.decode().split()
+                parts = path.decode('utf-8', 'surrogateescape').split('/')
+                # manifests/<letter>/<publisher>/<package>/<version>/<file>
+                if len(parts) == 4 and object_type == 'tree':
+                    packages.setdefault((parts[2], parts[3]), {})
+                elif len(parts) == 5 and object_type == 'tree':
+                    versions = packages.setdefault((parts[2], parts[3]), {})
+                    versions.setdefault(parts[4], [None, {}])[0] = oid
+                elif len(parts) == 6 and object_type == 'blob' and parts[5].endswith('.yaml'):
+                    versions = packages.setdefault((parts[2], parts[3]), {})
+                    versions.setdefault(parts[4], [None, {}])[1][parts[5]] = oid
+            self._packages = packages
+            return packages
+
+    def publishers(self, prefix):
+        """Return publishers whose name starts with prefix (case-insensitive)."""
+        prefix = prefix.lower()
+        return sorted({pub for pub, _ in self._load() if pub.lower().startswith(prefix)})
+
+    def packages(self, pub):
+        """Return the package names of publisher pub."""
+        return sorted(pkg for p, pkg in self._load() if p == pub)
+
+    def versions(self, pub, pkg):
+        """Return the version names of a package, or None if the package does not exist."""
+        versions = self._load().get((pub, pkg))
+        return None if versions is None else list(versions)
+
+    def files(self, pub, pkg, version):
+        """Return the manifest file names of a package version, or None if the version does not exist."""
+        entry = self._load().get((pub, pkg), {}).get(version)
+        return None if entry is None else sorted(entry[1])
+
+    def blob_id(self, pub, pkg, version, filename):
+        entry = self._load().get((pub, pkg), {}).get(version)
+        return entry[1].get(filename) if entry else None
+
+    def file_id(self, pub, pkg, version, filename):
+        """Return an identifier that changes whenever the file's content changes (its blob id), or None.
+
+        Unlike read(), this never fetches anything.
+        """
+        return self.blob_id(pub, pkg, version, filename)
+
+    def read(self, pub, pkg, version, filename):
+        """Return the bytes of one manifest file, or None if it does not exist."""
+        oid = self.blob_id(pub, pkg, version, filename)
+        if oid is None:
+            return None
+        data = self._read_blob(oid)
+        if data is None:
+            # Not in the partial clone yet: fetch the whole version in one round trip
+            self.prefetch([(pub, pkg, version)])
+            data = self._read_blob(oid)
+        return data
+
+    def walk(self):
+        """Yield (publisher, package, version_names) for every package with at least one version."""
+        for (pub, pkg), versions in self._load().items():
+            if versions:
+                yield pub, pkg, list(versions)
+
+    def prefetch(self, keys=None):
+        """Fetch the blobs of the given (publisher, package, version) keys that are not present locally.
+
+        With keys=None the whole manifests tree is prefetched. Versions
+        prefetched before are skipped without starting git.
+        """
+        with self._prefetch_lock:
+            if self._prefetched_all:
+                return
+            if keys is None:
+                roots = [f'{self.rev}:manifests']
+            else:
+                packages = self._load()
+                roots = []
+                for pub, pkg, version in keys:
+                    entry = packages.get((pub, pkg), {}).get(version)
+                    if entry and entry[0] and entry[0] not in self._prefetched:
+                        roots.append(entry[0])
+        if not roots:
+            return
+
+        # Trees are always present in a blobless clone; list the blobs they reference that are not.
+        output = self._git('rev-list', '--objects', '--missing=print', '--stdin',
+                           input='\n'.join(roots).encode())
+        missing = [line[1:] for line in output.decode().splitlines() if line.startswith('?')]
+        for i in range(0, len(missing), self.FETCH_BATCH):
+            batch = missing[i:i + self.FETCH_BATCH]
+            self._git('-c', 'fetch.negotiationAlgorithm=noop', 'fetch', self.remote,
+                      '--no-tags', '--no-write-fetch-head', '--recurse-submodules=no',
+                      '--filter=blob:none', '--stdin', input='\n'.join(batch).encode())
+
+        with self._prefetch_lock:
+            if keys is None:
+                self._prefetched_all = True
+            else:
+                self._prefetched.update(roots)
+
+    def _read_blob(self, oid):
+        with self._cat_lock:
+            if self._cat_file is None:
+                # Report missing blobs instead of fetching them one at a time
+                # (git 2.44+; older versions still fetch lazily)
+                self._cat_file = subprocess.Popen(
+                    ['git', '-C', str(self.repo_path), 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    env={**os.environ, 'GIT_NO_LAZY_FETCH': '1'}
+                )
+            proc = self._cat_file
+            proc.stdin.write(oid.encode() + b'\n')
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) < 3 or header[1] == b'missing':
+                return None
+            data = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # trailing newline
+            return data
+
+    def close(self):
+        with self._cat_lock:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None